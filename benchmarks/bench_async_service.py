@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Measures refreshing the access tokens of many users against a local stub OP
+that takes a while to answer. The token responses contain signed ID Tokens
+that are verified.
+
+Compares, in requests per second:
+
+- one request at a time using Service.service_request
+- concurrent requests on one event loop using Service.aservice_request,
+  with a number of requests per host allowed at the same time
+- the same with the ID Token verification done in a thread pool
+
+Usage::
+
+    python benchmarks/bench_async_service.py [number of users] [OP latency ms]
+"""
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oidc import AccessTokenResponse
+
+from oidcservice.async_transport import ExecutorTransport
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import State
+from oidcservice.transport import RequestsTransport
+
+CLIENT_ID = 'client_id'
+KEYSPEC = [{"type": "RSA", "use": ["sig"]}]
+
+
+class StubOP:
+    """
+    An OP, written in the style of an aiohttp application, that answers
+    refresh token requests after *latency* seconds. Runs its own event loop
+    in a thread. Connections are kept alive.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.keyjar = build_keyjar(KEYSPEC)
+        self.issuer = ''
+        self._token_response = None
+        self._loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        _server = self._loop.run_until_complete(
+            asyncio.start_server(self._connection, '127.0.0.1', 0))
+        _port = _server.sockets[0].getsockname()[1]
+        self.issuer = 'http://127.0.0.1:{}'.format(_port)
+        self._started.set()
+        self._loop.run_forever()
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    async def _connection(self, reader, writer):
+        try:
+            while True:
+                _line = await reader.readline()
+                if not _line:
+                    break
+                _headers = {}
+                while True:
+                    _header = await reader.readline()
+                    if _header in (b'\r\n', b'\n', b''):
+                        break
+                    _name, _value = _header.decode().split(':', 1)
+                    _headers[_name.strip().lower()] = _value.strip()
+                await reader.readexactly(int(_headers.get('content-length',
+                                                          0)))
+                _status, _body = await self.token()
+                writer.write(
+                    'HTTP/1.1 {}\r\nContent-Type: application/json\r\n'
+                    'Content-Length: {}\r\n\r\n'.format(
+                        _status, len(_body)).encode() + _body)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def token(self):
+        await asyncio.sleep(self.latency)
+        if self._token_response is None:
+            # Signed once, so that the OP does not use the CPU the client
+            # needs to verify it
+            _jwt = JWT(key_jar=self.keyjar, iss=self.issuer,
+                       sign_alg='RS256', lifetime=3600)
+            _id_token = _jwt.pack(payload={'sub': 'diana'}, recv=CLIENT_ID)
+            self._token_response = AccessTokenResponse(
+                access_token='access_token', refresh_token='refresh_token',
+                token_type='Bearer', expires_in=3600,
+                id_token=_id_token).to_json().encode()
+        return '200 OK', self._token_response
+
+
+def refresh_service(op, users):
+    _context = ServiceContext(config={
+        'client_id': CLIENT_ID, 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': op.issuer})
+    _context.keyjar.import_jwks(op.keyjar.export_jwks(), op.issuer)
+    _db = InMemoryStateDataBase()
+    _service = service_factory('RefreshAccessToken', ['oidc'], state_db=_db,
+                               service_context=_context)
+    _service.endpoint = op.issuer + '/token'
+
+    _keys = ['user{}'.format(n) for n in range(users)]
+    _token_response = AccessTokenResponse(access_token='access_token',
+                                          refresh_token='refresh_token',
+                                          token_type='Bearer')
+    for key in _keys:
+        _db.set(key, State(
+            iss=op.issuer, token_response=_token_response.to_json()).to_json())
+    return _service, _keys
+
+
+def one_at_a_time(service, keys):
+    for key in keys:
+        service.service_request(state=key)
+
+
+async def concurrently(service, keys, executor=None):
+    return await asyncio.gather(*[
+        service.aservice_request(state=key, executor=executor)
+        for key in keys])
+
+
+def measure(func, users):
+    _then = time.perf_counter()
+    func()
+    return users / (time.perf_counter() - _then)
+
+
+def main(users=200, latency=20):
+    _op = StubOP(latency / 1000).start()
+    _service, _keys = refresh_service(_op, users)
+    _transport = RequestsTransport(pool_maxsize=100)
+    _service.transport = _transport
+
+    print('{:<36}{:>12}'.format('', 'requests/s'))
+    print('{:<36}{:>12.0f}'.format(
+        'one at a time',
+        measure(lambda: one_at_a_time(_service, _keys), users)))
+
+    with ThreadPoolExecutor(100) as threads, ThreadPoolExecutor(4) as cpu:
+        for per_host in [10, 50, 100]:
+            _async = ExecutorTransport(_transport, executor=threads,
+                                       max_per_host=per_host)
+            _service.transport = _async
+            for name, executor in [('', None), (', verify in pool', cpu)]:
+                _rate = measure(
+                    lambda: asyncio.run(
+                        concurrently(_service, _keys, executor)), users)
+                print('{:<36}{:>12.0f}'.format(
+                    'asyncio, {} per host{}'.format(per_host, name), _rate))
+
+    _item = _service.get_item(AccessTokenResponse, 'token_response', _keys[-1])
+    assert _item['__verified_id_token']['sub'] == 'diana'
+    _transport.close()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
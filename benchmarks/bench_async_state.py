@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Compares running a number of concurrent logins on an event loop, using the
+asyncio versions of the state interface methods, with running every state
+operation in a thread, using the default executor. The state database
+has a simulated network latency.
+
+Usage::
+
+    python benchmarks/bench_async_state.py [latency in ms]
+"""
+import asyncio
+import sys
+import time
+
+from bench_state_db import AUTH_REQUEST
+from bench_state_db import AUTH_RESPONSE
+from bench_state_db import ISS
+from bench_state_db import TOKEN_RESPONSE
+from bench_state_db import USER_INFO
+from oidcmsg.oidc import AuthorizationRequest
+from oidcmsg.oidc import AuthorizationResponse
+
+from oidcservice.state_interface import StateInterface
+
+ITEM_TYPES = ['auth_response', 'token_response', 'refresh_token_response']
+
+
+class AsyncDataBase:
+    def __init__(self, latency):
+        self.latency = latency
+        self._db = {}
+
+    async def aget_many(self, keys):
+        await asyncio.sleep(self.latency)
+        return [self._db.get(key) for key in keys]
+
+    async def aget(self, key):
+        await asyncio.sleep(self.latency)
+        return self._db.get(key)
+
+    async def aset(self, key, value):
+        await asyncio.sleep(self.latency)
+        self._db[key] = value
+
+    async def adelete(self, key):
+        await asyncio.sleep(self.latency)
+        self._db.pop(key, None)
+
+
+class BlockingDataBase:
+    def __init__(self, latency):
+        self.latency = latency
+        self._db = {}
+
+    def get_many(self, keys):
+        time.sleep(self.latency)
+        return [self._db.get(key) for key in keys]
+
+    def get(self, key):
+        time.sleep(self.latency)
+        return self._db.get(key)
+
+    def set(self, key, value):
+        time.sleep(self.latency)
+        self._db[key] = value
+
+    def delete(self, key):
+        time.sleep(self.latency)
+        self._db.pop(key, None)
+
+
+async def alogin(state_interface):
+    """The same state operations as :py:func:`bench_state_db.login`."""
+    key = await state_interface.acreate_state(ISS)
+    await state_interface.astore_item(AUTH_REQUEST, 'auth_request', key)
+    await state_interface.astore_x2state(AUTH_REQUEST['nonce'], key, 'nonce')
+    await state_interface.astore_item(AUTH_RESPONSE, 'auth_response', key)
+    _reads = state_interface._state_reads(key)
+    await state_interface.arun(
+        _reads, state_interface.extend_request_args, {}, AuthorizationRequest,
+        'auth_request', key, ['redirect_uri', 'client_id'])
+    await state_interface.arun(
+        _reads, state_interface.extend_request_args, {},
+        AuthorizationResponse, 'auth_response', key, ['code'])
+    await state_interface.astore_item(TOKEN_RESPONSE, 'token_response', key)
+    await state_interface.amultiple_extend_request_args(
+        {}, key, ['access_token'], ITEM_TYPES)
+    await state_interface.amultiple_extend_request_args(
+        {}, key, ['id_token'], ITEM_TYPES)
+    await state_interface.astore_item(USER_INFO, 'user_info', key)
+
+
+async def threaded_login(state_interface):
+    """The same login with every state operation run in a thread."""
+    _run = asyncio.get_running_loop().run_in_executor
+    key = await _run(None, state_interface.create_state, ISS)
+    await _run(None, state_interface.store_item, AUTH_REQUEST, 'auth_request',
+               key)
+    await _run(None, state_interface.store_nonce2state, AUTH_REQUEST['nonce'],
+               key)
+    await _run(None, state_interface.store_item, AUTH_RESPONSE,
+               'auth_response', key)
+    await _run(None, state_interface.extend_request_args, {},
+               AuthorizationRequest, 'auth_request', key,
+               ['redirect_uri', 'client_id'])
+    await _run(None, state_interface.extend_request_args, {},
+               AuthorizationResponse, 'auth_response', key, ['code'])
+    await _run(None, state_interface.store_item, TOKEN_RESPONSE,
+               'token_response', key)
+    await _run(None, state_interface.multiple_extend_request_args, {}, key,
+               ['access_token'], ITEM_TYPES)
+    await _run(None, state_interface.multiple_extend_request_args, {}, key,
+               ['id_token'], ITEM_TYPES)
+    await _run(None, state_interface.store_item, USER_INFO, 'user_info', key)
+
+
+async def run(login, state_db, concurrency):
+    _interface = StateInterface(state_db)
+    _then = time.perf_counter()
+    await asyncio.gather(*[login(_interface) for _ in range(concurrency)])
+    return concurrency / (time.perf_counter() - _then)
+
+
+def main(latency=1):
+    latency /= 1000
+    print('{:>12}{:>16}{:>16}'.format('concurrency', 'async logins/s',
+                                      'thread logins/s'))
+    for concurrency in [1, 10, 100, 1000]:
+        _async = asyncio.run(run(alogin, AsyncDataBase(latency),
+                                 concurrency))
+        _threaded = asyncio.run(run(threaded_login, BlockingDataBase(latency),
+                                    concurrency))
+        print('{:>12}{:>16.0f}{:>16.0f}'.format(concurrency, _async,
+                                                _threaded))
+
+
+if __name__ == '__main__':
+    main(*[float(a) for a in sys.argv[1:2]])
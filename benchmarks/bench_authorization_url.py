@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Measures how many login redirects, OpenID Connect authorization requests
+with PKCE, can be built per second, with the authorization URL built by
+oidcservice.util.get_http_url and from a template (url_template).
+
+Usage::
+
+    python benchmarks/bench_authorization_url.py [number of redirects]
+"""
+import sys
+import timeit
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from oidcservice.oidc.add_on.pkce import add_pkce_support
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.util import get_http_url
+
+ISS = 'https://op.example.org'
+
+
+def authorization_service(url_template):
+    _context = ServiceContext(config={
+        'client_id': 'client_id', 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://rp.example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _context.behaviour = {'response_types': ['code']}
+    _db = InMemoryStateDataBase()
+    _service = service_factory('Authorization', ['oidc'], state_db=_db,
+                               service_context=_context,
+                               conf={'url_template': url_template})
+    _service.endpoint = ISS + '/authorization'
+    # PKCE needs the access token service too
+    _token = service_factory('AccessToken', ['oidc'], state_db=_db,
+                             service_context=_context)
+    add_pkce_support({'authorization': _service, 'accesstoken': _token}, 64,
+                     'S256')
+    return _service
+
+
+def redirect(service):
+    return service.get_request_parameters(
+        request_args={'scope': ['openid', 'email', 'profile'],
+                      'response_mode': 'query'})['url']
+
+
+def main(number=5000):
+    _plain = authorization_service(False)
+    _template = authorization_service(True)
+
+    _query = [parse_qs(urlsplit(redirect(s)).query) for s in (_plain,
+                                                              _template)]
+    for _q in _query:
+        for _param in ['state', 'nonce', 'code_challenge']:
+            del _q[_param]
+    assert _query[0] == _query[1]
+
+    # The URL alone
+    _request = _template.construct(request_args={
+        'scope': ['openid', 'email', 'profile'], 'response_mode': 'query'})
+    _endpoint = _template.endpoint
+    print('{:<28}{:>12}'.format('', 'us/URL'))
+    for name, func in [
+            ('get_http_url',
+             lambda: get_http_url(_endpoint, _request)),
+            ('template',
+             lambda: _template.authorization_url(_endpoint, _request))]:
+        _time = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print('{:<28}{:>12.1f}'.format(name, _time * 1e6))
+
+    print()
+    print('{:<28}{:>12}'.format('', 'redirects/s'))
+    for name, service in [('get_http_url', _plain), ('template', _template)]:
+        _time = min(timeit.repeat(lambda: redirect(service),
+                                  number=number // 5, repeat=5))
+        print('{:<28}{:>12.0f}'.format(name, number // 5 / _time))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Measures how long building refresh access token requests with the
+private_key_jwt and client_secret_jwt client authentication methods takes
+when the client assertion is signed for each request and when it is taken
+from an AssertionPool filled by a background thread.
+
+The requests come with a pause in between, like requests from users do,
+which is when the background thread signs. p50 and p99 of the time a
+request takes and the share of the assertions that came from the pool are
+reported.
+
+Usage::
+
+    python benchmarks/bench_client_assertion.py [requests] [pause ms]
+"""
+import sys
+import time
+
+from bench_rp_flow import percentile
+from bench_state_db import ISS
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oauth2 import AccessTokenResponse
+
+from oidcservice.assertion_pool import AssertionPool
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import State
+
+KEYSPEC = [{"type": "RSA", "use": ["sig"]}]
+AUTHN_METHODS = [('private_key_jwt', 'RS256'), ('client_secret_jwt', 'HS256')]
+
+
+def refresh_service(number):
+    _context = ServiceContext(build_keyjar(KEYSPEC), config={
+        'client_id': 'client_id', 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _context.provider_info = {'issuer': ISS,
+                              'token_endpoint': ISS + '/token'}
+    _db = InMemoryStateDataBase()
+    _service = service_factory('RefreshAccessToken', ['oauth2'],
+                               state_db=_db, service_context=_context)
+    _service.endpoint = ISS + '/token'
+
+    _keys = []
+    for i in range(number):
+        _key = 'state{}'.format(i)
+        _token_response = AccessTokenResponse(
+            access_token='access_token{}'.format(i),
+            refresh_token='refresh_token{}'.format(i), token_type='Bearer')
+        _db.set(_key, State(iss=ISS,
+                            token_response=_token_response.to_json()).to_json())
+        _keys.append(_key)
+    return _service, _keys
+
+
+def measure(service, keys, authn_method, algorithm, pause):
+    _times = []
+    for key in keys:
+        time.sleep(pause)
+        _start = time.perf_counter()
+        service.get_request_parameters(state=key, authn_method=authn_method,
+                                       algorithm=algorithm)
+        _times.append(time.perf_counter() - _start)
+    return percentile(_times, 50), percentile(_times, 99)
+
+
+def main(number=500, pause=5):
+    _service, _keys = refresh_service(number)
+    print('{:<32}{:>10}{:>10}{:>10}'.format('', 'p50 us', 'p99 us',
+                                            'hits'))
+    for authn_method, algorithm in AUTHN_METHODS:
+        _context = _service.service_context
+        _context.assertion_pool = None
+        _p50, _p99 = measure(_service, _keys, authn_method, algorithm,
+                             pause / 1000)
+        print('{:<32}{:>10.1f}{:>10.1f}{:>10}'.format(
+            authn_method, _p50 * 1e6, _p99 * 1e6, ''))
+
+        _pool = AssertionPool()
+        _pool.start()
+        _context.assertion_pool = _pool
+        _p50, _p99 = measure(_service, _keys, authn_method, algorithm,
+                             pause / 1000)
+        _pool.stop()
+        _stats = _pool.stats()
+        print('{:<32}{:>10.1f}{:>10.1f}{:>9.0f}%'.format(
+            authn_method + ', pool', _p50 * 1e6, _p99 * 1e6,
+            100 * _stats['hits'] / (_stats['hits'] + _stats['misses'])))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Measures a threaded client doing the cryptography of many users at the same
+time: building refresh requests with private_key_jwt, so signing an RS256
+client assertion, verifying the RS256 signed ID Token of the token response
+and unpacking RS256 signed userinfo responses.
+
+Compares doing the cryptography in the threads, which hold the GIL meanwhile,
+with a CryptoExecutor with a number of worker processes. Every operation
+costs a round trip to a worker, so the executor is only faster if there are
+cores to spare for the workers. Run this on the machine the client is to
+run on before setting a crypto_executor.
+
+Usage::
+
+    python benchmarks/bench_crypto_executor.py [operations] [threads]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oidc import AccessTokenResponse
+
+from oidcservice.crypto_executor import CryptoExecutor
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import State
+
+ISS = 'https://example.org/op'
+KEYSPEC = [{"type": "RSA", "use": ["sig"]}]
+
+
+def services(number):
+    _op_keyjar = build_keyjar(KEYSPEC)
+    _context = ServiceContext(build_keyjar(KEYSPEC), config={
+        'client_id': 'client_id',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _context.provider_info = {'issuer': ISS, 'token_endpoint': ISS + '/token'}
+    _context.keyjar.import_jwks(_op_keyjar.export_jwks(), ISS)
+    _db = InMemoryStateDataBase()
+    _refresh = service_factory('RefreshAccessToken', ['oidc'], state_db=_db,
+                               service_context=_context)
+    _refresh.endpoint = ISS + '/token'
+    _userinfo = service_factory('UserInfo', ['oidc'], state_db=_db,
+                                service_context=_context)
+
+    _keys = []
+    for i in range(number):
+        _key = 'state{}'.format(i)
+        _token_response = AccessTokenResponse(
+            access_token='access_token{}'.format(i),
+            refresh_token='refresh_token{}'.format(i), token_type='Bearer')
+        _db.set(_key, State(iss=ISS,
+                            token_response=_token_response.to_json()).to_json())
+        _keys.append(_key)
+
+    _jwt = JWT(key_jar=_op_keyjar, iss=ISS, sign_alg='RS256', lifetime=3600)
+    _responses = []
+    for i in range(number):
+        _sub = 'user{}'.format(i)
+        _id_token = _jwt.pack(payload={'sub': _sub}, aud=['client_id'])
+        _token_response = AccessTokenResponse(
+            access_token='access_token{}'.format(i), token_type='Bearer',
+            id_token=_id_token).to_json()
+        _responses.append((_token_response, _jwt.pack(payload={'sub': _sub})))
+    return _refresh, _userinfo, _keys, _responses
+
+
+def one_user(refresh, userinfo, key, responses):
+    refresh.get_request_parameters(state=key, authn_method='private_key_jwt',
+                                   algorithm='RS256')
+    assert refresh.verify_response(responses[0], 'json')['__verified_id_token']
+    assert userinfo._do_jwt(responses[1])['sub']
+
+
+def measure(refresh, userinfo, keys, responses, threads):
+    with ThreadPoolExecutor(threads) as pool:
+        _start = time.perf_counter()
+        for _ in pool.map(one_user, [refresh] * len(keys),
+                          [userinfo] * len(keys), keys, responses):
+            pass
+        return len(keys) / (time.perf_counter() - _start)
+
+
+def main(number=400, threads=16):
+    _refresh, _userinfo, _keys, _responses = services(number)
+    _context = _refresh.service_context
+    print('{} CPUs, {} threads'.format(os.cpu_count(), threads))
+    print('{:<28}{:>12}'.format('', 'users/s'))
+    print('{:<28}{:>12.0f}'.format('in the threads', measure(
+        _refresh, _userinfo, _keys, _responses, threads)))
+
+    for workers in [1, 2, 4, 8]:
+        _context.crypto_executor = CryptoExecutor(max_workers=workers)
+        # Starts the workers and hands them the keys
+        measure(_refresh, _userinfo, _keys[:workers * 4],
+                _responses[:workers * 4], threads)
+        print('{:<28}{:>12.0f}'.format(
+            'executor, {} processes'.format(workers),
+            measure(_refresh, _userinfo, _keys, _responses, threads)))
+        _context.crypto_executor.shutdown()
+        _context.crypto_executor = None
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:3]])
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Compares Service.gather_request_args, which uses a compiled plan of where
+each claim is found, with the loop it replaced that tried every place for
+every claim of the message class. Also measures constructing a complete
+OpenID Connect authorization request.
+
+Usage::
+
+    python benchmarks/bench_gather_request_args.py [number of rounds]
+"""
+import sys
+import timeit
+
+from bench_state_db import ISS
+
+from oidcservice.service import Service
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+
+SERVICES = [('oauth2', 'Authorization'), ('oauth2', 'AccessToken'),
+            ('oidc', 'Authorization'), ('oidc', 'Registration')]
+
+
+def gather_request_args(service, **kwargs):
+    """The implementation before the plan was introduced."""
+    ar_args = kwargs.copy()
+    for prop in service.msg_type.c_param:
+        if prop in ar_args:
+            continue
+
+        try:
+            ar_args[prop] = getattr(service.service_context, prop)
+        except AttributeError:
+            try:
+                ar_args[prop] = service.conf['request_args'][prop]
+            except KeyError:
+                try:
+                    ar_args[prop] = service.service_context.register_args[
+                        prop]
+                except KeyError:
+                    try:
+                        ar_args[prop] = service.default_request_args[prop]
+                    except KeyError:
+                        pass
+
+    return ar_args
+
+
+def create_service(flavour, name):
+    _context = ServiceContext(config={
+        'client_id': 'client_id', 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'response_types': ['code'], 'issuer': ISS})
+    _context.behaviour = {'response_types': ['code']}
+    _service = service_factory(name, [flavour],
+                               state_db=InMemoryStateDataBase(),
+                               service_context=_context)
+    _service.endpoint = 'https://example.org/op/authorization'
+    return _service
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(number=20000):
+    print('{:<22}{:>8}{:>12}{:>12}'.format('service', 'claims', 'before us',
+                                           'after us'))
+    for flavour, name in SERVICES:
+        _service = create_service(flavour, name)
+        _args = {'state': 'state', 'nonce': 'nonce'}
+        assert gather_request_args(_service, **_args) == \
+            Service.gather_request_args(_service, **_args)
+        _before = measure(lambda: gather_request_args(_service, **_args),
+                          number)
+        _after = measure(
+            lambda: Service.gather_request_args(_service, **_args), number)
+        print('{:<22}{:>8}{:>12.2f}{:>12.2f}'.format(
+            '{} {}'.format(flavour, name), len(_service.msg_type.c_param),
+            _before * 1e6, _after * 1e6))
+
+    _service = create_service('oidc', 'Authorization')
+    _request_args = {'state': 'state', 'nonce': 'nonce'}
+    _service.create_state(ISS, 'state')
+    _compiled = measure(
+        lambda: _service.construct(request_args=_request_args), number // 10)
+    _gather = Service.gather_request_args
+    Service.gather_request_args = gather_request_args
+    try:
+        _loop = measure(
+            lambda: _service.construct(request_args=_request_args),
+            number // 10)
+    finally:
+        Service.gather_request_args = _gather
+    print('{:<22}{:>8}{:>12.2f}{:>12.2f}'.format(
+        'oidc construct', '', _loop * 1e6, _compiled * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Shows where the time goes when an OpenID Connect authorization request is
+built and an access token response is parsed, using the stage timing of
+oidcservice.instrumentation, and what the timing costs: the time per round
+without a sink, with a sink that does nothing and with a histogram.
+
+Usage::
+
+    python benchmarks/bench_instrumentation.py [number of rounds]
+"""
+import sys
+import timeit
+
+from bench_state_db import ISS
+from bench_state_db import TOKEN_RESPONSE
+from oidcmsg.oidc import AccessTokenResponse
+
+from oidcservice.instrumentation import Histogram
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+
+
+def create_services():
+    _context = ServiceContext(config={
+        'client_id': 'client_id', 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _context.behaviour = {'response_types': ['code']}
+    _db = InMemoryStateDataBase()
+    _authorization = service_factory('Authorization', ['oidc'], state_db=_db,
+                                     service_context=_context)
+    _authorization.endpoint = ISS + '/authorization'
+    # Without the ID Token, that is not signed by a known key
+    _token = service_factory('AccessToken', ['oauth2'], state_db=_db,
+                             service_context=_context)
+    _authorization.create_state(ISS, 'state')
+    return _authorization, _token
+
+
+def round_trip(authorization, token, response):
+    authorization.get_request_parameters(state='state')
+    token.parse_response(response, state='state')
+
+
+def run(authorization, token, sink, number):
+    authorization.stage_sink = sink
+    token.stage_sink = sink
+    _response = AccessTokenResponse(access_token=TOKEN_RESPONSE[
+        'access_token'], token_type='Bearer').to_json()
+    return min(timeit.repeat(
+        lambda: round_trip(authorization, token, _response), number=number,
+        repeat=5)) / number
+
+
+def main(number=2000):
+    _authorization, _token = create_services()
+    _histogram = Histogram()
+
+    print('{:<12}{:>12}'.format('sink', 'us/round'))
+    for name, sink in [('none', None), ('no-op', lambda timing: None),
+                       ('histogram', _histogram)]:
+        print('{:<12}{:>12.1f}'.format(
+            name, run(_authorization, _token, sink, number) * 1e6))
+
+    print()
+    print('{:<16}{:<22}{:<22}{:>10}{:>10}'.format(
+        'service', 'stage', 'hook', 'p50 us', 'p99 us'))
+    for (service, stage, hook), _stats in sorted(_histogram.summary().items()):
+        print('{:<16}{:<22}{:<22}{:>10.1f}{:>10.1f}'.format(
+            service, stage, hook, _stats['p50'] * 1e6, _stats['p99'] * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Compares building refresh access token requests for many states one call
+at a time, with Service.get_request_parameters, and as a batch, with
+Service.get_request_parameters_batch.
+
+Usage::
+
+    python benchmarks/bench_request_batch.py [number of states]
+"""
+import sys
+import time
+
+from bench_state_db import ISS
+from oidcmsg.oauth2 import AccessTokenResponse
+
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import State
+
+AUTHN_METHODS = ['bearer_header', 'client_secret_basic', 'client_secret_post']
+
+
+def refresh_service(number):
+    _context = ServiceContext(config={
+        'client_id': 'client_id', 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _db = InMemoryStateDataBase()
+    _service = service_factory('RefreshAccessToken', ['oauth2'],
+                               state_db=_db, service_context=_context)
+    _service.endpoint = 'https://example.org/op/token'
+
+    _keys = []
+    for i in range(number):
+        _key = 'state{}'.format(i)
+        _token_response = AccessTokenResponse(
+            access_token='access_token{}'.format(i),
+            refresh_token='refresh_token{}'.format(i), token_type='Bearer')
+        _db.set(_key, State(iss=ISS,
+                            token_response=_token_response.to_json()).to_json())
+        _keys.append(_key)
+    return _service, _keys
+
+
+def one_at_a_time(service, keys, authn_method):
+    for key in keys:
+        service.get_request_parameters(state=key, authn_method=authn_method)
+
+
+def batch(service, keys, authn_method):
+    for _ in service.get_request_parameters_batch(
+            [(key, None) for key in keys], authn_method=authn_method):
+        pass
+
+
+def measure(func, *args):
+    _times = []
+    for _ in range(3):
+        _then = time.perf_counter()
+        func(*args)
+        _times.append(time.perf_counter() - _then)
+    return min(_times)
+
+
+def main(number=10000):
+    _service, _keys = refresh_service(number)
+    print('{:<22}{:>14}{:>14}'.format('client authn', 'one/s', 'batch/s'))
+    for authn_method in AUTHN_METHODS:
+        _single = measure(one_at_a_time, _service, _keys, authn_method)
+        _batch = measure(batch, _service, _keys, authn_method)
+        print('{:<22}{:>14.0f}{:>14.0f}'.format(
+            authn_method, number / _single, number / _batch))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Compares making random strings, like state, nonce and PKCE code verifiers,
+one random.choice call per character, as rndstr used to, also with
+random.SystemRandom, with oidcservice.rndstr and with the secrets module.
+
+Usage::
+
+    python benchmarks/bench_rndstr.py [number of strings]
+"""
+import random
+import secrets
+import string
+import sys
+import timeit
+
+from oidcservice import rndstr
+
+BASECH = string.ascii_letters + string.digits
+SYSTEM_RANDOM = random.SystemRandom()
+
+
+def choice_per_character(size):
+    return "".join([random.choice(BASECH) for _ in range(size)])
+
+
+def system_random_per_character(size):
+    return "".join([SYSTEM_RANDOM.choice(BASECH) for _ in range(size)])
+
+
+def secrets_choice(size):
+    return "".join([secrets.choice(BASECH) for _ in range(size)])
+
+
+def main(number=20000):
+    print('{:<30}{:>12}{:>12}{:>12}'.format('strings/s', '16', '32', '64'))
+    for name, func in [('random.choice (before)', choice_per_character),
+                       ('SystemRandom.choice', system_random_per_character),
+                       ('secrets.choice', secrets_choice),
+                       ('rndstr', rndstr)]:
+        _rates = [number / min(timeit.repeat(lambda: func(size),
+                                             number=number, repeat=3))
+                  for size in [16, 32, 64]]
+        print('{:<30}{:>12.0f}{:>12.0f}{:>12.0f}'.format(name, *_rates))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark of an OpenID Connect RP. Each round is a new RP doing
+the complete flow against a stub OP:
+
+webfinger, discovery, registration, the authorization URL, parsing the
+authorization response, the access token request with a signed ID Token,
+userinfo, refresh and end-session.
+
+The stub OP runs in the same process, it is the transport of the services
+and serves the JWKS of the OP to the key jar, so the benchmark runs offline
+and no time is spent on the network. The time the OP spends, for instance
+signing ID Tokens, is not counted. The keys are the ones the tests use, in
+tests/.
+
+For each stage ops/s, p50 and p99 are reported. If a file name is given the
+numbers are also written to it as JSON, to be compared with those of another
+commit::
+
+    python benchmarks/bench_rp_flow.py [rounds] [JSON file]
+    python benchmarks/bench_rp_flow.py compare [old JSON file] [new JSON file]
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import KeyJar
+from cryptojwt.key_jar import init_key_jar
+from oidcmsg.oidc import AccessTokenResponse
+from oidcmsg.oidc import AuthorizationResponse
+
+from oidcservice import rndstr
+from oidcservice.oidc import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+from oidcservice.state_interface import InMemoryStateDataBase
+
+_dirname = os.path.dirname(os.path.abspath(__file__))
+TESTS = os.path.join(_dirname, '..', 'tests')
+
+KEYSPEC = [
+    {"type": "RSA", "use": ["sig"]},
+    {"type": "EC", "crv": "P-256", "use": ["sig"]},
+]
+
+OP_BASEURL = 'https://example.org/op'
+RP_BASEURL = 'https://example.com/rp'
+
+STAGES = ['webfinger', 'discovery', 'registration', 'authorization_url',
+          'authorization_response', 'access_token', 'userinfo', 'refresh',
+          'end_session']
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class Response:
+    def __init__(self, text, status_code=200, headers=None):
+        self.text = text
+        self.status_code = status_code
+        self.headers = headers or JSON_HEADERS
+
+
+class StubOP:
+    """
+    An OP that answers in the same process. Used as the transport of the
+    services and as the HTTP client of the key jar. Keeps track of the time
+    it spends.
+    """
+
+    def __init__(self):
+        self.keyjar = init_key_jar(
+            public_path=os.path.join(TESTS, 'pub_iss.jwks'),
+            private_path=os.path.join(TESTS, 'priv_iss.jwks'),
+            key_defs=KEYSPEC, owner='')
+        self.jwks = json.dumps(self.keyjar.export_jwks())
+        self.seconds = 0.0
+        self.clients = {}
+        self.codes = {}
+        self.refresh_tokens = {}
+        self.paths = {
+            '/.well-known/webfinger': self.webfinger,
+            '/op/.well-known/openid-configuration': self.discovery,
+            '/op/jwks.json': self.jwks_uri,
+            '/op/registration': self.registration,
+            '/op/token': self.token,
+            '/op/userinfo': self.userinfo,
+        }
+
+    def send(self, url, method='GET', body=None, headers=None, issuer='',
+             timeout=None):
+        _start = time.perf_counter()
+        _comp = urlsplit(url)
+        _resp = self.paths[_comp.path](_comp.query or body, headers or {})
+        self.seconds += time.perf_counter() - _start
+        return _resp
+
+    def httpc(self, method, url, **kwargs):
+        return self.send(url, method)
+
+    def webfinger(self, request, headers):
+        return Response(json.dumps({
+            'subject': parse_qs(request)['resource'][0],
+            'links': [{'rel': 'http://openid.net/specs/connect/1.0/issuer',
+                       'href': OP_BASEURL}]}))
+
+    def discovery(self, request, headers):
+        return Response(json.dumps({
+            'issuer': OP_BASEURL,
+            'authorization_endpoint': OP_BASEURL + '/authorization',
+            'token_endpoint': OP_BASEURL + '/token',
+            'userinfo_endpoint': OP_BASEURL + '/userinfo',
+            'registration_endpoint': OP_BASEURL + '/registration',
+            'end_session_endpoint': OP_BASEURL + '/end_session',
+            'jwks_uri': OP_BASEURL + '/jwks.json',
+            'response_types_supported': ['code', 'id_token',
+                                         'code id_token'],
+            'subject_types_supported': ['public', 'pairwise'],
+            'grant_types_supported': ['authorization_code',
+                                      'refresh_token'],
+            'id_token_signing_alg_values_supported': ['RS256', 'ES256'],
+            'token_endpoint_auth_methods_supported': [
+                'client_secret_post', 'client_secret_basic'],
+            'scopes_supported': ['openid', 'profile', 'email',
+                                 'offline_access'],
+            'claims_supported': ['sub', 'name', 'email'],
+        }))
+
+    def jwks_uri(self, request, headers):
+        return Response(self.jwks)
+
+    def registration(self, request, headers):
+        _client_id = rndstr(12)
+        _info = json.loads(request)
+        _info.update({
+            'client_id': _client_id, 'client_secret': rndstr(24),
+            'registration_access_token': rndstr(32),
+            'registration_client_uri': '{}/registration?client_id={}'.format(
+                OP_BASEURL, _client_id),
+            'client_id_issued_at': int(time.time()),
+            'client_secret_expires_at': 0})
+        self.clients[_client_id] = _info
+        return Response(json.dumps(_info), 201)
+
+    def authorization(self, url):
+        """What the OP does when the user agent is redirected to it."""
+        _start = time.perf_counter()
+        _req = parse_qs(urlsplit(url).query)
+        _code = rndstr(32)
+        self.codes[_code] = (_req['client_id'][0], _req['nonce'][0])
+        _resp = AuthorizationResponse(
+            code=_code, state=_req['state'][0], iss=OP_BASEURL,
+            client_id=_req['client_id'][0]).to_urlencoded()
+        self.seconds += time.perf_counter() - _start
+        return _resp
+
+    def token(self, request, headers):
+        _req = parse_qs(request)
+        _resp = AccessTokenResponse(access_token=rndstr(32),
+                                    refresh_token=rndstr(32),
+                                    token_type='Bearer', expires_in=3600)
+        _payload = {'sub': 'diana'}
+        if _req['grant_type'] == ['authorization_code']:
+            _client_id, _payload['nonce'] = self.codes.pop(_req['code'][0])
+        else:
+            _client_id = self.refresh_tokens.pop(_req['refresh_token'][0])
+        self.refresh_tokens[_resp['refresh_token']] = _client_id
+        _jwt = JWT(self.keyjar, OP_BASEURL, lifetime=3600, sign_alg='RS256')
+        _resp['id_token'] = _jwt.pack(payload=_payload, recv=_client_id)
+        return Response(_resp.to_json())
+
+    def userinfo(self, request, headers):
+        return Response(json.dumps({'sub': 'diana', 'name': 'Diana',
+                                    'email': 'diana@example.org'}))
+
+
+def rp_keys():
+    _keyjar = init_key_jar(
+        public_path=os.path.join(TESTS, 'pub_client.jwks'),
+        private_path=os.path.join(TESTS, 'priv_client.jwks'),
+        key_defs=KEYSPEC, owner='')
+    return _keyjar.issuer_keys['']
+
+
+def new_rp(op, keys):
+    # The key jar fetches the keys of the OP from the stub
+    _keyjar = KeyJar(httpc=op.httpc)
+    for _bundle in keys:
+        _keyjar.add_kb('', _bundle)
+    _context = ServiceContext(_keyjar, config={
+        'client_preferences': {
+            'application_type': 'web', 'contacts': ['ops@example.com'],
+            'response_types': ['code'],
+            'scope': ['openid', 'profile', 'email', 'offline_access'],
+            'token_endpoint_auth_method': 'client_secret_basic'},
+        'redirect_uris': ['{}/authz_cb'.format(RP_BASEURL)],
+        'post_logout_redirect_uris': ['{}/logout_cb'.format(RP_BASEURL)]})
+
+    _definitions = DEFAULT_SERVICES.copy()
+    _definitions['webfinger'] = {
+        'class': 'oidcservice.oidc.webfinger.WebFinger'}
+    _definitions['end_session'] = {
+        'class': 'oidcservice.oidc.end_session.EndSession'}
+    _services = init_services(_definitions, _context, InMemoryStateDataBase(),
+                              transport=op)
+    _context.service = _services
+    return _services
+
+
+def flow(op, services):
+    """
+    One RP doing the whole flow.
+
+    :return: A list with the number of seconds the RP spent on each stage
+    """
+    _times = []
+    _state = None
+
+    def stage(func):
+        _op_seconds = op.seconds
+        _start = time.perf_counter()
+        _result = func()
+        _times.append(time.perf_counter() - _start -
+                      (op.seconds - _op_seconds))
+        return _result
+
+    stage(lambda: services['webfinger'].service_request(
+        request_args={'resource': 'acct:diana@example.org'}))
+    stage(lambda: services['provider_info'].service_request())
+    stage(lambda: services['registration'].service_request())
+
+    _info = stage(lambda: services['authorization'].get_request_parameters())
+    _response = op.authorization(_info['url'])
+
+    def authorization_response():
+        _resp = services['authorization'].parse_response(_response)
+        services['authorization'].update_service_context(
+            _resp, key=_resp['state'])
+        return _resp['state']
+
+    _state = stage(authorization_response)
+    _token = stage(lambda: services['accesstoken'].service_request(
+        state=_state))
+    assert _token['__verified_id_token']['sub'] == 'diana'
+    _user = stage(lambda: services['userinfo'].service_request(state=_state))
+    assert _user['name'] == 'Diana'
+    stage(lambda: services['refresh_token'].service_request(state=_state))
+    _info = stage(lambda: services['end_session'].get_request_parameters(
+        state=_state))
+    assert 'id_token_hint' in parse_qs(urlsplit(_info['url']).query)
+    return _times
+
+
+def percentile(values, percent):
+    _values = sorted(values)
+    return _values[min(len(_values) - 1, int(len(_values) * percent / 100))]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=_dirname,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(rounds):
+    _op = StubOP()
+    _keys = rp_keys()
+    # A round that is not measured, loads modules and fills caches
+    flow(_op, new_rp(_op, _keys))
+
+    _samples = [[] for _ in STAGES]
+    for _ in range(rounds):
+        for _stage, _seconds in zip(_samples,
+                                    flow(_op, new_rp(_op, _keys))):
+            _stage.append(_seconds)
+
+    _stages = {}
+    for name, samples in zip(STAGES, _samples):
+        _stages[name] = {'ops': len(samples) / sum(samples),
+                         'p50': percentile(samples, 50),
+                         'p99': percentile(samples, 99)}
+    _total = [sum(t) for t in zip(*_samples)]
+    _stages['flow'] = {'ops': len(_total) / sum(_total),
+                       'p50': percentile(_total, 50),
+                       'p99': percentile(_total, 99)}
+    return {'commit': git_commit(), 'python': platform.python_version(),
+            'rounds': rounds, 'stages': _stages}
+
+
+def report(result):
+    print('{:<24}{:>10}{:>12}{:>12}'.format('', 'ops/s', 'p50 us',
+                                            'p99 us'))
+    for name, stats in result['stages'].items():
+        print('{:<24}{:>10.0f}{:>12.1f}{:>12.1f}'.format(
+            name, stats['ops'], stats['p50'] * 1e6, stats['p99'] * 1e6))
+
+
+def compare(old_file, new_file):
+    with open(old_file) as fp:
+        _old = json.load(fp)
+    with open(new_file) as fp:
+        _new = json.load(fp)
+
+    print('{:<24}{:>14}{:>14}{:>9}'.format(
+        '', 'p50 {}'.format(_old['commit']),
+        'p50 {}'.format(_new['commit']), 'change'))
+    for name, stats in _new['stages'].items():
+        if name not in _old['stages']:
+            continue
+        _before = _old['stages'][name]['p50']
+        print('{:<24}{:>14.1f}{:>14.1f}{:>+8.0f}%'.format(
+            name, _before * 1e6, stats['p50'] * 1e6,
+            (stats['p50'] / _before - 1) * 100))
+
+
+def main(rounds=200, json_file=''):
+    _result = run(int(rounds))
+    report(_result)
+    if json_file:
+        with open(json_file, 'w') as fp:
+            json.dump(_result, fp, indent=2)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['compare']:
+        compare(*sys.argv[2:4])
+    else:
+        main(*sys.argv[1:3])
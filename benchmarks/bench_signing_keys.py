@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Measures picking the signing key for client assertions and request objects
+from key jars with many keys, with the key cache of the service context and
+with a cache miss every time, as it was before the cache.
+
+The key jar of the client has one RSA key and, for every hundred keys, 50
+EC keys and 50 symmetric keys, each symmetric key in its own key bundle.
+
+Usage::
+
+    python benchmarks/bench_signing_keys.py [number of keys]
+"""
+import sys
+import timeit
+
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oidc import AuthorizationRequest
+
+from oidcservice.client_auth import PrivateKeyJWT
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+
+ISS = 'https://example.org/op'
+
+
+def authorization_service(number):
+    _keyjar = build_keyjar([{"type": "RSA", "use": ["sig"]}] + [
+        {"type": "EC", "crv": "P-256", "use": ["sig"]}] * (number // 2))
+    for n in range(number // 2):
+        _keyjar.add_symmetric('', 'symmetric key number {}'.format(n))
+    _context = ServiceContext(_keyjar, config={
+        'client_id': 'client_id',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _context.provider_info = {'issuer': ISS, 'token_endpoint': ISS + '/token'}
+    return service_factory('Authorization', ['oidc'],
+                           state_db=InMemoryStateDataBase(),
+                           service_context=_context)
+
+
+def measure(func, context, cached):
+    def run():
+        if not cached:
+            context.keys_changed()
+        func()
+
+    return min(timeit.repeat(run, number=100, repeat=3)) / 100
+
+
+def main(number=300):
+    _service = authorization_service(number)
+    _context = _service.service_context
+    _method = PrivateKeyJWT()
+    _request = {'response_type': 'code', 'client_id': 'client_id',
+                'scope': 'openid', 'state': 'state',
+                'redirect_uri': 'https://example.com/cli/authz_cb'}
+
+    _cases = [
+        ('client assertion key',
+         lambda: _method._get_signing_key('RS256', _context)),
+        ('client assertion', lambda: _method._construct_client_assertion(
+            _service, algorithm='RS256')),
+        ('request object key', lambda: _service.request_object_keys('ES256')),
+        ('request object', lambda: _service.construct_request_parameter(
+            AuthorizationRequest(**_request), 'request',
+            request_object_signing_alg='ES256', service=_service)),
+    ]
+
+    print('{} keys'.format(number + 1))
+    print('{:<24}{:>12}{:>12}'.format('', 'miss us', 'cached us'))
+    for name, func in _cases:
+        print('{:<24}{:>12.1f}{:>12.1f}'.format(
+            name, measure(func, _context, False) * 1e6,
+            measure(func, _context, True) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Measures the write throughput of the SQLite state database when a number of
+processes, like pre-forked WSGI workers, are running logins at the same time.
+
+Usage::
+
+    python benchmarks/bench_sqlite_state_db.py [logins per process]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from bench_state_db import login
+
+from oidcservice.sqlite_state_db import SQLiteStateDataBase
+from oidcservice.state_interface import StateInterface
+
+
+def worker(filename, commit_interval, number, start):
+    _db = SQLiteStateDataBase(filename, commit_interval=commit_interval)
+    _interface = StateInterface(_db)
+    start.wait()
+    for _ in range(number):
+        login(_interface)
+    _db.close()
+
+
+def run(processes, commit_interval, number):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        filename = os.path.join(tmpdir, 'state.db')
+        SQLiteStateDataBase(filename).close()
+
+        start = multiprocessing.Event()
+        _procs = [multiprocessing.Process(
+            target=worker, args=(filename, commit_interval, number, start))
+            for _ in range(processes)]
+        for _proc in _procs:
+            _proc.start()
+        _then = time.perf_counter()
+        start.set()
+        for _proc in _procs:
+            _proc.join()
+        return processes * number / (time.perf_counter() - _then)
+
+
+def main(number=200):
+    print('{:>10}{:>16}{:>16}'.format('processes', 'commit interval',
+                                      'logins/s'))
+    for processes in [1, 2, 4, 8]:
+        for commit_interval in [0, 0.005]:
+            print('{:>10}{:>16}{:>16.0f}'.format(
+                processes, commit_interval,
+                run(processes, commit_interval, number)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
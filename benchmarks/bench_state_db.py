@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Measures the CPU cost of the state handling done during one login.
+
+Usage::
+
+    python benchmarks/bench_state_db.py [number of logins]
+"""
+import sys
+import timeit
+
+from oidcmsg.oidc import AccessTokenResponse
+from oidcmsg.oidc import AuthorizationRequest
+from oidcmsg.oidc import AuthorizationResponse
+from oidcmsg.oidc import OpenIDSchema
+
+from oidcservice import rndstr
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import ObjectStateDataBase
+from oidcservice.state_interface import StateInterface
+
+ISS = 'https://example.org/op'
+# Something the size of a signed ID Token
+ID_TOKEN = '.'.join([rndstr(64), rndstr(600), rndstr(342)])
+
+AUTH_REQUEST = AuthorizationRequest(
+    response_type='code', client_id='client_id', scope=['openid', 'email'],
+    redirect_uri='https://example.com/rp/authz_cb', nonce=rndstr(32))
+AUTH_RESPONSE = AuthorizationResponse(code=rndstr(32), iss=ISS)
+TOKEN_RESPONSE = AccessTokenResponse(
+    access_token=rndstr(32), token_type='Bearer', refresh_token=rndstr(32),
+    expires_in=3600, id_token=ID_TOKEN)
+USER_INFO = OpenIDSchema(sub=rndstr(16), name='Diana Prince',
+                         email='diana@example.org', email_verified=True)
+
+
+def login(state_interface):
+    """The state operations done by the services during one login."""
+    key = state_interface.create_state(ISS)
+    state_interface.store_item(AUTH_REQUEST, 'auth_request', key)
+    state_interface.store_nonce2state(AUTH_REQUEST['nonce'], key)
+    state_interface.store_item(AUTH_RESPONSE, 'auth_response', key)
+    # access token request
+    state_interface.extend_request_args({}, AuthorizationRequest,
+                                        'auth_request', key,
+                                        ['redirect_uri', 'client_id'])
+    state_interface.extend_request_args({}, AuthorizationResponse,
+                                        'auth_response', key, ['code'])
+    state_interface.store_item(TOKEN_RESPONSE, 'token_response', key)
+    # user info request
+    state_interface.multiple_extend_request_args(
+        {}, key, ['access_token'],
+        ['auth_response', 'token_response', 'refresh_token_response'])
+    state_interface.multiple_extend_request_args(
+        {}, key, ['id_token'],
+        ['auth_response', 'token_response', 'refresh_token_response'])
+    state_interface.store_item(USER_INFO, 'user_info', key)
+
+
+def run(state_db, number):
+    _interface = StateInterface(state_db)
+    return min(timeit.repeat(lambda: login(_interface), number=number,
+                             repeat=5)) / number
+
+
+def main(number=2000):
+    _base = run(InMemoryStateDataBase(), number)
+    print('{:<24}{:>10.1f} us/login'.format('InMemoryStateDataBase',
+                                            _base * 1e6))
+    _native = run(ObjectStateDataBase(), number)
+    print('{:<24}{:>10.1f} us/login ({:.0f}% less)'.format(
+        'ObjectStateDataBase', _native * 1e6, 100 * (1 - _native / _base)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Compares storing a state as one JSON document with storing each item as a
+separate field. Reports the number of bytes written, and the time used, per
+login and per token refresh.
+
+Usage::
+
+    python benchmarks/bench_state_layout.py [number of logins]
+"""
+import sys
+import timeit
+
+from bench_state_db import ISS
+from bench_state_db import TOKEN_RESPONSE
+from bench_state_db import login
+from oidcmsg.oidc import AccessTokenResponse
+
+from oidcservice import rndstr
+from oidcservice.state_interface import FieldStateDataBase
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import StateInterface
+
+REFRESH_RESPONSE = AccessTokenResponse(
+    access_token=rndstr(32), token_type='Bearer', refresh_token=rndstr(32),
+    expires_in=3600)
+
+
+class CountingDataBase(InMemoryStateDataBase):
+    def __init__(self):
+        InMemoryStateDataBase.__init__(self)
+        self.written = 0
+
+    def set(self, key, value):
+        self.written += len(key) + len(value)
+        InMemoryStateDataBase.set(self, key, value)
+
+
+class CountingFieldDataBase(FieldStateDataBase):
+    def __init__(self):
+        FieldStateDataBase.__init__(self)
+        self.written = 0
+
+    def set(self, key, value):
+        self.written += len(key) + len(value)
+        FieldStateDataBase.set(self, key, value)
+
+    def set_fields(self, key, fields):
+        self.written += len(key) + sum(len(f) + len(v)
+                                       for f, v in fields.items())
+        FieldStateDataBase.set_fields(self, key, fields)
+
+
+def refresh(state_interface, key):
+    """The state operations done by one token refresh."""
+    state_interface.multiple_extend_request_args(
+        {}, key, ['refresh_token'], ['token_response',
+                                     'refresh_token_response'])
+    state_interface.store_item(REFRESH_RESPONSE, 'refresh_token_response',
+                               key)
+
+
+def run(state_db, number):
+    _interface = StateInterface(state_db)
+    _login = min(timeit.repeat(lambda: login(_interface), number=number,
+                               repeat=3)) / number
+    _logins_written = state_db.written
+
+    key = _interface.create_state(ISS)
+    _interface.store_item(TOKEN_RESPONSE, 'token_response', key)
+    state_db.written = 0
+    _refresh = min(timeit.repeat(lambda: refresh(_interface, key),
+                                 number=number, repeat=3)) / number
+    return (_login, _logins_written / (3 * number), _refresh,
+            state_db.written / (3 * number))
+
+
+def main(number=1000):
+    print('{:<12}{:>14}{:>14}{:>16}{:>16}'.format(
+        'layout', 'us/login', 'bytes/login', 'us/refresh', 'bytes/refresh'))
+    for name, state_db in [('document', CountingDataBase()),
+                           ('fields', CountingFieldDataBase())]:
+        _login, _login_bytes, _refresh, _refresh_bytes = run(state_db,
+                                                             number)
+        print('{:<12}{:>14.1f}{:>14.0f}{:>16.1f}{:>16.0f}'.format(
+            name, _login * 1e6, _login_bytes, _refresh * 1e6,
+            _refresh_bytes))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
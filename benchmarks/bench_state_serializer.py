@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Compares the JSON and the binary State formats. Reports the size of a
+complete session (authorization request and response, token response with
+ID Token and user info), the time used to encode and decode it, and the time
+used by the binary serializer to read a record in the JSON format.
+
+Usage::
+
+    python benchmarks/bench_state_serializer.py [number of rounds]
+"""
+import sys
+import timeit
+
+from bench_state_db import ISS
+from bench_state_db import login
+
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import StateInterface
+from oidcservice.state_serializer import BinaryStateSerializer
+from oidcservice.state_serializer import JSONStateSerializer
+
+
+def session():
+    """A State with everything that is stored during a login."""
+    _interface = StateInterface(InMemoryStateDataBase())
+    login(_interface)
+    _key = [k for k in _interface.state_db._db.keys()
+            if not k.startswith(('__', 'ref', 'idx'))][0]
+    _state = _interface.get_state(_key)
+    assert _state['iss'] == ISS
+    return _state
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def main(number=10000):
+    _state = session()
+    _json = JSONStateSerializer()
+    _binary = BinaryStateSerializer()
+
+    print('{:<10}{:>10}{:>14}{:>14}'.format('format', 'bytes', 'encode us',
+                                            'decode us'))
+    for name, serializer in [('JSON', _json), ('binary', _binary)]:
+        _data = serializer.dumps(_state)
+        _size = len(_data.encode('utf-8') if isinstance(_data, str) else _data)
+        _encode = measure(lambda: serializer.dumps(_state), number)
+        _decode = measure(lambda: serializer.loads(_data), number)
+        print('{:<10}{:>10}{:>14.1f}{:>14.1f}'.format(
+            name, _size, _encode * 1e6, _decode * 1e6))
+
+    _record = _json.dumps(_state)
+    _migrate = measure(lambda: _binary.loads(_record), number)
+    print('{:<10}{:>10}{:>14}{:>14.1f}'.format('migration', '', '',
+                                               _migrate * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
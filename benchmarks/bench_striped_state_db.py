@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Measures how the in-memory state databases behave when a number of threads
+store items at the same time. Each thread stores an item, of its own type,
+over and over again. Either every thread works on its own state or all
+threads work on the same state. For the shared state the number of threads
+whose last update was lost, overwritten by some other thread, is reported.
+
+Usage::
+
+    python benchmarks/bench_striped_state_db.py [updates per thread]
+"""
+import sys
+import threading
+import time
+
+from oidcmsg.oidc import AuthorizationResponse
+
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import StateInterface
+from oidcservice.striped_state_db import StripedStateDataBase
+
+ISS = 'https://example.org/op'
+
+DATABASES = [
+    ('InMemory', InMemoryStateDataBase),
+    ('1 lock', lambda: StripedStateDataBase(stripes=1)),
+    ('64 stripes', lambda: StripedStateDataBase(stripes=64)),
+]
+
+
+def worker(state_interface, key, n, number, start):
+    start.wait()
+    for i in range(number):
+        state_interface.store_item(AuthorizationResponse(code=str(i)),
+                                   'item_{}'.format(n), key)
+
+
+def run(state_db, threads, number, shared):
+    _interface = StateInterface(state_db)
+    _keys = ['shared' if shared else 'key{}'.format(n)
+             for n in range(threads)]
+    for key in set(_keys):
+        _interface.create_state(ISS, key)
+
+    start = threading.Event()
+    _threads = [threading.Thread(target=worker, args=(_interface, key, n,
+                                                      number, start))
+                for n, key in enumerate(_keys)]
+    for _thread in _threads:
+        _thread.start()
+    _then = time.perf_counter()
+    start.set()
+    for _thread in _threads:
+        _thread.join()
+    _ops = threads * number / (time.perf_counter() - _then)
+
+    _lost = 0
+    for n, key in enumerate(_keys):
+        try:
+            _item = _interface.get_item(AuthorizationResponse,
+                                        'item_{}'.format(n), key)
+        except KeyError:
+            _lost += 1
+        else:
+            if _item['code'] != str(number - 1):
+                _lost += 1
+    return _ops, _lost
+
+
+def main(number=200):
+    # Switch threads often so that races show up
+    sys.setswitchinterval(1e-4)
+    print('{:>8}{:>12}{:>16}{:>16}{:>8}'.format(
+        'threads', 'database', 'own state/s', 'shared state/s', 'lost'))
+    for threads in [1, 2, 4, 8, 16, 32, 64]:
+        for name, factory in DATABASES:
+            _own, _ = run(factory(), threads, number, False)
+            _shared, _lost = run(factory(), threads, number, True)
+            print('{:>8}{:>12}{:>16.0f}{:>16.0f}{:>8}'.format(
+                threads, name, _own, _shared, _lost))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
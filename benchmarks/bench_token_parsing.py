@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Measures parsing access token responses with RS256 signed ID Tokens using
+the different verification policies of a service:
+
+- full, the response and the ID Token are verified when parsed
+- deferred, verified when a claim is first read. Shown with none and with
+  one in ten of the responses read.
+- skip, as for token responses read back from the state database
+
+Also shows what building the dictionary for the debug log, which is now
+only done if debug logging is on, cost per response.
+
+Usage::
+
+    python benchmarks/bench_token_parsing.py [number of responses]
+"""
+import sys
+import time
+
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oidc import AccessTokenResponse
+
+from oidcservice.service import VERIFY_DEFERRED
+from oidcservice.service import VERIFY_FULL
+from oidcservice.service import VERIFY_SKIP
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+
+ISS = 'https://op.example.org'
+CLIENT_ID = 'client_id'
+KEYSPEC = [{"type": "RSA", "use": ["sig"]}]
+
+
+def token_responses(number):
+    _keyjar = build_keyjar(KEYSPEC)
+    _jwt = JWT(key_jar=_keyjar, iss=ISS, sign_alg='RS256', lifetime=3600)
+    _responses = []
+    for n in range(number):
+        _responses.append(AccessTokenResponse(
+            access_token='access_token{}'.format(n), token_type='Bearer',
+            expires_in=3600,
+            id_token=_jwt.pack(payload={'sub': 'user{}'.format(n)},
+                               recv=CLIENT_ID)).to_json())
+    return _keyjar, _responses
+
+
+def token_service(keyjar):
+    _context = ServiceContext(config={
+        'client_id': CLIENT_ID, 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _context.keyjar.import_jwks(keyjar.export_jwks(), ISS)
+    return service_factory('AccessToken', ['oidc'],
+                           state_db=InMemoryStateDataBase(),
+                           service_context=_context)
+
+
+def measure(service, responses, verification, read_every=0):
+    _start = time.process_time()
+    for n, _response in enumerate(responses):
+        _resp = service.verify_response(_response, 'json',
+                                        verification=verification)
+        if read_every and n % read_every == 0:
+            assert _resp['__verified_id_token']['sub'] == 'user{}'.format(n)
+    return (time.process_time() - _start) / len(responses)
+
+
+def main(number=500):
+    _keyjar, _responses = token_responses(number)
+    _service = token_service(_keyjar)
+    # Read back from the state database, already verified
+    _stored = [_service.verify_response(r, 'json').to_json()
+               for r in _responses]
+
+    print('{:<32}{:>16}'.format('', 'CPU us/response'))
+    for name, responses, verification, read_every in [
+            ('full', _responses, VERIFY_FULL, 0),
+            ('deferred, none read', _responses, VERIFY_DEFERRED, 0),
+            ('deferred, 1 in 10 read', _responses, VERIFY_DEFERRED, 10),
+            ('stored, full', _stored, VERIFY_FULL, 0),
+            ('stored, skip', _stored, VERIFY_SKIP, 0)]:
+        print('{:<32}{:>16.1f}'.format(
+            name, measure(_service, responses, verification,
+                          read_every) * 1e6))
+
+    _parsed = [AccessTokenResponse().from_json(r) for r in _stored]
+    _start = time.process_time()
+    for _resp in _parsed:
+        _resp.to_dict()
+    print('{:<32}{:>16.1f}'.format(
+        'debug log dictionary',
+        (time.process_time() - _start) / len(_parsed) * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Measures the user info path, constructing the request and parsing the
+response, with and without the per-operation state cache. Reports the time
+used and the number of times the state is read from the state database.
+
+Usage::
+
+    python benchmarks/bench_userinfo.py [number of rounds]
+"""
+import contextlib
+import sys
+import timeit
+
+from bench_state_db import AUTH_RESPONSE
+from bench_state_db import ISS
+from bench_state_db import TOKEN_RESPONSE
+from bench_state_db import USER_INFO
+from oidcmsg.oidc import AccessTokenResponse
+
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import StateInterface
+
+
+class CountingDataBase(InMemoryStateDataBase):
+    def __init__(self):
+        InMemoryStateDataBase.__init__(self)
+        self.reads = 0
+
+    def get(self, key):
+        self.reads += 1
+        return InMemoryStateDataBase.get(self, key)
+
+
+def userinfo_service():
+    _context = ServiceContext(config={
+        'client_id': 'client_id', 'client_secret': 'a longesh password',
+        'redirect_uris': ['https://example.com/cli/authz_cb'],
+        'issuer': ISS})
+    _db = CountingDataBase()
+    _service = service_factory('UserInfo', ['oidc'], state_db=_db,
+                               service_context=_context)
+    _service.endpoint = 'https://example.org/op/userinfo'
+
+    _token_response = AccessTokenResponse(**TOKEN_RESPONSE.to_dict())
+    _token_response['__verified_id_token'] = {'sub': USER_INFO['sub'],
+                                              'iss': ISS}
+    _service.create_state(ISS, 'key')
+    _service.store_item(AUTH_RESPONSE, 'auth_response', 'key')
+    _service.store_item(_token_response, 'token_response', 'key')
+    return _service
+
+
+def userinfo(service, response):
+    service.get_request_parameters(state='key')
+    service.parse_response(response, state='key')
+
+
+def run(number):
+    _service = userinfo_service()
+    _response = USER_INFO.to_json()
+    _time = min(timeit.repeat(lambda: userinfo(_service, _response),
+                              number=number, repeat=5)) / number
+    _service.state_db.reads = 0
+    userinfo(_service, _response)
+    return _time, _service.state_db.reads
+
+
+def main(number=2000):
+    print('{:<12}{:>12}{:>8}'.format('state cache', 'us/round', 'reads'))
+    _cached = run(number)
+
+    _state_cache = StateInterface.state_cache
+    StateInterface.state_cache = lambda self: contextlib.nullcontext()
+    try:
+        _uncached = run(number)
+    finally:
+        StateInterface.state_cache = _state_cache
+
+    for name, (_time, _reads) in [('off', _uncached), ('on', _cached)]:
+        print('{:<12}{:>12.1f}{:>8}'.format(name, _time * 1e6, _reads))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -1,12 +1,7 @@
 import hashlib
 import string
 
-# Since SystemRandom is not available on all systems
-try:
-    import random.SystemRandom as rnd
-except ImportError:
-    import random as rnd
-
+from oidcservice.token_generator import TokenGenerator
 
 __author__ = 'Roland Hedberg'
 __version__ = '0.6.5'
@@ -32,6 +27,9 @@ JWT_BEARER = "urn:ietf:params:oauth:client-assertion-type:jwt-bearer"
 SAML2_BEARER_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:saml2-bearer"
 
 
+_RNDSTR = TokenGenerator(string.ascii_letters + string.digits)
+
+
 def rndstr(size=16):
     """
     Returns a string of random ascii characters or digits
@@ -39,11 +37,11 @@ def rndstr(size=16):
     :param size: The length of the string
     :return: string
     """
-    _basech = string.ascii_letters + string.digits
-    return "".join([rnd.choice(_basech) for _ in range(size)])
+    return _RNDSTR(size)
 
 
 BASECH = string.ascii_letters + string.digits + '-._~'
+_UNRESERVED = TokenGenerator(BASECH)
 
 
 def unreserved(size=64):
@@ -55,7 +53,7 @@ def unreserved(size=64):
     :return: string
     """
 
-    return "".join([rnd.choice(BASECH) for _ in range(size)])
+    return _UNRESERVED(size)
 
 
 def sanitize(str):
@@ -0,0 +1,147 @@
+"""Client assertions signed ahead of time."""
+import logging
+import threading
+from collections import deque
+
+from oidcmsg.time_util import utc_time_sans_frac
+
+from oidcservice.client_auth import assertion_jwt
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AssertionPool:
+    """
+    Keeps a number of signed client assertions, as used by the
+    private_key_jwt and client_secret_jwt client authentication methods,
+    for each client ID, audience, algorithm and set of signing keys.
+
+    Assertions are signed by :py:meth:`fill`, normally called by a
+    background thread started with :py:meth:`start`, and handed out by
+    :py:meth:`take`. Every assertion has its own jti and is only handed out
+    once. An assertion that expires in less than *min_remaining* seconds is
+    thrown away.
+
+    A combination is first asked for, and so added to the pool, when no
+    assertion is available. The client authentication method then signs one
+    itself. Combinations that have not been asked for in *lifetime* seconds
+    are removed.
+
+    Thread safe.
+    """
+
+    def __init__(self, size=8, lifetime=120, min_remaining=60):
+        """
+        :param size: How many assertions to keep per combination
+        :param lifetime: The lifetime of the assertions in seconds
+        :param min_remaining: How many seconds an assertion must have left
+            to be handed out
+        """
+        self.size = size
+        self.lifetime = lifetime
+        self.min_remaining = min_remaining
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.signed = 0
+        self._pools = {}
+        self._lock = threading.Lock()
+        self._wanted = threading.Event()
+        self._stop = None
+
+    def take(self, client_id, keys, audience, algorithm):
+        """
+        Hand out a signed assertion.
+
+        :param client_id: The client ID
+        :param keys: The signing keys
+        :param audience: The receiver of the assertion
+        :param algorithm: The signing algorithm
+        :return: A signed JSON Web Token or None if there is none
+        """
+        # The pool keeps the keys so their ids are not reused
+        _key = (client_id, audience, algorithm, tuple(id(k) for k in keys))
+        _now = utc_time_sans_frac()
+        with self._lock:
+            _pool = self._pools.get(_key)
+            if _pool is None:
+                # [arguments to assertion_jwt, assertions, last asked for]
+                _pool = [(client_id, keys, audience, algorithm), deque(), 0]
+                self._pools[_key] = _pool
+            _pool[2] = _now
+            _assertions = _pool[1]
+            while _assertions:
+                _expires_at, _assertion = _assertions.popleft()
+                if _expires_at - _now >= self.min_remaining:
+                    self.hits += 1
+                    if len(_assertions) < self.size // 2:
+                        self._wanted.set()
+                    return _assertion
+                self.expired += 1
+            self.misses += 1
+
+        self._wanted.set()
+        return None
+
+    def fill(self):
+        """
+        Sign assertions until there are *size* of them for every combination
+        that has been asked for recently.
+        """
+        _now = utc_time_sans_frac()
+        with self._lock:
+            for _key, _pool in list(self._pools.items()):
+                if _now - _pool[2] > self.lifetime:
+                    del self._pools[_key]
+            _work = [(_pool, self.size - len(_pool[1]))
+                     for _pool in self._pools.values()]
+
+        for _pool, _number in _work:
+            for _ in range(_number):
+                # Signing is slow, the lock is not held meanwhile
+                _expires_at = utc_time_sans_frac() + self.lifetime
+                _assertion = assertion_jwt(*_pool[0], lifetime=self.lifetime)
+                with self._lock:
+                    _pool[1].append((_expires_at, _assertion))
+                    self.signed += 1
+
+    def stats(self):
+        """
+        :return: A dictionary with the number of hits, misses, expired and
+            signed assertions and the number of assertions in the pool
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'expired': self.expired, 'signed': self.signed,
+                    'pooled': sum(len(p[1]) for p in self._pools.values())}
+
+    def start(self, interval=10):
+        """
+        Start a background thread that fills the pool when assertions are
+        taken or missing, or else every *interval* seconds.
+
+        :param interval: Seconds between fills
+        """
+        self.stop()
+        self._stop = threading.Event()
+        _thread = threading.Thread(target=self._background_fill,
+                                   args=(self._stop, interval), daemon=True)
+        _thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        if self._stop is not None:
+            self._stop.set()
+            self._wanted.set()
+            self._stop = None
+
+    def _background_fill(self, stop, interval):
+        while not stop.is_set():
+            try:
+                self.fill()
+            except Exception as err:
+                LOGGER.error('Could not sign client assertion: %s', err)
+            self._wanted.wait(interval)
+            self._wanted.clear()
@@ -0,0 +1,354 @@
+"""
+Support for state databases that are accessed using asyncio.
+
+An asynchronous state database has the coroutine methods *aget*, *aset* and
+*adelete*. It may also have asynchronous versions of the optional methods,
+with the same name prefixed with an 'a' (*aget_many*, *aset_fields*,
+*aindex_get*, ...). A database that has both versions of a method will
+be accessed using the asynchronous one.
+"""
+import asyncio
+import copy
+import json
+import logging
+import weakref
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+
+def supports(state_db, name):
+    """
+    Find out if a state database supports an operation, synchronously or
+    asynchronously.
+
+    :param state_db: The state database
+    :param name: Name of the synchronous method
+    """
+    return hasattr(state_db, name) or hasattr(state_db, 'a' + name)
+
+
+async def acall(state_db, name, *args):
+    """
+    Run an operation on a state database. The asynchronous version of the
+    method is used if there is one.
+
+    :param state_db: The state database
+    :param name: Name of the synchronous method
+    :param args: Arguments to the method
+    :return: What the method returned
+    """
+    _meth = getattr(state_db, 'a' + name, None)
+    if _meth is not None:
+        return await _meth(*args)
+    return getattr(state_db, name)(*args)
+
+
+class OverlayStateDataBase:
+    """
+    A state database that is put on top of another, possibly asynchronous,
+    state database while synchronous code is run against it.
+
+    Values have to be loaded, using :py:meth:`aload`, before the code is
+    run. If the code reads something that is not loaded it gets nothing back
+    and the read is recorded in :py:attr:`missing`. What the code writes is
+    kept in the overlay, so it can read its own writes, and applied to the
+    underlying database by :py:meth:`awrite_back`.
+
+    The overlay supports the same optional operations as the underlying
+    database. An *update* is applied to the underlying database with
+    *update*, which means that the function given to it is called once more
+    when it is written back.
+
+    Reads are expressed as tuples: ('get', key), ('fields', key) and
+    ('index', name, value).
+    """
+
+    def __init__(self, state_db):
+        self.state_db = state_db
+        self.native = getattr(state_db, 'native', False)
+        self.missing = set()
+        self.writes = []
+        # What has been read from the underlying database
+        self._loaded = {}
+        self._values = {}
+        self._fields = {}
+        self._index = {}
+
+        if supports(state_db, 'set_fields'):
+            self.get_fields = self._get_fields
+            self.set_fields = self._set_fields
+        if supports(state_db, 'index_add'):
+            self.index_add = self._index_add
+            self.index_get = self._index_get
+        if supports(state_db, 'expire_at'):
+            self.expire_at = self._expire_at
+        if supports(state_db, 'update'):
+            self.update = self._update
+
+    async def aload(self, reads):
+        """
+        Read from the underlying database. All the reads are done
+        concurrently and keys are read with one *get_many* if the database
+        supports it.
+
+        :param reads: A list of reads
+        """
+        _reads = [r for r in reads if r not in self._loaded]
+        _keys = [r[1] for r in _reads if r[0] == 'get']
+        _other = [r for r in _reads if r[0] != 'get']
+
+        _jobs = [self._aread(r) for r in _other]
+        _bulk = supports(self.state_db, 'get_many')
+        if _keys and _bulk:
+            _jobs.append(acall(self.state_db, 'get_many', _keys))
+        elif _keys:
+            _jobs.extend(acall(self.state_db, 'get', key) for key in _keys)
+        if not _jobs:
+            return
+
+        _result = await asyncio.gather(*_jobs)
+        for _read, _value in zip(_other, _result):
+            self._loaded[_read] = _value
+        if _keys:
+            _values = _result[-1] if _bulk else _result[len(_other):]
+            for _key, _value in zip(_keys, _values):
+                self._loaded[('get', _key)] = _value
+
+    async def _aread(self, read):
+        if read[0] == 'fields':
+            return await acall(self.state_db, 'get_fields', read[1])
+        return await acall(self.state_db, 'index_get', read[1], read[2])
+
+    def loaded(self, read):
+        """
+        :param read: A read
+        :return: What was loaded, None if nothing was found or the read has
+            not been done
+        """
+        return self._loaded.get(read) or None
+
+    def begin(self):
+        """
+        Start running code against what has been loaded. Forget about what
+        was written and missed before.
+        """
+        self.missing = set()
+        self.writes = []
+        self._values = {}
+        self._fields = {}
+        self._index = {}
+        for _read, _value in self._loaded.items():
+            if _read[0] == 'get':
+                self._values[_read[1]] = _value
+            elif _read[0] == 'fields':
+                self._fields[_read[1]] = copy.copy(_value)
+            else:
+                self._index[_read[1:]] = list(_value)
+
+    async def awrite_back(self):
+        """Apply what has been written to the underlying database."""
+        _db = self.state_db
+        for _name, _args in self.writes:
+            if _name == 'set_many' and not supports(_db, _name):
+                for key, value in _args[0].items():
+                    await acall(_db, 'set', key, value)
+            elif _name == 'delete_many' and not supports(_db, _name):
+                for key in _args[0]:
+                    await acall(_db, 'delete', key)
+            else:
+                await acall(_db, _name, *_args)
+        self.writes = []
+
+    def _miss(self, read):
+        if read not in self._loaded:
+            self.missing.add(read)
+
+    def _set_value(self, key, value):
+        self._values[key] = value
+        # The value replaces the fields
+        self._fields[key] = None if value is None else _as_fields(value)
+
+    def _remove(self, key):
+        self._values[key] = None
+        self._fields[key] = None
+        for _keys in self._index.values():
+            if key in _keys:
+                _keys.remove(key)
+
+    def set(self, key, value):
+        """Assign a value to a key."""
+        self.writes.append(('set', (key, value)))
+        self._set_value(key, value)
+
+    def get(self, key):
+        """Return the value bound to a key."""
+        try:
+            return self._values[key]
+        except KeyError:
+            self._miss(('get', key))
+            return None
+
+    def delete(self, key):
+        """Delete a key and its value."""
+        self.writes.append(('delete', (key,)))
+        self._remove(key)
+
+    def get_many(self, keys):
+        """Return the values bound to a number of keys."""
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items):
+        """Assign values to a number of keys."""
+        self.writes.append(('set_many', (dict(items),)))
+        for key, value in items.items():
+            self._set_value(key, value)
+
+    def delete_many(self, keys):
+        """Delete a number of keys and their values."""
+        self.writes.append(('delete_many', (list(keys),)))
+        for key in keys:
+            self._remove(key)
+
+    def _update(self, key, func):
+        self.writes.append(('update', (key, func)))
+        self._set_value(key, func(self.get(key)))
+
+    def _get_fields(self, key, fields=None):
+        try:
+            _val = self._fields[key]
+        except KeyError:
+            self._miss(('fields', key))
+            return None
+
+        if _val is None:
+            return None
+        if fields is None:
+            return _val.copy()
+        return {field: _val[field] for field in fields if field in _val}
+
+    def _set_fields(self, key, fields):
+        self.writes.append(('set_fields', (key, dict(fields))))
+        try:
+            _val = self._fields[key]
+        except KeyError:
+            # The other fields are not known
+            return
+
+        if _val is None:
+            self._fields[key] = dict(fields)
+        else:
+            _val.update(fields)
+
+    def _index_add(self, name, value, key):
+        self.writes.append(('index_add', (name, value, key)))
+        try:
+            _keys = self._index[(name, value)]
+        except KeyError:
+            return
+
+        if key in _keys:
+            _keys.remove(key)
+        _keys.append(key)
+
+    def _index_get(self, name, value):
+        try:
+            return list(self._index[(name, value)])
+        except KeyError:
+            self._miss(('index', name, value))
+            return []
+
+    def _expire_at(self, key, when):
+        self.writes.append(('expire_at', (key, when)))
+
+
+class KeyLocks:
+    """
+    asyncio locks for the keys of a state database. A key is locked while
+    code that reads it is run against an :py:class:`OverlayStateDataBase`
+    and what the code wrote is written back, so concurrent read-modify-write
+    operations on the same key do not lose each other's changes.
+    """
+
+    def __init__(self):
+        # key -> [lock, number of tasks holding or waiting for the lock]
+        self._locks = {}
+
+    async def acquire(self, keys):
+        """
+        Lock a number of keys. They are locked in a fixed order so tasks
+        locking overlapping sets of keys do not deadlock.
+
+        :param keys: The keys
+        :return: The keys that were locked, to be given to :py:meth:`release`
+        """
+        _keys = sorted(set(keys), key=repr)
+        _held = []
+        try:
+            for _key in _keys:
+                _item = self._locks.setdefault(_key, [asyncio.Lock(), 0])
+                _item[1] += 1
+                try:
+                    await _item[0].acquire()
+                except BaseException:
+                    self._unref(_key)
+                    raise
+                _held.append(_key)
+        except BaseException:
+            self.release(_held)
+            raise
+        return _held
+
+    def release(self, keys):
+        """
+        Unlock a number of keys.
+
+        :param keys: What :py:meth:`acquire` returned
+        """
+        for _key in keys:
+            self._locks[_key][0].release()
+            self._unref(_key)
+
+    def _unref(self, key):
+        _item = self._locks[key]
+        _item[1] -= 1
+        if not _item[1]:
+            del self._locks[key]
+
+
+_KEY_LOCKS = weakref.WeakKeyDictionary()
+
+
+def key_locks(state_db):
+    """
+    :param state_db: A state database
+    :return: The :py:class:`KeyLocks` of the state database
+    """
+    try:
+        return _KEY_LOCKS[state_db]
+    except KeyError:
+        _locks = _KEY_LOCKS[state_db] = KeyLocks()
+        return _locks
+
+
+def lock_key(read):
+    """
+    :param read: A read, as given to :py:meth:`OverlayStateDataBase.aload`
+    :return: What to lock before doing the read
+    """
+    if read[0] == 'index':
+        return read
+    return read[1]
+
+
+def _as_fields(value):
+    """The fields of a state that is assigned as a JSON document."""
+    if isinstance(value, str):
+        try:
+            _val = json.loads(value)
+        except ValueError:
+            return {}
+        if isinstance(_val, dict):
+            return _val
+    return {}
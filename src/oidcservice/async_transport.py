@@ -0,0 +1,205 @@
+"""
+Sending requests using asyncio.
+
+An asynchronous transport has the coroutine method *asend* which takes the
+same arguments as the *send* method of a transport, see
+:py:mod:`oidcservice.transport`, and returns a response with the attributes
+*status_code*, *text* and *headers*. This is what
+:py:meth:`oidcservice.service.Service.aservice_request` uses.
+
+A transport that only has *send* is run in an executor by an
+:py:class:`ExecutorTransport`.
+"""
+import asyncio
+import functools
+import logging
+import threading
+import time
+import weakref
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from oidcservice.exception import TransportError
+from oidcservice.transport import Timing
+from oidcservice.transport import origin
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ExecutorTransport:
+    """
+    Runs the *send* method of a synchronous transport in an executor, so
+    that the event loop is not blocked. The connection pools of the
+    synchronous transport are used. At most *max_per_host* requests to each
+    host are sent at the same time, the rest wait for their turn.
+    """
+
+    def __init__(self, transport, executor=None, max_per_host=10):
+        """
+        :param transport: A synchronous transport
+        :param executor: Where *send* is run. If not given the default
+            executor of the event loop is used.
+        :param max_per_host: The number of requests that may be sent to one
+            host at the same time
+        """
+        self.transport = transport
+        self.executor = executor
+        self.max_per_host = max_per_host
+        # A semaphore per host for each event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def send(self, url, **kwargs):
+        """The synchronous transport."""
+        return self.transport.send(url, **kwargs)
+
+    async def asend(self, url, method='GET', body=None, headers=None,
+                    issuer='', timeout=None):
+        """
+        Send a request and read the response.
+
+        :param url: Where to send the request
+        :param method: HTTP method
+        :param body: The body of the request, if any
+        :param headers: HTTP headers
+        :param issuer: The issuer ID of the OP
+        :param timeout: Overrides the timeout of the transport
+        :return: The response from the synchronous transport
+        """
+        _loop = asyncio.get_running_loop()
+        _host = origin(url)
+        _semaphores = self._semaphores.setdefault(_loop, {})
+        _semaphore = _semaphores.get(_host)
+        if _semaphore is None:
+            _semaphore = asyncio.Semaphore(self.max_per_host)
+            _semaphores[_host] = _semaphore
+
+        _send = functools.partial(self.transport.send, url, method=method,
+                                  body=body, headers=headers, issuer=issuer,
+                                  timeout=timeout)
+        async with _semaphore:
+            return await _loop.run_in_executor(self.executor, _send)
+
+
+class AiohttpResponse:
+    """What :py:class:`AiohttpTransport` returns."""
+
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+
+class AiohttpTransport:
+    """
+    A transport that uses aiohttp. Each issuer has its own session, and with
+    that its own pool of keep-alive connections. At most *max_per_host*
+    connections to each host are used at the same time.
+
+    Must be used from one event loop. Requires aiohttp.
+    """
+
+    def __init__(self, timeout=10, max_per_host=10, verify=True,
+                 on_timing=None):
+        """
+        :param timeout: Seconds to wait for the OP. None means forever.
+        :param max_per_host: The number of requests that may be sent to one
+            host at the same time
+        :param verify: Whether the TLS certificate of the OP should be
+            verified
+        :param on_timing: A function that is given a
+            :py:class:`oidcservice.transport.Timing` after each call
+        """
+        if aiohttp is None:
+            raise ImportError('AiohttpTransport requires aiohttp')
+
+        self.timeout = timeout
+        self.max_per_host = max_per_host
+        self.verify = verify
+        self.on_timing = on_timing
+        self._sessions = {}
+
+    def session(self, issuer):
+        """
+        :param issuer: The issuer ID of the OP
+        :return: The aiohttp session used for the issuer
+        """
+        _session = self._sessions.get(issuer)
+        if _session is None or _session.closed:
+            _connector = aiohttp.TCPConnector(
+                limit_per_host=self.max_per_host,
+                ssl=None if self.verify else False)
+            _session = aiohttp.ClientSession(connector=_connector)
+            self._sessions[issuer] = _session
+        return _session
+
+    async def asend(self, url, method='GET', body=None, headers=None,
+                    issuer='', timeout=None):
+        """
+        Send a request and read the response.
+
+        :param url: Where to send the request
+        :param method: HTTP method
+        :param body: The body of the request, if any
+        :param headers: HTTP headers
+        :param issuer: The issuer ID of the OP, decides which connection pool
+            is used. If not given the scheme, host and port of the URL is
+            used.
+        :param timeout: Overrides the timeout given when the transport was
+            created
+        :return: A :py:class:`AiohttpResponse` instance
+        """
+        if not issuer:
+            issuer = origin(url)
+        if timeout is None:
+            timeout = self.timeout
+
+        _start = time.perf_counter()
+        try:
+            async with self.session(issuer).request(
+                    method, url, data=body, headers=headers,
+                    timeout=aiohttp.ClientTimeout(total=timeout),
+                    allow_redirects=False) as _resp:
+                _text = await _resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+            LOGGER.error('%s %s failed: %s', method, url, err)
+            raise TransportError('{} {} failed: {}'.format(method, url, err))
+
+        if self.on_timing is not None:
+            self.on_timing(Timing(issuer, method, url.split('?', 1)[0],
+                                  _resp.status, time.perf_counter() - _start))
+        return AiohttpResponse(_resp.status, _text, _resp.headers)
+
+    async def aclose(self):
+        """Close all connections."""
+        _sessions = list(self._sessions.values())
+        self._sessions = {}
+        for _session in _sessions:
+            await _session.close()
+
+
+_EXECUTOR_TRANSPORTS = weakref.WeakKeyDictionary()
+_LOCK = threading.Lock()
+
+
+def async_transport(transport):
+    """
+    :param transport: A transport
+    :return: The transport if it is asynchronous, otherwise an
+        :py:class:`ExecutorTransport` running it. The same
+        ExecutorTransport is returned every time for a transport, so that
+        the number of requests per host is bounded for all its users.
+    """
+    if hasattr(transport, 'asend'):
+        return transport
+
+    with _LOCK:
+        _transport = _EXECUTOR_TRANSPORTS.get(transport)
+        if _transport is None:
+            _transport = ExecutorTransport(transport)
+            _EXECUTOR_TRANSPORTS[transport] = _transport
+        return _transport
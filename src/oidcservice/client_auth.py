@@ -30,7 +30,8 @@ class UnknownAuthnMethod(Exception):
 
 
 # ========================================================================
-def assertion_jwt(client_id, keys, audience, algorithm, lifetime=600):
+def assertion_jwt(client_id, keys, audience, algorithm, lifetime=600,
+                  crypto_executor=None):
     """
     Create a signed Json Web Token containing some information.
 
@@ -39,6 +40,8 @@ def assertion_jwt(client_id, keys, audience, algorithm, lifetime=600):
     :param audience: Who is the receivers for this assertion
     :param algorithm: Signing algorithm
     :param lifetime: The lifetime of the signed Json Web Token
+    :param crypto_executor: If given, a
+        :py:class:`oidcservice.crypto_executor.CryptoExecutor` that signs
     :return: A Signed Json Web Token
     """
     _now = utc_time_sans_frac()
@@ -46,10 +49,27 @@ def assertion_jwt(client_id, keys, audience, algorithm, lifetime=600):
     _token = AuthnToken(iss=client_id, sub=client_id,
                         aud=audience, jti=rndstr(32),
                         exp=_now + lifetime, iat=_now)
-    LOGGER.debug('AuthnToken: %s', _token.to_dict())
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug('AuthnToken: %s', _token.to_dict())
+    if crypto_executor is not None:
+        return crypto_executor.sign(_token.to_json(), algorithm, keys)
     return _token.to_jwt(key=keys, algorithm=algorithm)
 
 
+def basic_credentials(user, passwd):
+    """
+    The credentials for HTTP Basic authentication. The user and password
+    are URL encoded, joined with a ':' in between and then base 64 encoded.
+
+    :param user: The user
+    :param passwd: The password
+    :return: A (token, Authorization header value) tuple
+    """
+    credentials = "{}:{}".format(quote_plus(user), quote_plus(passwd))
+    _token = base64.urlsafe_b64encode(credentials.encode("utf-8")).decode("utf-8")
+    return _token, "Basic {}".format(_token)
+
+
 class ClientAuthnMethod:
     """
     Basic Client Authentication Method class.
@@ -101,6 +121,13 @@ class ClientSecretBasic(ClientAuthnMethod):
             user = service.service_context.client_id
         return user
 
+    def _get_credentials(self, request, service, **kwargs):
+        passwd = self._get_passwd(request, service, **kwargs)
+        user = self._get_user(service, **kwargs)
+        if service is None:
+            return basic_credentials(user, passwd)
+        return service.service_context.basic_credentials(user, passwd)
+
     def _get_authentication_token(self, request, service, **kwargs):
         """
         Return authentication Token.
@@ -112,11 +139,7 @@ class ClientSecretBasic(ClientAuthnMethod):
         :param kwargs: Extra key word arguments
         :return: An authentication token
         """
-        passwd = self._get_passwd(request, service, **kwargs)
-        user = self._get_user(service, **kwargs)
-
-        credentials = "{}:{}".format(quote_plus(user), quote_plus(passwd))
-        return base64.urlsafe_b64encode(credentials.encode("utf-8")).decode("utf-8")
+        return self._get_credentials(request, service, **kwargs)[0]
 
     @staticmethod
     def _with_or_without_client_id(request, service):
@@ -180,9 +203,8 @@ class ClientSecretBasic(ClientAuthnMethod):
         if "headers" not in http_args:
             http_args["headers"] = {}
 
-        _token = self._get_authentication_token(request, service, **kwargs)
-
-        http_args["headers"]["Authorization"] = "Basic {}".format(_token)
+        http_args["headers"]["Authorization"] = self._get_credentials(
+            request, service, **kwargs)[1]
 
         self.modify_request(request, service)
 
@@ -426,6 +448,13 @@ class JWSAuthnMethod(ClientAuthnMethod):
         raise MissingKey("No key with kid:%s" % kid)
 
     def _get_signing_key(self, algorithm, context, kid=None):
+        ktype = alg2keytype(algorithm)
+        _kid = kid or context.kid["sig"].get(ktype)
+        return context.cached_keys(
+            ('client_assertion', type(self).__name__, algorithm, _kid),
+            lambda: self._find_signing_key(algorithm, context, kid))
+
+    def _find_signing_key(self, algorithm, context, kid=None):
         ktype = alg2keytype(algorithm)
         try:
             if kid:
@@ -477,10 +506,16 @@ class JWSAuthnMethod(ClientAuthnMethod):
             _args = {'lifetime': kwargs['lifetime']}
         except KeyError:
             _args = {}
+            if _context.assertion_pool is not None:
+                _assertion = _context.assertion_pool.take(
+                    _context.client_id, signing_key, audience, algorithm)
+                if _assertion:
+                    return _assertion
 
         # construct the signed JWT with the assertions and add
         # it as value to the 'client_assertion' claim of the request
-        return assertion_jwt(_context.client_id, signing_key, audience, algorithm, **_args)
+        return assertion_jwt(_context.client_id, signing_key, audience, algorithm,
+                             crypto_executor=_context.crypto_executor, **_args)
 
     def modify_request(self, request, service, **kwargs):
         """
@@ -0,0 +1,238 @@
+"""
+Signing, verifying, encrypting and decrypting JSON Web Tokens in other
+processes.
+
+The cryptographic operations hold the GIL, so a client that uses threads to
+serve many users at the same time is limited to one core. With a
+:py:class:`CryptoExecutor` as the *crypto_executor* of the service context
+the operations are done by a pool of processes:
+
+- signing client assertions, with private_key_jwt and client_secret_jwt
+- signing and encrypting request objects
+- verifying and decrypting responses that are JSON Web Tokens, like signed
+  userinfo
+- verifying the signature of the ID Token in a response, the rest of the ID
+  Token is verified by the message classes in this process
+
+Every operation costs a round trip to a worker process, which is more than
+an RS256 verification takes. The executor only pays off if there are cores
+to spare for the workers, so there is none by default.
+benchmarks/bench_crypto_executor.py shows if it does on a given machine.
+
+The keys are picked in this process and sent to the workers by reference.
+A worker that does not have a key asks for it, after which it is kept, so
+a key is only serialized and imported once per worker.
+"""
+import hashlib
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from cryptojwt.jwe.jwe import JWE
+from cryptojwt.jwe.jwe import factory as jwe_factory
+from cryptojwt.jwk.jwk import key_from_jwk_dict
+from cryptojwt.jws.jws import JWS
+from cryptojwt.jws.jws import factory as jws_factory
+from cryptojwt.jwt import JWT
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+# How many keys a worker or the executor keeps
+MAX_KEYS = 256
+
+# In the worker processes, key reference -> key
+_WORKER_KEYS = {}
+
+
+class KeysMissing(Exception):
+    """A worker does not have all the keys it was asked to use."""
+
+
+def _worker_keys(refs, jwks):
+    if jwks is None:
+        try:
+            return [_WORKER_KEYS[ref] for ref in refs]
+        except KeyError:
+            raise KeysMissing()
+
+    _keys = []
+    for ref, jwk in zip(refs, jwks):
+        _key = _WORKER_KEYS.get(ref)
+        if _key is None:
+            if len(_WORKER_KEYS) >= MAX_KEYS:
+                _WORKER_KEYS.clear()
+            _key = key_from_jwk_dict(jwk)
+            _WORKER_KEYS[ref] = _key
+        _keys.append(_key)
+    return _keys
+
+
+def _sign(refs, jwks, msg, alg, headers):
+    return JWS(msg, alg=alg, **headers).sign_compact(_worker_keys(refs, jwks))
+
+
+def _verify(refs, jwks, token, allowed_algs):
+    _verifier = jws_factory(token, alg=allowed_algs or '')
+    if _verifier is None:
+        raise ValueError('Not a signed JSON Web Token')
+    return _verifier.verify_compact(token, _worker_keys(refs, jwks))
+
+
+def _encrypt(refs, jwks, msg, alg, enc, headers):
+    return JWE(msg, alg=alg, enc=enc, **headers).encrypt(
+        _worker_keys(refs, jwks))
+
+
+def _decrypt(refs, jwks, token, allowed_algs, allowed_encs):
+    _decryptor = jwe_factory(token, alg=allowed_algs or '',
+                             enc=allowed_encs or '')
+    if _decryptor is None:
+        raise ValueError('Not an encrypted JSON Web Token')
+    return _decryptor.decrypt(token, _worker_keys(refs, jwks))
+
+
+class CryptoExecutor:
+    """
+    Does JWS and JWE operations in a pool of processes. The methods block
+    until the result is there, without holding the GIL meanwhile.
+
+    Thread safe.
+    """
+
+    def __init__(self, max_workers=None, executor=None):
+        """
+        :param max_workers: The number of processes, by default the number
+            of CPUs
+        :param executor: A :py:class:`concurrent.futures.Executor` to use
+            instead of a new process pool
+        """
+        self.executor = executor or ProcessPoolExecutor(max_workers)
+        # id(key) -> (key, reference, serialized key)
+        self._serialized = OrderedDict()
+
+    def _refs(self, keys):
+        _refs = []
+        _jwks = []
+        for _key in keys:
+            try:
+                _item = self._serialized[id(_key)]
+            except KeyError:
+                _item = None
+            if _item is None or _item[0] is not _key:
+                _jwk = _key.serialize(private=True)
+                _ref = hashlib.sha256(
+                    json.dumps(_jwk, sort_keys=True).encode()).hexdigest()
+                # Keeps the key so that its id is not reused
+                _item = (_key, _ref, _jwk)
+                self._serialized[id(_key)] = _item
+                if len(self._serialized) > MAX_KEYS:
+                    self._serialized.popitem(last=False)
+            _refs.append(_item[1])
+            _jwks.append(_item[2])
+        return _refs, _jwks
+
+    def _call(self, func, keys, *args):
+        _refs, _jwks = self._refs(keys)
+        try:
+            return self.executor.submit(func, _refs, None, *args).result()
+        except KeysMissing:
+            return self.executor.submit(func, _refs, _jwks, *args).result()
+
+    def sign(self, msg, alg, keys, **headers):
+        """
+        :param msg: The payload
+        :param alg: The signing algorithm
+        :param keys: Keys to pick the signing key from
+        :param headers: Extra JWS headers
+        :return: A signed JSON Web Token
+        """
+        return self._call(_sign, keys, msg, alg, headers)
+
+    def verify(self, token, keys, allowed_algs=None):
+        """
+        :param token: A signed JSON Web Token
+        :param keys: Keys that can be used to verify the signature
+        :param allowed_algs: The signing algorithms that are accepted, by
+            default any
+        :return: The payload
+        """
+        return self._call(_verify, keys, token, allowed_algs)
+
+    def encrypt(self, msg, alg, enc, keys, **headers):
+        """
+        :param msg: The message
+        :param alg: The key encryption algorithm
+        :param enc: The content encryption algorithm
+        :param keys: Keys to pick the encryption key from
+        :param headers: Extra JWE headers
+        :return: An encrypted JSON Web Token
+        """
+        return self._call(_encrypt, keys, msg, alg, enc, headers)
+
+    def decrypt(self, token, keys, allowed_algs=None, allowed_encs=None):
+        """
+        :param token: An encrypted JSON Web Token
+        :param keys: Keys that can be used to decrypt it
+        :param allowed_algs: The key encryption algorithms that are accepted,
+            by default any
+        :param allowed_encs: The content encryption algorithms that are
+            accepted, by default any
+        :return: The decrypted message
+        """
+        return self._call(_decrypt, keys, token, allowed_algs, allowed_encs)
+
+    def shutdown(self, wait=True):
+        """Stop the worker processes."""
+        self.executor.shutdown(wait=wait)
+
+
+class OffloadedJWT(JWT):
+    """
+    A :py:class:`cryptojwt.jwt.JWT` that picks the keys from its key jar
+    and leaves signing, verifying and decrypting to a
+    :py:class:`CryptoExecutor`. JSON Web Tokens that are to be both signed
+    and encrypted are packed in this process.
+    """
+
+    def __init__(self, crypto_executor, **kwargs):
+        """
+        :param crypto_executor: A :py:class:`CryptoExecutor` instance
+        :param kwargs: The arguments of :py:class:`cryptojwt.jwt.JWT`
+        """
+        JWT.__init__(self, **kwargs)
+        self.crypto_executor = crypto_executor
+
+    def pack(self, payload=None, kid='', owner='', recv='', aud=None,
+             **kwargs):
+        if not self.sign or self.alg == 'none' or kwargs.get('encrypt',
+                                                             self.encrypt):
+            return JWT.pack(self, payload, kid, owner, recv, aud, **kwargs)
+
+        _args = {}
+        if payload is not None:
+            _args.update(payload)
+        _args.update(self.pack_init(recv, aud))
+        if self.with_jti:
+            _args['jti'] = kwargs.get('jti') or uuid.uuid4().hex
+
+        _key = self.pack_key(owner or self.iss, kid)
+        _args['kid'] = _key.kid
+        return self.crypto_executor.sign(json.dumps(_args), self.alg, [_key])
+
+    def _verify(self, rj, token):
+        keys = self.key_jar.get_jwt_verify_keys(rj.jwt)
+        return self.crypto_executor.verify(token, keys,
+                                           self.allowed_sign_algs)
+
+    def _decrypt(self, rj, token):
+        if self.iss:
+            keys = self.key_jar.get_jwt_decrypt_keys(rj.jwt, aud=self.iss)
+        else:
+            keys = self.key_jar.get_jwt_decrypt_keys(rj.jwt)
+        return self.crypto_executor.decrypt(token, keys,
+                                            self.allowed_enc_algs,
+                                            self.allowed_enc_encs)
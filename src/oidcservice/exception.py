@@ -57,6 +57,10 @@ class InvalidRequest(OidcServiceError):
     pass
 
 
+class StateConflict(OidcServiceError):
+    pass
+
+
 class NonFatalException(OidcServiceError):
     """
     :param resp: A response that the function/method would return on non-error
@@ -114,3 +118,7 @@ class WrongContentType(OidcServiceError):
 
 class WebFingerError(OidcServiceError):
     pass
+
+
+class TransportError(OidcServiceError):
+    pass
@@ -0,0 +1,270 @@
+"""A state database where the information has a limited lifetime."""
+import json
+import logging
+import threading
+from collections import deque
+
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.state_interface import INDEX_PATTERN
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import KEY_PATTERN
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+# The first and last characters of the keys that connect values to states
+_X_MARKS = {_pattern[:2] for _pattern in KEY_PATTERN.values()}
+_INDEX_MARK = INDEX_PATTERN[:3]
+
+
+def _is_x_key(key):
+    return len(key) >= 4 and key[:2] in _X_MARKS and key[:2] == key[-2:]
+
+
+def _is_index_key(key):
+    return len(key) >= 6 and key[:3] == _INDEX_MARK == key[-3:]
+
+
+def _is_ref_key(key):
+    return len(key) >= 6 and key[:3] == 'ref' == key[-3:]
+
+
+class ExpiringStateDataBase(InMemoryStateDataBase):
+    """
+    An in-memory state database where every key has an expiration time.
+
+    Every time a key is assigned a value its lifetime is extended to at least
+    *lifetime* seconds from now. So a login that is never finished will
+    disappear *lifetime* seconds after the last thing that happened to it.
+    A :py:class:`oidcservice.state_interface.StateInterface` will further
+    extend the lifetime of a state, and the keys connected to it, using
+    the *__expires_at* value of the responses it stores.
+
+    The keys the state interface connects to a state, its references and
+    the keys of the values connected to it, live at least as long as the
+    state. A value that is connected to a number of states may outlive some
+    of them. Reading it leaves out the states that have expired.
+
+    Expired keys are removed when someone tries to read them and by an
+    incremental sweeper that, every time a value is set, examines
+    *sweep_batch* keys in a round-robin fashion. Since more keys are
+    examined than are added, the number of expired keys that are kept
+    stays proportional to the number of keys that are alive, even if no
+    one ever reads the expired ones. A background thread doing full sweeps
+    can be started with :py:meth:`start_sweeper`.
+    """
+
+    def __init__(self, lifetime=600, sweep_batch=2):
+        """
+        :param lifetime: Default lifetime of a key in seconds.
+        :param sweep_batch: How many keys to examine per set operation.
+            Must be larger than 1 for the memory bound to hold.
+        """
+        InMemoryStateDataBase.__init__(self)
+        self.lifetime = lifetime
+        self.sweep_batch = sweep_batch
+        self._expires = {}
+        self._sweep_queue = deque()
+        self._queued = set()
+        self._lock = threading.RLock()
+        self._sweeper = None
+
+    def set(self, key, value):
+        """Assign a value to a key and extend the lifetime of the key."""
+        with self._lock:
+            self._set(key, value, time_sans_frac())
+            self._link(key)
+
+    def set_many(self, items):
+        """
+        Assign values to a number of keys and extend their lifetimes.
+
+        :param items: A dictionary with keys and values
+        """
+        _now = time_sans_frac()
+        with self._lock:
+            for key, value in items.items():
+                self._set(key, value, _now)
+            # Once all the keys are there
+            for key in items:
+                self._link(key)
+
+    def _set(self, key, value, now):
+        if key not in self._queued:
+            self._sweep_queue.append(key)
+            self._queued.add(key)
+        self._db[key] = value
+        self._expires[key] = max(self._expires.get(key, 0),
+                                 now + self.lifetime)
+        self._sweep(self.sweep_batch, now)
+
+    def get(self, key):
+        """
+        Return the value bound to a key. If the key has expired it is
+        removed and None is returned. States that have expired are left
+        out of the values that connect values to states.
+        """
+        with self._lock:
+            _now = time_sans_frac()
+            _value = self._get(key, _now)
+            if _value is None:
+                return None
+            if _is_index_key(key):
+                return self._live_index(_value, _now)
+            if _is_x_key(key) and not self._alive(_value, _now):
+                # The most recent state that is still there
+                _states = self._live_index(
+                    self._get(INDEX_PATTERN.format(key), _now), _now)
+                if _states is None:
+                    return None
+                return json.loads(_states)[-1]
+            return _value
+
+    def _get(self, key, now):
+        try:
+            _value = self._db[key]
+        except KeyError:
+            return None
+
+        if self._expires[key] <= now:
+            self._remove(key)
+            return None
+
+        return _value
+
+    def _alive(self, key, now):
+        return self._expires.get(key, 0) > now
+
+    def _live_index(self, value, now):
+        """Leave out the states that have expired from a list of states."""
+        if value is None:
+            return None
+        _states = json.loads(value)
+        _live = [_state for _state in _states if self._alive(_state, now)]
+        if not _live:
+            return None
+        if len(_live) == len(_states):
+            return value
+        return json.dumps(_live)
+
+    def _connected(self, state):
+        """The keys that are connected to a state."""
+        _ref_key = "ref{}ref".format(state)
+        _keys = [_ref_key]
+        _refs = self._db.get(_ref_key)
+        if _refs:
+            for xtyp, _x in json.loads(_refs).items():
+                _x_key = KEY_PATTERN[xtyp].format(_x)
+                _keys.extend([_x_key, INDEX_PATTERN.format(_x_key)])
+        return _keys
+
+    def _link(self, key):
+        """
+        Make sure the keys connected to a state do not expire before the
+        state does.
+        """
+        if _is_ref_key(key):
+            _state = key[3:-3]
+        elif _is_x_key(key) or _is_index_key(key):
+            # Set together with the references of the state
+            return
+        else:
+            _state = key
+
+        try:
+            _expires = self._expires[_state]
+        except KeyError:
+            return
+        for _key in self._connected(_state):
+            if _key in self._db and self._expires[_key] < _expires:
+                self._expires[_key] = _expires
+
+    def delete(self, key):
+        """Delete a key and its value."""
+        with self._lock:
+            self._remove(key)
+
+    def expire_at(self, key, when):
+        """
+        Make sure a key does not expire before *lifetime* seconds after a
+        specific time. This is used with the expiration time of an access
+        token which leaves the client time to refresh the token.
+        Will never shorten the lifetime of a key.
+
+        :param key: The key
+        :param when: Expiration time in seconds since the epoch
+        """
+        when += self.lifetime
+        with self._lock:
+            if key in self._db and self._expires[key] < when:
+                self._expires[key] = when
+                self._link(key)
+
+    def _remove(self, key):
+        try:
+            del self._db[key]
+        except KeyError:
+            pass
+        else:
+            del self._expires[key]
+
+    def _sweep(self, number, now):
+        """
+        Examine a number of keys, the ones examined the longest time ago.
+        Remove the expired ones.
+        """
+        _queue = self._sweep_queue
+        for _ in range(min(number, len(_queue))):
+            _key = _queue.popleft()
+            try:
+                _expires = self._expires[_key]
+            except KeyError:  # Already removed
+                self._queued.discard(_key)
+                continue
+
+            if _expires <= now:
+                self._remove(_key)
+                self._queued.discard(_key)
+            else:
+                _queue.append(_key)
+
+    def sweep(self):
+        """
+        Go through all keys and remove the expired ones.
+
+        :return: The number of keys removed
+        """
+        with self._lock:
+            _size = len(self._db)
+            self._sweep(len(self._sweep_queue), time_sans_frac())
+            return _size - len(self._db)
+
+    def start_sweeper(self, interval=60):
+        """
+        Start a background thread that does a full sweep every *interval*
+        seconds.
+        """
+        if self._sweeper is not None:
+            return
+
+        self._sweeper = threading.Event()
+        _thread = threading.Thread(target=self._background_sweep,
+                                   args=(self._sweeper, interval), daemon=True)
+        _thread.start()
+
+    def stop_sweeper(self):
+        """Stop the background sweeper thread."""
+        if self._sweeper is not None:
+            self._sweeper.set()
+            self._sweeper = None
+
+    def _background_sweep(self, stop, interval):
+        while not stop.wait(interval):
+            _removed = self.sweep()
+            if _removed:
+                LOGGER.debug('Removed %d expired keys', _removed)
+
+    def __len__(self):
+        return len(self._db)
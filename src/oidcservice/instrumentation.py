@@ -0,0 +1,149 @@
+"""
+Timing the stages of the request and response pipelines of a service.
+
+A service with a *stage_sink* reports, for each stage, a
+:py:class:`StageTiming` to it. A sink is any function that takes a
+StageTiming, like the *append* method of a list, or one of the sinks in this
+module. Services without a sink, the default, do not time anything.
+
+The stages are:
+
+pre_construct
+    One of the pre_construct functions, *hook* is the name of the function
+gather_request_args
+    :py:meth:`oidcservice.service.Service.gather_request_args`
+instantiate
+    Creating the request message
+post_construct
+    One of the post_construct functions, *hook* is the name of the function
+client_authn
+    Client authentication, *hook* is the name of the method
+serialize
+    Serializing the request into a URL and possibly a body
+deserialize
+    Deserializing the response
+verify
+    Verifying the response
+post_parse_response
+    :py:meth:`oidcservice.service.Service.post_parse_response`
+"""
+import logging
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+StageTiming = namedtuple('StageTiming',
+                         ['service_name', 'stage', 'hook', 'seconds'])
+
+
+def hook_name(func):
+    """
+    :param func: A pre_construct or post_construct function
+    :return: The name it is reported with
+    """
+    return getattr(func, '__name__', None) or type(func).__name__
+
+
+def instrument(services, sink):
+    """
+    Set the stage sink of a number of services.
+
+    :param services: A dictionary of services, like the one
+        :py:func:`oidcservice.service.init_services` returns
+    :param sink: The sink, None turns timing off
+    """
+    for _service in services.values():
+        _service.stage_sink = sink
+
+
+class LogSink:
+    """Logs every timing."""
+
+    def __init__(self, logger=LOGGER, level=logging.DEBUG):
+        """
+        :param logger: The logger to use
+        :param level: The log level to use
+        """
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, timing):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, '%s %s %s: %.1f us',
+                            timing.service_name, timing.stage, timing.hook,
+                            timing.seconds * 1e6)
+
+
+class Histogram:
+    """
+    Collects the timings in memory, as one histogram per service, stage and
+    hook. The buckets grow exponentially, each one is *factor* times wider
+    than the previous, so percentiles are correct to within that factor.
+
+    Thread safe.
+    """
+
+    def __init__(self, smallest=1e-6, largest=10.0, factor=1.25):
+        """
+        :param smallest: The upper bound, in seconds, of the first bucket
+        :param largest: Timings above this end up in the last bucket
+        :param factor: How much wider each bucket is than the previous one
+        """
+        self.bounds = []
+        _bound = smallest
+        while _bound < largest:
+            self.bounds.append(_bound)
+            _bound *= factor
+        self.bounds.append(largest)
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, timing):
+        _key = (timing.service_name, timing.stage, timing.hook)
+        _bucket = bisect_left(self.bounds, timing.seconds)
+        with self._lock:
+            _data = self._data.get(_key)
+            if _data is None:
+                # count, total, max and the buckets
+                _data = [0, 0.0, 0.0, [0] * (len(self.bounds) + 1)]
+                self._data[_key] = _data
+            _data[0] += 1
+            _data[1] += timing.seconds
+            if timing.seconds > _data[2]:
+                _data[2] = timing.seconds
+            _data[3][_bucket] += 1
+
+    def _percentile(self, buckets, count, percent):
+        _rank = count * percent / 100
+        _seen = 0
+        for _bucket, _count in enumerate(buckets):
+            _seen += _count
+            if _seen >= _rank:
+                return self.bounds[min(_bucket, len(self.bounds) - 1)]
+        return self.bounds[-1]
+
+    def summary(self):
+        """
+        :return: A dictionary with (service_name, stage, hook) as key and a
+            dictionary with count, mean, p50, p99 and max, in seconds, as
+            value. The percentiles are the upper bounds of their buckets.
+        """
+        with self._lock:
+            _items = [(k, v[0], v[1], v[2], list(v[3]))
+                      for k, v in self._data.items()]
+
+        return {
+            key: {'count': count, 'mean': total / count,
+                  'p50': min(self._percentile(buckets, count, 50), largest),
+                  'p99': min(self._percentile(buckets, count, 99), largest),
+                  'max': largest}
+            for key, count, total, largest, buckets in _items}
+
+    def clear(self):
+        """Forget all timings."""
+        with self._lock:
+            self._data = {}
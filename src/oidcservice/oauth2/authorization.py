@@ -1,5 +1,9 @@
 """The service that talks to the OAuth2 Authorization endpoint."""
 import logging
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
 
 from oidcmsg import oauth2
 from oidcmsg.exception import MissingParameter
@@ -10,6 +14,7 @@ from oidcservice.oauth2.utils import get_state_parameter
 from oidcservice.oauth2.utils import pick_redirect_uris
 from oidcservice.oauth2.utils import set_state_parameter
 from oidcservice.service import Service
+from oidcservice.util import get_http_url
 
 
 LOGGER = logging.getLogger(__name__)
@@ -24,6 +29,12 @@ class Authorization(Service):
     synchronous = False
     service_name = 'authorization'
     response_body_type = 'urlencoded'
+    # If the authorization URL is built from a template, see
+    # authorization_url
+    url_template = False
+    # The parameters that are expected to change with every request
+    dynamic_params = ['state', 'nonce', 'code_challenge', 'request',
+                      'request_uri']
 
     def __init__(self, service_context, state_db,
                  client_authn_factory=None, conf=None):
@@ -31,6 +42,9 @@ class Authorization(Service):
                          client_authn_factory=client_authn_factory, conf=conf)
         self.pre_construct.extend([pick_redirect_uris, set_state_parameter])
         self.post_construct.append(self.store_auth_request)
+        if conf and 'url_template' in conf:
+            self.url_template = conf['url_template']
+        self._template = None
 
     def update_service_context(self, resp, key='', **kwargs):
         if 'expires_in' in resp:
@@ -54,6 +68,104 @@ class Authorization(Service):
 
         return ar_args
 
+    def _request_info(self, request, method, endpoint_url, content_type,
+                      headers):
+        if not self.url_template or method != 'GET':
+            return Service._request_info(request, method, endpoint_url,
+                                         content_type, headers)
+
+        _info = {'method': method,
+                 'url': self.authorization_url(endpoint_url, request)}
+        if headers:
+            _info['headers'] = headers
+        return _info
+
+    def _make_template(self, endpoint_url, request):
+        """
+        Encode the parameters that are not expected to change, together with
+        the query part of the endpoint URL, if there is one.
+
+        :return: A template or None if one can not be used
+        """
+        comp = urlsplit(str(endpoint_url))
+        # A copy, so that changing a value in place does not go unnoticed
+        _req = request.copy()
+        for param in self.dynamic_params:
+            if param in _req:
+                del _req[param]
+        _static = dict(_req.items())
+        if comp.query:
+            _query = parse_qs(comp.query)
+            if any(param in _query for param in self.dynamic_params):
+                return None
+            _req.update(_query)
+        _req.lax = True
+
+        _prefix = urlunsplit((comp.scheme, comp.netloc, comp.path, '', ''))
+        _suffix = '#' + comp.fragment if comp.fragment else ''
+        _required = [param for param in self.dynamic_params
+                     if request.c_param.get(param, (0, False))[1]]
+        return (endpoint_url, type(request), _static,
+                '{}?{}'.format(_prefix, _req.to_urlencoded()), _suffix,
+                _required)
+
+    def _get_template(self, endpoint_url, request, static):
+        """
+        The template for an endpoint URL, message class and values of the
+        parameters that are not dynamic. A new one is made if any of them
+        has changed.
+
+        :return: The template or None if no template can be made
+        """
+        _template = self._template
+        if _template is None or _template[0] != endpoint_url or \
+                _template[1] is not type(request) or _template[2] != static:
+            _template = self._make_template(endpoint_url, request)
+            if _template is not None:
+                self._template = _template
+        return _template
+
+    def authorization_url(self, endpoint_url, request):
+        """
+        The URL the user agent is redirected to. Same as
+        :py:func:`oidcservice.util.get_http_url` but the parameters that
+        are not in *dynamic_params*, like client_id, redirect_uri, scope and
+        response_type, are encoded once and reused as long as their values,
+        the endpoint URL and the message class are the same. Only the
+        values of the dynamic parameters are encoded for each request. The
+        parameters may come in another order than with get_http_url.
+
+        :param endpoint_url: The authorization endpoint
+        :param request: The authorization request, a Message class instance
+        :return: The URL
+        """
+        _static = {}
+        _dynamic = []
+        for key, val in request.items():
+            if key not in self.dynamic_params:
+                _static[key] = val
+            elif isinstance(val, str):
+                _dynamic.append((key, val))
+            else:
+                return get_http_url(endpoint_url, request)
+
+        _template = self._get_template(endpoint_url, request, _static)
+        if _template is None:
+            return get_http_url(endpoint_url, request)
+
+        _url, _suffix, _required = _template[3:]
+        for param in _required:
+            if param not in request:
+                # Let the message class complain
+                return get_http_url(endpoint_url, request)
+        if _dynamic:
+            if _url[-1] != '?':
+                _url += '&'
+            _url += urlencode(_dynamic)
+        elif _url[-1] == '?':
+            return endpoint_url
+        return _url + _suffix
+
     def post_parse_response(self, response, **kwargs):
         """
         Add scope claim to response, from the request, if not present in the
@@ -140,6 +140,7 @@ class ProviderInfoDiscovery(Service):
             _keyjar.load_keys(_pcr_issuer, jwks=resp['jwks'])
 
         self.service_context.keyjar = _keyjar
+        self.service_context.keys_changed()
 
     def update_service_context(self, resp, **kwargs):
         return self._update_service_context(resp)
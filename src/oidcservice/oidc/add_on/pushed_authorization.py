@@ -59,7 +59,8 @@ def add_pushed_authorization_support(services, body_format="jws", signing_algort
     """
 
     if http_client is None:
-        http_client = requests
+        # A session so that connections to the OP are reused
+        http_client = requests.Session()
 
     _service = services["authorization"]
     _service.service_context.add_on['pushed_authorization'] = {
@@ -1,11 +1,17 @@
 import logging
 
+from cryptojwt.jwt import JWT
+from cryptojwt.jwt import pick_key
+from cryptojwt.jws.utils import alg2keytype
+from cryptojwt.key_bundle import KeyBundle
+from cryptojwt.key_jar import KeyJar
 from oidcmsg import oidc
 from oidcmsg.oidc import make_openid_request
 from oidcmsg.oidc import verified_claim_name
 from oidcmsg.time_util import time_sans_frac
 
 from oidcservice import rndstr
+from oidcservice.crypto_executor import OffloadedJWT
 from oidcservice.exception import ParameterError
 from oidcservice.oauth2 import authorization
 from oidcservice.oidc import IDT2REG
@@ -141,13 +147,42 @@ class Authorization(authorization.Authorization):
         fid.close()
         return _webname
 
+    def request_object_keys(self, alg):
+        """
+        The keys to sign a request object with. A key jar with only the key
+        that would be picked from all the keys, the one with the signing key
+        ID of the service context if there is one, cached in the service
+        context.
+
+        :param alg: The signing algorithm
+        :return: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        """
+        _context = self.service_context
+        _kid = _context.kid['sig'].get(alg2keytype(alg), '')
+
+        def resolve():
+            _keys = pick_key(
+                JWT(key_jar=_context.keyjar).my_keys(_context.client_id),
+                'sig', alg=alg, kid=_kid)
+            if not _keys:
+                # Lets the signing fail as it always has
+                return _context.keyjar
+            _bundle = KeyBundle()
+            _bundle.append(_keys[0])
+            _keyjar = KeyJar()
+            _keyjar.add_kb('', _bundle)
+            return _keyjar
+
+        return _context.cached_keys(('request_object', alg, _kid), resolve,
+                                    owner=_context.client_id)
+
     def construct_request_parameter(self, req, request_method, **kwargs):
         """Construct a request parameter"""
         alg = self.get_request_object_signing_alg(**kwargs)
         kwargs["request_object_signing_alg"] = alg
 
         if "keys" not in kwargs and alg and alg != "none":
-            kwargs["keys"] = self.service_context.keyjar
+            kwargs["keys"] = self.request_object_keys(alg)
 
         _srv_cntx = self.service_context
         kwargs['issuer'] = _srv_cntx.client_id
@@ -157,7 +192,14 @@ class Authorization(authorization.Authorization):
             kwargs['recv'] = _srv_cntx.issuer
         del kwargs['service']
 
-        _req = make_openid_request(req, **kwargs)
+        if _srv_cntx.crypto_executor is None or 'keys' not in kwargs:
+            _req = make_openid_request(req, **kwargs)
+        else:
+            _jwt = OffloadedJWT(_srv_cntx.crypto_executor,
+                                key_jar=kwargs['keys'], iss=kwargs['issuer'],
+                                sign_alg=alg)
+            _req = _jwt.pack(req.to_dict(), owner=kwargs['issuer'],
+                             recv=kwargs['recv'])
 
         # Should the request be encrypted
         _req = request_object_encryption(_req, self.service_context,
@@ -173,6 +173,5 @@ class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
             if key not in PREFERENCE2PROVIDER:
                 self.service_context.behaviour[key] = val
 
-        logger.debug(
-            'service_context behaviour: {}'.format(
-                self.service_context.behaviour))
+        logger.debug('service_context behaviour: %s',
+                     self.service_context.behaviour)
@@ -60,6 +60,10 @@ def request_object_encryption(msg, service_context, **kwargs):
         _keys = service_context.keyjar.get_encrypt_key(_kty,
                                                        owner=kwargs["target"])
 
+    if service_context.crypto_executor is not None:
+        _headers = {'kid': _kid} if _kid else {}
+        return service_context.crypto_executor.encrypt(msg, encalg, encenc,
+                                                       _keys, **_headers)
     return _jwe.encrypt(_keys)
 
 
@@ -1,21 +1,31 @@
 """ The basic Service class upon which all the specific services are built. """
+import asyncio
+import copy
 import logging
+from functools import partial
+from time import perf_counter
 from urllib.parse import urlparse
 
+from cryptojwt.jws.exception import NoSuitableSigningKeys
+from cryptojwt.jws.jws import factory as jws_factory
 from cryptojwt.jwt import JWT
 from oidcmsg.message import Message
 from oidcmsg.oauth2 import ResponseMessage
 from oidcmsg.oauth2 import is_error_message
+from oidcmsg.oidc import verified_claim_name
 
 from oidcservice import util
 from oidcservice.client_auth import factory as ca_factory
+from oidcservice.crypto_executor import OffloadedJWT
 from oidcservice.exception import ResponseError
+from oidcservice.instrumentation import StageTiming
+from oidcservice.instrumentation import hook_name
 from oidcservice.state_interface import StateInterface
-from oidcservice.util import JOSE_ENCODED
-from oidcservice.util import JSON_ENCODED
-from oidcservice.util import URL_ENCODED
+from oidcservice.state_interface import state_cached
+from oidcservice.util import get_content_type
 from oidcservice.util import get_http_body
 from oidcservice.util import get_http_url
+from oidcservice.util import get_response_body_type
 
 __author__ = 'Roland Hedberg'
 
@@ -27,6 +37,73 @@ SPECIAL_ARGS = ['authn_endpoint', 'algs']
 
 REQUEST_INFO = 'Doing request with: URL:{}, method:{}, data:{}, https_args:{}'
 
+# How responses are verified, see Service.verification
+VERIFY_FULL = 'full'
+VERIFY_DEFERRED = 'deferred'
+VERIFY_SKIP = 'skip'
+
+
+class DeferredVerification(object):
+    """
+    A response whose verification has been deferred until it is read.
+    Reading a claim, or using any other method of the response, verifies it
+    first. If the verification fails the exception is raised every time the
+    response is read.
+
+    The verification arguments, and the key jar among them, are shared by
+    copies of the response, not copied.
+    """
+
+    def __init__(self, response, verify):
+        """
+        :param response: The response, a Message class instance
+        :param verify: A function that verifies the response, raising an
+            exception if it does not verify
+        """
+        self.unverified = response
+        self._verify = verify
+        self._verified = False
+
+    def message(self):
+        """
+        :return: The response, verified
+        """
+        if not self._verified:
+            self._verify(self.unverified)
+            self._verified = True
+        return self.unverified
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.message(), name)
+
+    def __getitem__(self, item):
+        return self.message()[item]
+
+    def __setitem__(self, item, value):
+        self.message()[item] = value
+
+    def __contains__(self, item):
+        return item in self.message()
+
+    def __iter__(self):
+        return iter(self.message())
+
+    def __len__(self):
+        return len(self.message())
+
+    def __copy__(self):
+        _copy = DeferredVerification(copy.copy(self.unverified), self._verify)
+        _copy._verified = self._verified
+        return _copy
+
+    def __deepcopy__(self, memo):
+        _copy = DeferredVerification(copy.deepcopy(self.unverified, memo),
+                                     self._verify)
+        _copy._verified = self._verified
+        return _copy
+
 
 class Service(StateInterface):
     """The basic Service class."""
@@ -41,6 +118,13 @@ class Service(StateInterface):
     http_method = 'GET'
     request_body_type = 'urlencoded'
     response_body_type = 'json'
+    # Sends the requests, see oidcservice.transport
+    transport = None
+    # Gets the timing of each stage, see oidcservice.instrumentation
+    stage_sink = None
+    # How responses are verified: VERIFY_FULL, VERIFY_DEFERRED until a
+    # claim is read, or VERIFY_SKIP
+    verification = VERIFY_FULL
 
     def __init__(self, service_context, state_db, conf=None,
                  client_authn_factory=None, **kwargs):
@@ -57,7 +141,8 @@ class Service(StateInterface):
             self.conf = conf
             for param in ['msg_type', 'response_cls', 'error_msg',
                           'default_authn_method', 'http_method',
-                          'request_body_type', 'response_body_type']:
+                          'request_body_type', 'response_body_type',
+                          'verification']:
                 if param in conf:
                     setattr(self, param, conf[param])
         else:
@@ -67,6 +152,16 @@ class Service(StateInterface):
         self.pre_construct = []
         self.post_construct = []
 
+        # Where gather_request_args finds each claim, see
+        # _request_args_plan
+        self._plan = None
+        self._plan_sources = None
+        # The JWT instance that unpacks responses, see _jwt_unpacker
+        self._unpacker = None
+        # The compiled pre_construct and post_construct lists, see
+        # _hook_chain
+        self._chains = {}
+
     def gather_request_args(self, **kwargs):
         """
         Go through the attributes that the message class can contain and
@@ -84,27 +179,70 @@ class Service(StateInterface):
         # 1. A keyword argument
         # 2. configured set of default attribute values
         # 3. default attribute values defined in the OIDC standard document
-        for prop in self.msg_type.c_param:
+        _context = self.service_context
+        for prop, source in self._request_args_plan():
             if prop in ar_args:
                 continue
-
-            try:
-                ar_args[prop] = getattr(self.service_context, prop)
-            except AttributeError:
-                try:
-                    ar_args[prop] = self.conf['request_args'][prop]
-                except KeyError:
-                    try:
-                        ar_args[prop] = self.service_context.register_args[
-                            prop]
-                    except KeyError:
-                        try:
-                            ar_args[prop] = self.default_request_args[prop]
-                        except KeyError:
-                            pass
+            if source is None:
+                ar_args[prop] = getattr(_context, prop)
+            else:
+                ar_args[prop] = source[prop]
 
         return ar_args
 
+    def _request_args_sources(self):
+        """
+        The places where gather_request_args looks for values, in order of
+        priority: the service context attributes, the configured request
+        arguments, the registration arguments and the default request
+        arguments.
+        """
+        _context = self.service_context
+        return [vars(_context), self.conf.get('request_args'),
+                _context.register_args, self.default_request_args]
+
+    def _request_args_plan(self):
+        """
+        Which claims of the message class that have a value and where that
+        value is found. The plan is compiled once and used until the
+        message class, the service context or one of the places where values
+        are found is replaced or gets a new set of keys. Values are always
+        read when the request is constructed, so changing a value does not
+        require a new plan.
+
+        :return: A list of (claim name, place) tuples in the order of the
+            message class claims. The place is a dictionary or None if the
+            value is a class attribute of the service context.
+        """
+        _sources = self._request_args_sources()
+        _known = self._plan_sources
+        if _known is not None and _known[0] is self.msg_type:
+            for source, (_source, _keys) in zip(_sources, _known[1]):
+                if source is not _source or (
+                        source is not None and source.keys() != _keys):
+                    break
+            else:
+                return self._plan
+
+        _context_cls = type(self.service_context)
+        _plan = []
+        for prop in self.msg_type.c_param:
+            # Class attributes, like properties, are read with getattr
+            if hasattr(_context_cls, prop):
+                _plan.append((prop, None))
+                continue
+            for source in _sources:
+                if source is not None and prop in source:
+                    _plan.append((prop, source))
+                    break
+
+        self._plan = _plan
+        self._plan_sources = (
+            self.msg_type,
+            [(source, None if source is None else set(source.keys()))
+             for source in _sources])
+        return _plan
+
     def method_args(self, context, **kwargs):
         """
         Collect the set of arguments that should be used by a set of methods
@@ -121,6 +259,44 @@ class Service(StateInterface):
             _args.update(kwargs)
         return _args
 
+    def _hook_args(self, context, kwargs):
+        """
+        Like :py:meth:`method_args` but without copying when there is
+        nothing to merge. The result must not be modified.
+
+        :param context: 'pre_construct' or 'post_construct'
+        :param kwargs: The keyword arguments added at run-time
+        :return: A dictionary of keyword arguments
+        """
+        _static = self.conf.get(context)
+        if not _static:
+            return kwargs
+        if not kwargs:
+            return _static
+
+        _args = _static.copy()
+        _args.update(kwargs)
+        return _args
+
+    def _hook_chain(self, context):
+        """
+        The functions in the pre_construct or post_construct list together
+        with the names they are reported with, see
+        :py:mod:`oidcservice.instrumentation`. Compiled once and used until
+        the list is replaced or changed.
+
+        :param context: 'pre_construct' or 'post_construct'
+        :return: A tuple of (function, name) tuples
+        """
+        _hooks = getattr(self, context)
+        _known = self._chains.get(context)
+        if _known is not None and _known[0] is _hooks and _known[1] == _hooks:
+            return _known[2]
+
+        _chain = tuple((meth, hook_name(meth)) for meth in _hooks)
+        self._chains[context] = (_hooks, list(_hooks), _chain)
+        return _chain
+
     def do_pre_construct(self, request_args, **kwargs):
         """
         Will run the pre_construct methods one by one in the order given.
@@ -131,13 +307,21 @@ class Service(StateInterface):
             used by the post_construct methods.
         """
 
-        _args = self.method_args('pre_construct', **kwargs)
-        post_args = {}
-        for meth in self.pre_construct:
+        _args = self._hook_args('pre_construct', kwargs)
+        post_args = None
+        _sink = self.stage_sink
+        for meth, name in self._hook_chain('pre_construct'):
+            _start = perf_counter() if _sink else 0
             request_args, _post_args = meth(request_args, service=self, **_args)
-            post_args.update(_post_args)
+            if _sink:
+                self._report(_sink, 'pre_construct', _start, name)
+            if _post_args:
+                if post_args is None:
+                    post_args = dict(_post_args)
+                else:
+                    post_args.update(_post_args)
 
-        return request_args, post_args
+        return request_args, post_args or {}
 
     def do_post_construct(self, request_args, **kwargs):
         """
@@ -147,13 +331,29 @@ class Service(StateInterface):
         :param kwargs: Arguments used by the post_construct method
         :return: Possible modified set of request arguments.
         """
-        _args = self.method_args('post_construct', **kwargs)
+        _args = self._hook_args('post_construct', kwargs)
 
-        for meth in self.post_construct:
+        _sink = self.stage_sink
+        for meth, name in self._hook_chain('post_construct'):
+            _start = perf_counter() if _sink else 0
             request_args = meth(request_args, service=self, **_args)
+            if _sink:
+                self._report(_sink, 'post_construct', _start, name)
 
         return request_args
 
+    def _report(self, sink, stage, start, hook=''):
+        """
+        Report the time used by a stage.
+
+        :param sink: Where to report it
+        :param stage: The name of the stage
+        :param start: When the stage started, from time.perf_counter
+        :param hook: The name of the function or method run in the stage
+        """
+        sink(StageTiming(self.service_name, stage, hook,
+                         perf_counter() - start))
+
     def update_service_context(self, resp, key='', **kwargs):
         """
         A method run after the response has been parsed and verified.
@@ -163,6 +363,7 @@ class Service(StateInterface):
         :param kwargs: Extra key word arguments
         """
 
+    @state_cached
     def construct(self, request_args=None, **kwargs):
         """
         Instantiate the request as a message class instance with
@@ -189,13 +390,21 @@ class Service(StateInterface):
             if 'state' not in request_args:
                 request_args['state'] = kwargs['state']
 
+        _sink = self.stage_sink
+
         # logger.debug("request_args: %s" % sanitize(request_args))
+        _start = perf_counter() if _sink else 0
         _args = self.gather_request_args(**request_args)
+        if _sink:
+            self._report(_sink, 'gather_request_args', _start)
 
         # logger.debug("kwargs: %s" % sanitize(kwargs))
         # initiate the request as in an instance of the self.msg_type
         # message type
+        _start = perf_counter() if _sink else 0
         request = self.msg_type(**_args)
+        if _sink:
+            self._report(_sink, 'instantiate', _start)
 
         return self.do_post_construct(request, **post_args)
 
@@ -280,6 +489,7 @@ class Service(StateInterface):
         """
         return self.default_authn_method
 
+    @state_cached
     def get_request_parameters(self, request_args=None, method="",
                                request_body_type="", authn_method='', **kwargs):
         """
@@ -310,18 +520,28 @@ class Service(StateInterface):
             request_body_type = self.request_body_type
 
         request = self.construct_request(request_args=request_args, **kwargs)
-        LOGGER.debug("Request: ", request)
-        _info = {'method': method}
+        LOGGER.debug("Request: %s", request)
 
-        _args = kwargs.copy()
-        if self.service_context.issuer:
-            _args['iss'] = self.service_context.issuer
+        _sink = self.stage_sink
 
         # Client authentication by usage of the Authorization HTTP header
         # or by modifying the request object
-        _headers = self.get_authn_header(request, authn_method,
-                                         authn_endpoint=self.endpoint_name,
-                                         **_args)
+        _start = perf_counter() if _sink else 0
+        _issuer = self.service_context.issuer
+        if _issuer and 'iss' not in kwargs:
+            _headers = self.get_authn_header(
+                request, authn_method, authn_endpoint=self.endpoint_name,
+                iss=_issuer, **kwargs)
+        else:
+            _args = kwargs
+            if _issuer:
+                _args = kwargs.copy()
+                _args['iss'] = _issuer
+            _headers = self.get_authn_header(
+                request, authn_method, authn_endpoint=self.endpoint_name,
+                **_args)
+        if _sink and authn_method:
+            self._report(_sink, 'client_authn', _start, authn_method)
 
         # Find out where to send this request
         try:
@@ -329,26 +549,159 @@ class Service(StateInterface):
         except KeyError:
             endpoint_url = self.get_endpoint()
 
-        _info['url'] = get_http_url(endpoint_url, request, method=method)
+        _start = perf_counter() if _sink else 0
+        _info = self._request_info(request, method, endpoint_url,
+                                   get_content_type(request_body_type),
+                                   _headers)
+        if _sink:
+            self._report(_sink, 'serialize', _start)
+        return _info
+
+    @staticmethod
+    def _request_info(request, method, endpoint_url, content_type, headers):
+        """
+        Serialize a request and put together the information needed to send
+        it.
+
+        :param request: The request, a Message class instance
+        :param method: HTTP method used
+        :param endpoint_url: Where the request should be sent
+        :param content_type: How the body, if there is to be one, should be
+            serialized
+        :param headers: HTTP headers
+        :return: Dictionary with the necessary information for the HTTP
+            request
+        """
+        _info = {'method': method,
+                 'url': get_http_url(endpoint_url, request, method=method)}
 
         # If there is to be a body part
         if method == 'POST':
-            # How should it be serialized
-            if request_body_type == 'urlencoded':
-                content_type = URL_ENCODED
-            elif request_body_type in ['jws', 'jwe', 'jose']:
-                content_type = JOSE_ENCODED
-            else:  # request_body_type == 'json'
-                content_type = JSON_ENCODED
-
             _info['body'] = get_http_body(request, content_type)
-            _headers.update({'Content-Type': content_type})
+            headers.update({'Content-Type': content_type})
 
-        if _headers:
-            _info['headers'] = _headers
+        if headers:
+            _info['headers'] = headers
 
         return _info
 
+    def get_request_parameters_batch(self, requests, method="",
+                                     request_body_type="", authn_method='',
+                                     **kwargs):
+        """
+        Builds requests for a number of states, for instance when refreshing
+        the access tokens of many sessions.
+
+        What is the same for all the requests, the HTTP method, the client
+        authentication method, the endpoint and the content type, is worked
+        out once. The requests are built one at a time, as they are asked
+        for.
+
+        A request that can not be built does not stop the batch. The
+        exception is yielded in its place and the following requests are
+        built as usual.
+
+        :param requests: An iterable of (state, request_args) tuples.
+            request_args may be None.
+        :param request_body_type: Which serialization to use for the HTTP body
+        :param method: HTTP method used.
+        :param authn_method: Client authentication method
+        :param kwargs: extra keyword arguments, used for all the requests. A
+            *state* among them is ignored, the state of each request is used.
+        :return: A generator that yields, for each state, the dictionary
+            :py:meth:`get_request_parameters` would have returned or the
+            exception that was raised while building the request
+        """
+        kwargs.pop('state', None)
+        if type(self).get_request_parameters is not \
+                Service.get_request_parameters:
+            # The service builds its requests in its own way
+            _options = {'method': method,
+                        'request_body_type': request_body_type,
+                        'authn_method': authn_method}
+            kwargs.update((k, v) for k, v in _options.items() if v)
+            _build = self._batch_request_by_service
+        else:
+            _build = self._batch_request_builder(method, request_body_type,
+                                                 authn_method, kwargs)
+
+        for state, request_args in requests:
+            try:
+                _info = _build(state, request_args, kwargs)
+            except Exception as err:
+                LOGGER.debug('Could not build request for state %s: %s',
+                             state, err)
+                _info = err
+            yield _info
+
+    def _batch_request_by_service(self, state, request_args, kwargs):
+        return self.get_request_parameters(request_args=request_args,
+                                           state=state, **kwargs)
+
+    def _batch_request_builder(self, method, request_body_type, authn_method,
+                               kwargs):
+        """
+        Work out what is the same for all the requests of a batch.
+
+        :return: A function that builds the request for one state
+        """
+        if not method:
+            method = self.http_method
+        if not authn_method:
+            authn_method = self.get_authn_method()
+        if not request_body_type:
+            request_body_type = self.request_body_type
+        content_type = get_content_type(request_body_type)
+
+        _args = kwargs.copy()
+        if self.service_context.issuer:
+            _args['iss'] = self.service_context.issuer
+        _args['authn_endpoint'] = self.endpoint_name
+
+        try:
+            endpoint_url = kwargs['endpoint']
+        except KeyError:
+            endpoint_url = self.get_endpoint()
+
+        # Use one client authentication instance for all the requests unless
+        # the service does client authentication in its own way
+        _client_authn = None
+        _cls = type(self)
+        if authn_method and \
+                _cls.get_authn_header is Service.get_authn_header and \
+                _cls.init_authentication_method is \
+                Service.init_authentication_method:
+            LOGGER.debug('Client authn method: %s', authn_method)
+            _client_authn = self.client_authn_factory(authn_method)
+
+        return partial(self._batch_request, method, authn_method,
+                       content_type, endpoint_url, _client_authn, _args)
+
+    def _batch_request(self, method, authn_method, content_type, endpoint_url,
+                       client_authn, authn_args, state, request_args, kwargs):
+        _sink = self.stage_sink
+        with self.state_cache():
+            request = self.construct_request(request_args=request_args,
+                                             state=state, **kwargs)
+
+            _start = perf_counter() if _sink else 0
+            if client_authn is None:
+                _headers = self.get_authn_header(request, authn_method,
+                                                 state=state, **authn_args)
+            else:
+                _h_args = client_authn.construct(request, self, http_args={},
+                                                 state=state, **authn_args)
+                _headers = _h_args.get('headers', {})
+            if _sink and authn_method:
+                self._report(_sink, 'client_authn', _start, authn_method)
+
+            _start = perf_counter() if _sink else 0
+            _info = self._request_info(request, method, endpoint_url,
+                                       content_type, _headers)
+            if _sink:
+                self._report(_sink, 'serialize', _start)
+        return _info
+
     # ------------------ response handling -----------------------
 
     @staticmethod
@@ -393,15 +746,37 @@ class Service(StateInterface):
                   'verify': True}
         return kwargs
 
+    def _jwt_unpacker(self):
+        """
+        The JWT instance that unpacks responses. It is reused until the
+        allowed algorithms, the key jar, the client ID or the crypto
+        executor changes. Keys are looked up in the key jar for each
+        response, so adding or removing keys does not require a new instance.
+
+        :return: A :py:class:`cryptojwt.jwt.JWT` instance
+        """
+        _context = self.service_context
+        _keyjar = _context.keyjar
+        _config = (_context.client_id,) + _context.get_jwt_algs(
+            self.service_name) + (_context.crypto_executor,)
+        if self._unpacker is not None:
+            _jwt, _known_keyjar, _known_config = self._unpacker
+            if _keyjar is _known_keyjar and _config == _known_config:
+                return _jwt
+
+        _args = {'key_jar': _keyjar, 'allowed_sign_algs': _config[1],
+                 'allowed_enc_algs': _config[2],
+                 'allowed_enc_encs': _config[3]}
+        if _config[4] is None:
+            _jwt = JWT(**_args)
+        else:
+            _jwt = OffloadedJWT(_config[4], **_args)
+        _jwt.iss = _config[0]
+        self._unpacker = (_jwt, _keyjar, _config)
+        return _jwt
+
     def _do_jwt(self, info):
-        args = {'allowed_sign_algs':
-                    self.service_context.get_sign_alg(self.service_name)}
-        enc_algs = self.service_context.get_enc_alg_enc(self.service_name)
-        args['allowed_enc_algs'] = enc_algs['alg']
-        args['allowed_enc_encs'] = enc_algs['enc']
-        _jwt = JWT(key_jar=self.service_context.keyjar, **args)
-        _jwt.iss = self.service_context.client_id
-        return _jwt.unpack(info)
+        return self._jwt_unpacker().unpack(info)
 
     def _do_response(self, info, sformat, **kwargs):
         try:
@@ -424,6 +799,7 @@ class Service(StateInterface):
                 raise
         return resp
 
+    @state_cached
     def parse_response(self, info, sformat="", state="", **kwargs):
         """
         This the start of a pipeline that will:
@@ -440,23 +816,40 @@ class Service(StateInterface):
             format
         :param sformat: Which serialization that was used
         :param state: The state
-        :param kwargs: Extra key word arguments
+        :param kwargs: Extra key word arguments. *verification* overrides
+            the verification policy of the service, for instance
+            VERIFY_SKIP for a response that was read back from the state
+            database.
         :return: The parsed and to some extend verified response
         """
 
         if not sformat:
             sformat = self.response_body_type
 
+        resp = self.verify_response(info, sformat, **kwargs)
+        return self._post_parse(resp, sformat, state)
+
+    def verify_response(self, info, sformat, **kwargs):
+        """
+        The first two steps of :py:meth:`parse_response`, deserializing and
+        verifying the response. Does not use the state database, so it can
+        be run in another thread.
+
+        :param info: The response
+        :param sformat: Which serialization that was used
+        :param kwargs: Extra key word arguments. *verification* overrides
+            the verification policy of the service.
+        :return: The response, if it is to be post parsed as a JOSE object
+            the response as is.
+        """
         LOGGER.debug('response format: %s', sformat)
+        _verification = kwargs.pop('verification', self.verification)
 
         if sformat in ['jose', 'jws', 'jwe']:
-            resp = self.post_parse_response(info, state=state)
-
-            if not resp:
-                LOGGER.error('Missing or faulty response')
-                raise ResponseError("Missing or faulty response")
+            return info
 
-            return resp
+        _sink = self.stage_sink
+        _start = perf_counter() if _sink else 0
 
         # If format is urlencoded 'info' may be a URL
         # in which case I have to get at the query/fragment part
@@ -470,25 +863,107 @@ class Service(StateInterface):
         LOGGER.debug('response_cls: %s', self.response_cls.__name__)
 
         resp = self._do_response(info, sformat, **kwargs)
+        if _sink:
+            self._report(_sink, 'deserialize', _start)
 
-        LOGGER.debug('Initial response parsing => "%s"', resp.to_dict())
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('Initial response parsing => "%s"', resp.to_dict())
 
         # is this an error message
         if is_error_message(resp):
             LOGGER.debug('Error response: %s', resp)
+        elif _verification == VERIFY_SKIP:
+            LOGGER.debug('Response not verified')
+        elif _verification == VERIFY_DEFERRED:
+            resp = DeferredVerification(
+                resp, partial(self._verify,
+                              vargs=self.gather_verify_arguments()))
         else:
+            _start = perf_counter() if _sink else 0
+            self._verify(resp)
+            if _sink:
+                self._report(_sink, 'verify', _start)
+
+        return resp
+
+    def _verify(self, resp, vargs=None):
+        """
+        Verify a response, an exception is raised if it does not verify.
+
+        :param resp: The response
+        :param vargs: The keyword arguments to the verify method of the
+            response, by default :py:meth:`gather_verify_arguments`
+        """
+        if vargs is None:
             vargs = self.gather_verify_arguments()
-            LOGGER.debug("Verify response with %s", vargs)
-            try:
-                # verify the message. If something is wrong an exception is
-                # thrown
-                resp.verify(**vargs)
-            except Exception as err:
-                LOGGER.error(
-                    'Got exception while verifying response: %s', err)
-                raise
+        else:
+            vargs = vargs.copy()
+        LOGGER.debug("Verify response with %s", vargs)
+        try:
+            if self._verify_id_token_signature(resp, vargs):
+                # Everything but the signature of the ID Token
+                vargs['verify'] = False
+            # verify the message. If something is wrong an exception is
+            # thrown
+            resp.verify(**vargs)
+        except Exception as err:
+            LOGGER.error('Got exception while verifying response: %s', err)
+            raise
+
+    def _verify_id_token_signature(self, resp, vargs):
+        """
+        If there is a crypto executor, verify the signature of the ID Token
+        in the response with it. The keys are picked as the message classes
+        would have done it.
 
+        :return: True if the signature was verified, False if it is left to
+            the message classes
+        """
+        _executor = self.service_context.crypto_executor
+        if _executor is None or not vargs.get('keyjar'):
+            return False
+        try:
+            _token = str(resp['id_token'])
+        except KeyError:
+            return False
+
+        # An encrypted ID Token is not a JWS
+        _jws = jws_factory(_token)
+        if _jws is None or _jws.jwt.headers.get('alg', 'none') == 'none':
+            return False
+
+        _args = {k: v for k, v in vargs.items() if k != 'keyjar'}
+        _keys = vargs['keyjar'].get_jwt_verify_keys(_jws.jwt, **_args)
+        if not _keys:
+            return False
+        try:
+            _executor.verify(_token, _keys,
+                             [vargs['sigalg']] if 'sigalg' in vargs else None)
+        except NoSuitableSigningKeys:
+            # The message classes update the key jar and try again
+            return False
+        return True
+
+    def _post_parse(self, resp, sformat, state):
+        """The last step of :py:meth:`parse_response`."""
+        if isinstance(resp, DeferredVerification):
+            if type(self).post_parse_response is \
+                    Service.post_parse_response:
+                # Nothing reads the response, it stays unverified. It is
+                # not an error message, those are never deferred.
+                if not resp.unverified:
+                    LOGGER.error('Missing or faulty response')
+                    raise ResponseError("Missing or faulty response")
+                return resp
+            # The service post parses, which needs a verified response
+            resp = resp.message()
+
+        if sformat in ['jose', 'jws', 'jwe'] or not is_error_message(resp):
+            _sink = self.stage_sink
+            _start = perf_counter() if _sink else 0
             resp = self.post_parse_response(resp, state=state)
+            if _sink:
+                self._report(_sink, 'post_parse_response', _start)
 
         if not resp:
             LOGGER.error('Missing or faulty response')
@@ -496,6 +971,223 @@ class Service(StateInterface):
 
         return resp
 
+    # ------------------ sending -----------------------
+
+    def get_transport(self):
+        """
+        :return: The transport of this service or, if it has none, the
+            default transport
+        """
+        if self.transport is not None:
+            return self.transport
+
+        # requests is only needed if the service sends the requests itself
+        from oidcservice.transport import default_transport
+        return default_transport()
+
+    @state_cached
+    def service_request(self, request_args=None, state='', transport=None,
+                        timeout=None, **kwargs):
+        """
+        Build the request, send it to the OP, parse the response and update
+        the service context with it.
+
+        :param request_args: Request arguments
+        :param state: The state
+        :param transport: Overrides the transport of the service
+        :param timeout: Overrides the timeout of the transport
+        :param kwargs: Extra keyword arguments used when building the request
+        :return: The parsed response, or the error message if the OP
+            returned one
+        """
+        if state:
+            kwargs['state'] = state
+        _info = self.get_request_parameters(request_args=request_args,
+                                            **kwargs)
+
+        if transport is None:
+            transport = self.get_transport()
+        response = transport.send(_info['url'], method=_info['method'],
+                                  body=_info.get('body'),
+                                  headers=_info.get('headers'),
+                                  issuer=self.service_context.issuer,
+                                  timeout=timeout)
+        return self.parse_request_response(response, state=state)
+
+    def parse_request_response(self, response, state=''):
+        """
+        Deal with the HTTP response to a request sent by this service.
+
+        :param response: The response, has the attributes status_code, text
+            and headers
+        :param state: The state
+        :return: The parsed response, or the error message if the OP
+            returned one
+        """
+        if response.status_code in SUCCESSFUL:
+            sformat = get_response_body_type(response.headers,
+                                             self.response_body_type)
+            resp = self.parse_response(response.text, sformat, state=state)
+            if not is_error_message(resp):
+                self.update_service_context(resp, key=state)
+            return resp
+
+        return self._error_response(response)
+
+    def _error_response(self, response):
+        """
+        :param response: A HTTP response with a status code that is not
+            one of the successful ones
+        :return: The error message if there is one
+        """
+        if 400 <= response.status_code < 500:
+            try:
+                resp = self.error_msg().deserialize(response.text, 'json')
+            except Exception:
+                pass
+            else:
+                if is_error_message(resp):
+                    LOGGER.debug('Error response: %s', resp)
+                    return resp
+
+        LOGGER.error('Got HTTP status %s: %s', response.status_code,
+                     response.text)
+        raise ResponseError(
+            'HTTP status {}: {}'.format(response.status_code, response.text))
+
+    # ------------------ asyncio -----------------------
+
+    def get_async_transport(self):
+        """
+        :return: The asynchronous version of the transport returned by
+            :py:meth:`get_transport`
+        """
+        from oidcservice.async_transport import async_transport
+        return async_transport(self.get_transport())
+
+    async def aservice_request(self, request_args=None, state='',
+                               transport=None, timeout=None, executor=None,
+                               **kwargs):
+        """
+        The asyncio version of :py:meth:`service_request`. Neither the state
+        database nor the OP blocks the event loop.
+
+        :param request_args: Request arguments
+        :param state: The state
+        :param transport: Overrides the transport of the service
+        :param timeout: Overrides the timeout of the transport
+        :param executor: If given, deserializing and verifying the response,
+            which for signed or encrypted responses is CPU heavy, is done
+            in this executor.
+        :param kwargs: Extra keyword arguments used when building the request
+        :return: The parsed response, or the error message if the OP
+            returned one
+        """
+        if state:
+            kwargs['state'] = state
+        _info = await self.aget_request_parameters(request_args=request_args,
+                                                   **kwargs)
+
+        if transport is None:
+            transport = self.get_async_transport()
+        else:
+            from oidcservice.async_transport import async_transport
+            transport = async_transport(transport)
+        response = await transport.asend(_info['url'], method=_info['method'],
+                                         body=_info.get('body'),
+                                         headers=_info.get('headers'),
+                                         issuer=self.service_context.issuer,
+                                         timeout=timeout)
+        return await self.aparse_request_response(response, state=state,
+                                                  executor=executor)
+
+    async def aparse_request_response(self, response, state='', executor=None):
+        """
+        The asyncio version of :py:meth:`parse_request_response`.
+
+        :param response: The response, has the attributes status_code, text
+            and headers
+        :param state: The state
+        :param executor: If given, deserializing and verifying the response
+            is done in this executor.
+        :return: The parsed response, or the error message if the OP
+            returned one
+        """
+        if response.status_code not in SUCCESSFUL:
+            return self._error_response(response)
+
+        sformat = get_response_body_type(response.headers,
+                                         self.response_body_type)
+        if executor is None:
+            resp = self.verify_response(response.text, sformat)
+        else:
+            resp = await asyncio.get_running_loop().run_in_executor(
+                executor, self.verify_response, response.text, sformat)
+
+        return await self.arun(self._context_reads(resp, state),
+                               self._finish_response, resp, sformat, state)
+
+    def _finish_response(self, resp, sformat, state):
+        """Post parse a verified response and update the service context."""
+        resp = self._post_parse(resp, sformat, state)
+        if not is_error_message(resp):
+            self.update_service_context(resp, key=state)
+        return resp
+
+    def _key_reads(self, key):
+        if key:
+            return self._state_reads(key)
+        return []
+
+    def _context_reads(self, resp, key):
+        """
+        What to load before updating the service context. The nonce and
+        subject of a verified ID Token are connected to the state.
+        """
+        _reads = self._key_reads(key)
+        try:
+            _idt = resp[verified_claim_name('id_token')]
+        except (KeyError, TypeError):
+            return _reads
+        for xtyp, claim in (('nonce', 'nonce'), ('subject id', 'sub')):
+            if claim in _idt:
+                _reads.extend(self._x_reads(_idt[claim], xtyp))
+        return _reads
+
+    async def aconstruct(self, request_args=None, **kwargs):
+        """
+        The asyncio version of :py:meth:`construct`. State database access
+        does not block the event loop.
+        """
+        return await self.arun(self._key_reads(kwargs.get('state')),
+                               self.construct, request_args=request_args,
+                               **kwargs)
+
+    async def aget_request_parameters(self, **kwargs):
+        """
+        The asyncio version of :py:meth:`get_request_parameters`. State
+        database access does not block the event loop.
+        """
+        return await self.arun(self._key_reads(kwargs.get('state')),
+                               self.get_request_parameters, **kwargs)
+
+    async def aparse_response(self, info, sformat="", state="", **kwargs):
+        """
+        The asyncio version of :py:meth:`parse_response`. State database
+        access does not block the event loop.
+        """
+        return await self.arun(self._key_reads(state), self.parse_response,
+                               info, sformat=sformat, state=state, **kwargs)
+
+    async def aupdate_service_context(self, resp, key='', **kwargs):
+        """
+        The asyncio version of :py:meth:`update_service_context`. State
+        database access does not block the event loop.
+        """
+        return await self.arun(self._context_reads(resp, key),
+                               self.update_service_context, resp, key=key,
+                               **kwargs)
+
     def get_conf_attr(self, attr, default=None):
         """
         Get the value of a attribute in the configuration
@@ -529,7 +1221,7 @@ def gather_constructors(service_methods, construct):
 
 
 def init_services(service_definitions, service_context, state_db,
-                  client_authn_factory=None):
+                  client_authn_factory=None, transport=None):
     """
     Initiates a set of services
 
@@ -540,6 +1232,8 @@ def init_services(service_definitions, service_context, state_db,
         services.
     :param client_authn_factory: A list of methods the services can use to
         authenticate the client to a service.
+    :param transport: Sends the requests of all the services, see
+        :py:mod:`oidcservice.transport`
     :return: A dictionary, with service name as key and the service instance as
         value.
     """
@@ -563,6 +1257,8 @@ def init_services(service_definitions, service_context, state_db,
             gather_constructors(service_configuration['post_functions'], _srv.post_construct)
         if 'pre_functions' in service_configuration:
             gather_constructors(service_configuration['pre_functions'], _srv.pre_construct)
+        if transport is not None:
+            _srv.transport = transport
 
         try:
             service[_srv.service_name] = _srv
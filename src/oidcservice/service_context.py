@@ -4,6 +4,7 @@ common to all the services by an OpenID Connect Relying Party.
 """
 import hashlib
 import os
+import time
 
 from cryptojwt.utils import as_bytes
 from cryptojwt.jwk.rsa import import_private_rsa_key_from_file
@@ -16,6 +17,8 @@ from cryptojwt.key_jar import KeyJar
 # and how they are represented in a provider info response.
 from oidcmsg.oidc import RegistrationRequest
 
+from oidcservice.client_auth import basic_credentials
+
 CLI_REG_MAP = {
     "userinfo": {
         "sign": "userinfo_signed_response_alg",
@@ -88,6 +91,16 @@ class ServiceContext:
         self.callback = None
         self.args = {}
         self.add_on = {}
+        # An oidcservice.assertion_pool.AssertionPool
+        self.assertion_pool = None
+        # An oidcservice.crypto_executor.CryptoExecutor
+        self.crypto_executor = None
+        self.keys_generation = 0
+        self._key_cache = {}
+        self.client_secret_expires_at = 0
+        self.secret_generation = 0
+        self._secret_bundle = None
+        self._credentials = None
 
         try:
             self.clock_skew = config['clock_skew']
@@ -133,17 +146,31 @@ class ServiceContext:
         return self._c_secret
 
     def set_client_secret(self, val):
-        """Set client secret."""
+        """
+        Set client secret. The key jar holds one symmetric key made from
+        the client secret, the one made from the previous secret is removed.
+        """
         if not val:
-            self._c_secret = ""
-        else:
-            self._c_secret = val
+            val = ""
+        if self.keyjar is None:
+            self.keyjar = KeyJar()
+        _own = self.keyjar[""] if "" in self.keyjar else []
+        if val == self._c_secret and (
+                not val or any(b is self._secret_bundle for b in _own)):
+            return
+
+        if any(b is self._secret_bundle for b in _own):
+            self.keyjar[""] = [b for b in _own if b is not self._secret_bundle]
+        self._secret_bundle = None
+        if val:
             # client uses it for signing
             # Server might also use it for signing which means the
             # client uses it for verifying server signatures
-            if self.keyjar is None:
-                self.keyjar = KeyJar()
             self.keyjar.add_symmetric("", str(val))
+            self._secret_bundle = self.keyjar[""][-1]
+        self._c_secret = val
+        self.secret_generation += 1
+        self.keys_changed()
 
     # since client secret is used as a symmetric key in some instances
     # some special handling is needed for the client_secret attribute
@@ -217,6 +244,77 @@ class ServiceContext:
                 for iss, url in spec.items():
                     _bundle = KeyBundle(source=url)
                     self.keyjar.add_kb(iss, _bundle)
+        self.keys_changed()
+
+    def basic_credentials(self, user, passwd):
+        """
+        The credentials for HTTP Basic authentication. Those of the last user
+        and password are kept until the client secret or when it expires
+        changes.
+
+        :param user: The user, normally the client ID
+        :param passwd: The password, normally the client secret
+        :return: A (token, Authorization header value) tuple
+        """
+        _key = (user, passwd, self.secret_generation,
+                self.client_secret_expires_at)
+        _cached = self._credentials
+        if _cached is not None and _cached[0] == _key:
+            return _cached[1]
+
+        _credentials = basic_credentials(user, passwd)
+        # One assignment, so other threads see the old or the new pair
+        self._credentials = (_key, _credentials)
+        return _credentials
+
+    def keys_changed(self):
+        """
+        Tell that the keys in the key jar have changed, for instance that
+        keys were rotated, so that no cached keys are used.
+        """
+        self.keys_generation += 1
+
+    def cached_keys(self, key, resolve, owner=''):
+        """
+        Keys picked from the key jar, like the signing key for an algorithm,
+        are cached until the key jar is replaced, :py:meth:`keys_changed` is
+        called, which :py:meth:`set_client_secret` does, a picked key is
+        marked as inactive or a key bundle that is fetched from somewhere is
+        due to be fetched again. Whoever changes the keys in the key jar in
+        some other way has to call :py:meth:`keys_changed`.
+
+        :param key: What the keys are for, like (purpose, algorithm, key ID)
+        :param resolve: A function that picks the keys from the key jar,
+            returns a list of keys or a key jar
+        :param owner: Whose keys are picked, '' for the client's own
+        :return: What *resolve* returned
+        """
+        _jar = self.keyjar
+        _generation = self.keys_generation
+        try:
+            _cached = self._key_cache[(key, owner)]
+        except KeyError:
+            pass
+        else:
+            _cached_jar, _cached_generation, _expires, _picked, _keys = _cached
+            if _cached_jar is _jar and _cached_generation == _generation and \
+                    time.time() <= _expires and \
+                    not any(k.inactive_since for k in _picked):
+                return _keys
+
+        _keys = resolve()
+        # Resolving may have fetched keys. Any owner's keys may have been
+        # picked from.
+        _expires = min([b.time_out for _bundles in _jar.issuer_keys.values()
+                        for b in _bundles if b.remote] or [float('inf')])
+        if isinstance(_keys, KeyJar):
+            _picked = [k for _bundles in _keys.issuer_keys.values()
+                       for b in _bundles for k in b]
+        else:
+            _picked = list(_keys)
+        self._key_cache[(key, owner)] = (_jar, _generation, _expires, _picked,
+                                         _keys)
+        return _keys
 
     def get_sign_alg(self, typ):
         """
@@ -235,6 +333,23 @@ class ServiceContext:
 
         return None
 
+    def get_jwt_algs(self, typ):
+        """
+        :py:meth:`get_sign_alg` and :py:meth:`get_enc_alg_enc` in one go.
+
+        :param typ: ['id_token', 'userinfo', 'request_object']
+        :return: A (sign alg, encryption alg, encryption enc) tuple
+        """
+        _algs = []
+        for attr in ['sign', 'alg', 'enc']:
+            _name = CLI_REG_MAP.get(typ, {}).get(attr)
+            if _name in self.behaviour:
+                _algs.append(self.behaviour[_name])
+            else:
+                _algs.append(self.provider_info.get(
+                    PROVIDER_INFO_MAP.get(typ, {}).get(attr)))
+        return tuple(_algs)
+
     def get_enc_alg_enc(self, typ):
         """
 
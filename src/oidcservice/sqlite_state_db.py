@@ -0,0 +1,355 @@
+"""A state database that keeps the state information in a SQLite database."""
+import logging
+import os
+import sqlite3
+import threading
+import weakref
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+CREATE_TABLE = 'CREATE TABLE IF NOT EXISTS state (' \
+               'key TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL)'
+SELECT_VALUE = 'SELECT value FROM state WHERE key = ?'
+SELECT_VALUES = 'SELECT key, value FROM state WHERE key IN ({})'
+UPSERT_VALUE = 'INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)'
+DELETE_VALUE = 'DELETE FROM state WHERE key = ?'
+CREATE_INDEX_TABLE = 'CREATE TABLE IF NOT EXISTS state_index (' \
+                     'name TEXT NOT NULL, value TEXT NOT NULL, ' \
+                     'key TEXT NOT NULL, PRIMARY KEY (name, value, key))'
+CREATE_INDEX_KEY = 'CREATE INDEX IF NOT EXISTS state_index_key ' \
+                   'ON state_index (key)'
+# A replaced row gets a new rowid, so the most recently added key is last
+UPSERT_INDEX = 'INSERT OR REPLACE INTO state_index (name, value, key) ' \
+               'VALUES (?, ?, ?)'
+SELECT_INDEX = 'SELECT key FROM state_index WHERE name = ? AND value = ? ' \
+               'ORDER BY rowid'
+DELETE_INDEX = 'DELETE FROM state_index WHERE key = ?'
+MAX_PARAMETERS = 500
+
+
+class _Connection:
+    """The connection of a thread, kept in a thread local."""
+
+    def __init__(self, conn, pid):
+        self.conn = conn
+        self.lock = threading.Lock()
+        self.pid = pid
+
+
+def _release(connections, registry_lock, conn, lock, pid):
+    """
+    Commit and close the connection of a thread that has ended. Done only
+    once, by the process that opened the connection, and not if the database
+    has already closed it.
+    """
+    if os.getpid() != pid:
+        return
+    with registry_lock:
+        try:
+            connections.remove((conn, lock))
+        except ValueError:
+            return
+    with lock:
+        try:
+            if conn.in_transaction:
+                conn.execute('COMMIT')
+        except sqlite3.Error as err:
+            LOGGER.error('Commit on thread exit failed: %s', err)
+        conn.close()
+
+
+class SQLiteStateDataBase:
+    """
+    An implementation of the state database that uses SQLite.
+    Since the information is kept in a file it can be shared by a number of
+    processes and will survive a restart.
+
+    The database is run in WAL (write-ahead logging) mode which allows
+    readers to run concurrently with a writer. Each thread, in each process,
+    gets its own connection. The SQL statements are constants so they are
+    prepared once per connection and then picked from the statement cache.
+
+    If *commit_interval* is larger than 0, writes are grouped together and
+    committed by a background thread every *commit_interval* seconds.
+    A thread always sees its own writes but other threads and processes will
+    not see them until they are committed. Since a connection holds the
+    write lock until the commit, the interval should be kept short.
+    Use :py:meth:`commit` to force a commit.
+
+    The connection of a thread is committed and closed when the thread ends.
+    :py:meth:`close` stops the background committer and closes all the
+    connections.
+
+    Values, like a subject id, can be connected to keys using a secondary
+    index kept in a separate table. Deleting a key removes its index entries
+    in the same transaction.
+    """
+
+    def __init__(self, filename, commit_interval=0, timeout=5.0):
+        """
+        :param filename: Name of the file where the database is kept
+        :param commit_interval: How long, in seconds, a write may wait before
+            being committed. 0 means commit on every write.
+        :param timeout: How long, in seconds, to wait for a lock held by
+            some other connection.
+        """
+        self.filename = filename
+        self.commit_interval = commit_interval
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = None
+        self._connections = []
+        self._registry_lock = threading.Lock()
+        self._committer = None
+        # Make sure the table exists and the database is in WAL mode
+        self._connection()
+
+    def _connect(self):
+        _conn = sqlite3.connect(self.filename, timeout=self.timeout,
+                                isolation_level=None,
+                                check_same_thread=False)
+        _conn.execute('PRAGMA journal_mode=WAL')
+        _conn.execute('PRAGMA synchronous=NORMAL')
+        _conn.execute(CREATE_TABLE)
+        _conn.execute(CREATE_INDEX_TABLE)
+        _conn.execute(CREATE_INDEX_KEY)
+        return _conn
+
+    def _connection(self):
+        """
+        Return the connection and lock bound to this thread. A forked child
+        process will not reuse the connections of its parent.
+        """
+        _pid = os.getpid()
+        if self._pid != _pid:
+            self._after_fork(_pid)
+
+        _local = self._local
+        _holder = getattr(_local, 'holder', None)
+        if _holder is None or _holder.pid != _pid:
+            _holder = _Connection(self._connect(), _pid)
+            with self._registry_lock:
+                self._connections.append((_holder.conn, _holder.lock))
+            # The thread local drops the holder when the thread ends
+            weakref.finalize(_holder, _release, self._connections,
+                             self._registry_lock, _holder.conn,
+                             _holder.lock, _pid)
+            _local.holder = _holder
+        return _holder.conn, _holder.lock
+
+    def _after_fork(self, pid):
+        self._pid = pid
+        self._connections = []
+        self._registry_lock = threading.Lock()
+        if self.commit_interval:
+            _stop = threading.Event()
+            _thread = threading.Thread(target=self._background_commit,
+                                       args=(_stop,), daemon=True)
+            _thread.start()
+            self._committer = (_thread, _stop)
+
+    def _background_commit(self, stop):
+        while not stop.wait(self.commit_interval):
+            self.commit_all()
+
+    def _write(self, statement, args):
+        _conn, _lock = self._connection()
+        with _lock:
+            if self.commit_interval and not _conn.in_transaction:
+                _conn.execute('BEGIN IMMEDIATE')
+            _conn.execute(statement, args)
+
+    def _write_many(self, statement, seq_of_args, *more):
+        """
+        Do a number of writes in one transaction.
+
+        :param statement: The SQL statement
+        :param seq_of_args: A list of arguments, one per write
+        :param more: More statements and lists of arguments
+        """
+        _writes = [(statement, seq_of_args)]
+        _writes.extend(zip(more[::2], more[1::2]))
+        _conn, _lock = self._connection()
+        with _lock:
+            if _conn.in_transaction:
+                for _statement, _args in _writes:
+                    _conn.executemany(_statement, _args)
+                return
+
+            _conn.execute('BEGIN IMMEDIATE')
+            try:
+                for _statement, _args in _writes:
+                    _conn.executemany(_statement, _args)
+            except sqlite3.Error:
+                _conn.execute('ROLLBACK')
+                raise
+            if not self.commit_interval:
+                _conn.execute('COMMIT')
+
+    def set(self, key, value):
+        """Assign a value to a key."""
+        self._write(UPSERT_VALUE, (key, value))
+
+    def get(self, key):
+        """Return the value bound to a key."""
+        _conn, _lock = self._connection()
+        with _lock:
+            _row = _conn.execute(SELECT_VALUE, (key,)).fetchone()
+        if _row is None:
+            return None
+        return _row[0]
+
+    def delete(self, key):
+        """Delete a key, its value and the index entries pointing to it."""
+        self._write_many(DELETE_VALUE, [(key,)], DELETE_INDEX, [(key,)])
+
+    def update(self, key, func):
+        """
+        Atomically replace the value bound to a key. The read and the write
+        are done in one transaction that holds the write lock, so no other
+        thread or process can change the value in between.
+
+        :param key: The key
+        :param func: A function that is given the present value, None if the
+            key is unknown, and returns the new value. If it returns None
+            the key is deleted.
+        :return: The new value
+        """
+        _conn, _lock = self._connection()
+        with _lock:
+            _own = not _conn.in_transaction
+            if _own:
+                _conn.execute('BEGIN IMMEDIATE')
+            try:
+                _row = _conn.execute(SELECT_VALUE, (key,)).fetchone()
+                _value = func(None if _row is None else _row[0])
+                if _value is None:
+                    _conn.execute(DELETE_VALUE, (key,))
+                    _conn.execute(DELETE_INDEX, (key,))
+                else:
+                    _conn.execute(UPSERT_VALUE, (key, _value))
+            except Exception:
+                if _own:
+                    _conn.execute('ROLLBACK')
+                raise
+            if _own and not self.commit_interval:
+                _conn.execute('COMMIT')
+        return _value
+
+    def get_many(self, keys):
+        """
+        Return the values bound to a number of keys.
+
+        :param keys: A list of keys
+        :return: A list of values in the same order as the keys. None for
+            keys that are unknown.
+        """
+        _conn, _lock = self._connection()
+        _keys = list(keys)
+        _found = {}
+        with _lock:
+            # Stay below the limit on the number of host parameters
+            for i in range(0, len(_keys), MAX_PARAMETERS):
+                _chunk = _keys[i:i + MAX_PARAMETERS]
+                _statement = SELECT_VALUES.format(','.join('?' * len(_chunk)))
+                _found.update(_conn.execute(_statement, _chunk).fetchall())
+        return [_found.get(key) for key in _keys]
+
+    def set_many(self, items):
+        """
+        Assign values to a number of keys in one transaction.
+
+        :param items: A dictionary with keys and values
+        """
+        self._write_many(UPSERT_VALUE, list(items.items()))
+
+    def delete_many(self, keys):
+        """
+        Delete a number of keys, their values and the index entries pointing
+        to them, in one transaction.
+
+        :param keys: A list of keys
+        """
+        _args = [(key,) for key in keys]
+        self._write_many(DELETE_VALUE, _args, DELETE_INDEX, _args)
+
+    def index_add(self, name, value, key):
+        """
+        Connect a value to a key. If the connection already exists, the key
+        becomes the most recently added one.
+
+        :param name: Name of the index (e.g. 'nonce', 'subject id', ...)
+        :param value: The value
+        :param key: The key
+        """
+        self._write(UPSERT_INDEX, (name, value, key))
+
+    def index_get(self, name, value):
+        """
+        Return the keys connected to a value.
+
+        :param name: Name of the index
+        :param value: The value
+        :return: A list of keys, the most recently added last
+        """
+        _conn, _lock = self._connection()
+        with _lock:
+            _rows = _conn.execute(SELECT_INDEX, (name, value)).fetchall()
+        return [_row[0] for _row in _rows]
+
+    @staticmethod
+    def _commit(conn, lock):
+        with lock:
+            if conn.in_transaction:
+                conn.execute('COMMIT')
+
+    def commit(self):
+        """Commit the writes done by this thread that are not yet committed."""
+        self._commit(*self._connection())
+
+    def commit_all(self):
+        """
+        Commit all not yet committed writes done in this process.
+        Connections that are busy are skipped, they will be dealt with the
+        next time around. A busy connection might be waiting for the write
+        lock held by one of the other connections.
+        """
+        with self._registry_lock:
+            _connections = list(self._connections)
+
+        for _conn, _lock in _connections:
+            if not _lock.acquire(blocking=False):
+                continue
+            try:
+                if _conn.in_transaction:
+                    _conn.execute('COMMIT')
+            except sqlite3.Error as err:
+                LOGGER.error('Group commit failed: %s', err)
+            finally:
+                _lock.release()
+
+    def close(self):
+        """
+        Stop the background committer, commit outstanding writes and close
+        all the connections opened by this process. The instance can not be
+        used afterwards.
+        """
+        if self._pid != os.getpid():
+            return
+
+        if self._committer is not None:
+            _thread, _stop = self._committer
+            self._committer = None
+            _stop.set()
+            if _thread is not threading.current_thread():
+                _thread.join()
+
+        with self._registry_lock:
+            _connections = self._connections[:]
+            del self._connections[:]
+
+        for _conn, _lock in _connections:
+            self._commit(_conn, _lock)
+            _conn.close()
@@ -1,5 +1,9 @@
 """A database interface for storing state information."""
+import contextvars
+import functools
 import json
+import threading
+from contextlib import contextmanager
 
 from oidcmsg.message import Message
 from oidcmsg.message import SINGLE_OPTIONAL_JSON
@@ -7,6 +11,11 @@ from oidcmsg.message import SINGLE_REQUIRED_STRING
 from oidcmsg.oidc import verified_claim_name
 
 from oidcservice import rndstr
+from oidcservice.async_state import OverlayStateDataBase
+from oidcservice.exception import StateConflict
+from oidcservice.async_state import key_locks
+from oidcservice.async_state import lock_key
+from oidcservice.async_state import supports
 
 
 class State(Message):
@@ -29,6 +38,46 @@ KEY_PATTERN = {
     'subject id': '=={}=='
 }
 
+# Where the list of all the states connected to a value is kept
+INDEX_PATTERN = 'idx{}idx'
+
+# The decoded states of the ongoing operation, see StateInterface.state_cache
+_STATE_CACHE = contextvars.ContextVar('state_cache', default=None)
+
+# The overlay the ongoing operation is run against, see StateInterface.arun
+_OVERLAY = contextvars.ContextVar('overlay', default=None)
+
+
+def _add_ref(value, xtyp, x):
+    """Add a reference to a JSON document with references."""
+    if value is None:
+        _refs = {}
+    else:
+        _refs = json.loads(value)
+    _refs[xtyp] = x
+    return json.dumps(_refs)
+
+
+def _add_to_index(value, state):
+    """Add a state, as the most recent one, to a JSON list of states."""
+    if value is None:
+        _states = []
+    else:
+        _states = [s for s in json.loads(value) if s != state]
+    _states.append(state)
+    return json.dumps(_states)
+
+
+def _remove_from_index(value, state):
+    """
+    Remove a state from a JSON list of states. Returns None if no states are
+    left.
+    """
+    _states = [s for s in json.loads(value or '[]') if s != state]
+    if _states:
+        return json.dumps(_states)
+    return None
+
 
 class InMemoryStateDataBase:
     """The simplest possible implementation of the state database."""
@@ -53,11 +102,326 @@ class InMemoryStateDataBase:
         except KeyError:
             pass
 
+    def get_many(self, keys):
+        """
+        Return the values bound to a number of keys.
+
+        :param keys: A list of keys
+        :return: A list of values in the same order as the keys. None for
+            keys that are unknown.
+        """
+        return [self.get(key) for key in keys]
+
+    def set_many(self, items):
+        """
+        Assign values to a number of keys.
+
+        :param items: A dictionary with keys and values
+        """
+        for key, value in items.items():
+            self.set(key, value)
+
+    def delete_many(self, keys):
+        """
+        Delete a number of keys and their values.
+
+        :param keys: A list of keys
+        """
+        for key in keys:
+            self.delete(key)
+
+
+class ObjectStateDataBase(InMemoryStateDataBase):
+    """
+    A state database that keeps :py:class:`State` instances as live objects.
+
+    A :py:class:`StateInterface` using this database will neither parse nor
+    serialize the whole state on every access. Serialization only happens
+    when information is written to the optional backing database, which
+    must support the same *set/get/delete* interface as
+    :py:class:`InMemoryStateDataBase`.
+
+    Objects handed out by this database are shared with the database so they
+    must not be modified in place other than through the StateInterface.
+    """
+    native = True
+
+    def __init__(self, backend=None):
+        InMemoryStateDataBase.__init__(self)
+        self.backend = backend
+        self._dirty = set()
+        self._deleted = set()
+
+    @property
+    def serializer(self):
+        """
+        The serializer of the backing database. Needed to read what is
+        fetched from it.
+        """
+        return getattr(self.backend, 'serializer', None)
+
+    def set(self, key, value):
+        """Assign a value to a key."""
+        self._db[key] = value
+        self._dirty.add(key)
+        self._deleted.discard(key)
+
+    def get(self, key):
+        """
+        Return the value bound to a key. If the key is not known locally
+        the backing database, if there is one, is consulted.
+        """
+        try:
+            return self._db[key]
+        except KeyError:
+            if self.backend is None or key in self._deleted:
+                return None
+
+        _val = self.backend.get(key)
+        if _val is not None:
+            self._db[key] = _val
+        return _val
+
+    def delete(self, key):
+        """Delete a key and its value."""
+        InMemoryStateDataBase.delete(self, key)
+        self._dirty.discard(key)
+        if self.backend is not None:
+            self._deleted.add(key)
+
+    def flush(self):
+        """
+        Write all changed information to the backing database. This is where
+        State instances are serialized, into JSON documents unless the
+        backing database has a serializer.
+        """
+        if self.backend is None:
+            return
+
+        _serializer = self.serializer
+
+        for key in self._deleted:
+            self.backend.delete(key)
+        self._deleted = set()
+
+        for key in self._dirty:
+            _val = self._db[key]
+            if isinstance(_val, State) and _serializer is not None:
+                _val = _serializer.dumps(_val)
+            elif isinstance(_val, Message):
+                _val = _val.to_json()
+            self.backend.set(key, _val)
+        self._dirty = set()
+
+
+class FieldStateDataBase(InMemoryStateDataBase):
+    """
+    An in-memory state database where each part of a state (the issuer ID,
+    the authorization request, the token response, ...) is kept as a
+    separate field. This means that storing one item does not mean
+    rewriting all the others.
+
+    A database that supports this has two extra methods: *get_fields* and
+    *set_fields*. The value of a field is the JSON representation of the
+    item, except for the issuer ID which is a string.
+
+    A JSON document stored under a key using *set* is converted into
+    fields the first time the fields are accessed.
+    """
+
+    def get(self, key):
+        """
+        Return the value bound to a key. A state kept as fields is returned
+        as a JSON document.
+        """
+        _val = InMemoryStateDataBase.get(self, key)
+        if isinstance(_val, dict):
+            return json.dumps(_val)
+        return _val
+
+    def get_fields(self, key, fields=None):
+        """
+        Return a number of fields of the state bound to a key.
+
+        :param key: The key
+        :param fields: A list of field names, if None all fields are returned
+        :return: A dictionary with field names and values. Fields that have
+            no value are left out. If the key is unknown None is returned.
+        """
+        try:
+            _val = self._db[key]
+        except KeyError:
+            return None
+
+        if not isinstance(_val, dict):
+            _val = self._to_fields(key, _val)
+
+        if fields is None:
+            return _val.copy()
+        return {field: _val[field] for field in fields if field in _val}
+
+    def set_fields(self, key, fields):
+        """
+        Assign values to a number of fields of the state bound to a key.
+        Other fields are left as they are.
+
+        :param key: The key
+        :param fields: A dictionary with field names and values
+        """
+        try:
+            _val = self._db[key]
+        except KeyError:
+            self._db[key] = dict(fields)
+            return
+
+        if not isinstance(_val, dict):
+            _val = self._to_fields(key, _val)
+        _val.update(fields)
+
+    def _to_fields(self, key, value):
+        """Convert a State JSON document into fields."""
+        _val = json.loads(value)
+        self._db[key] = _val
+        return _val
+
+
+class IndexedStateDataBase(InMemoryStateDataBase):
+    """
+    An in-memory state database with a secondary index. An index maps a
+    value, like a subject id, to the set of keys connected to it. Both
+    adding to the index and looking up a value are O(1) operations.
+    Deleting a key also removes it from the index.
+    """
+
+    def __init__(self):
+        InMemoryStateDataBase.__init__(self)
+        # (name, value) -> keys, a dictionary is used as an ordered set
+        self._index = {}
+        # key -> set of (name, value)
+        self._indexed = {}
+        self._index_lock = threading.Lock()
+
+    def delete(self, key):
+        """Delete a key, its value and the index entries pointing to it."""
+        with self._index_lock:
+            self._db.pop(key, None)
+            for _entry in self._indexed.pop(key, ()):
+                _keys = self._index[_entry]
+                del _keys[key]
+                if not _keys:
+                    del self._index[_entry]
+
+    def index_add(self, name, value, key):
+        """
+        Connect a value to a key. If the connection already exists, the key
+        becomes the most recently added one.
+
+        :param name: Name of the index (e.g. 'nonce', 'subject id', ...)
+        :param value: The value
+        :param key: The key
+        """
+        _entry = (name, value)
+        with self._index_lock:
+            _keys = self._index.setdefault(_entry, {})
+            _keys.pop(key, None)
+            _keys[key] = None
+            self._indexed.setdefault(key, set()).add(_entry)
+
+    def index_get(self, name, value):
+        """
+        Return the keys connected to a value.
+
+        :param name: Name of the index
+        :param value: The value
+        :return: A list of keys, the most recently added last
+        """
+        with self._index_lock:
+            return list(self._index.get((name, value), ()))
+
+
+def state_cached(func):
+    """
+    Decorator that runs a :py:class:`StateInterface` method in a
+    :py:meth:`StateInterface.state_cache` scope.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self.state_cache():
+            return func(self, *args, **kwargs)
+    return wrapper
+
 
 class StateInterface:
     """A more powerful interface to a state DB."""
-    def __init__(self, state_db):
+    def __init__(self, state_db, serializer=None):
+        """
+        :param state_db: The state database
+        :param serializer: How a State is serialized, see
+            :py:mod:`oidcservice.state_serializer`. If not given the
+            *serializer* attribute of the state database is used, if there is
+            one, otherwise the State is stored as a JSON document.
+        """
         self.state_db = state_db
+        if serializer is None:
+            serializer = getattr(state_db, 'serializer', None)
+        self.serializer = serializer
+
+    @property
+    def state_db(self):
+        """
+        The state database. While :py:meth:`arun` runs a method, and only
+        in the thread and asyncio task that runs it, this is the overlay
+        the method is run against.
+        """
+        _overlay = _OVERLAY.get()
+        if _overlay is not None and _overlay.state_db is self._state_db:
+            return _overlay
+        return self._state_db
+
+    @state_db.setter
+    def state_db(self, state_db):
+        self._state_db = state_db
+
+    def _get_many(self, keys):
+        """
+        Read a number of keys from the state database. In one operation if
+        the database supports it.
+
+        :param keys: A list of keys
+        :return: A list of values in the same order as the keys.
+        """
+        _get_many = getattr(self.state_db, 'get_many', None)
+        if _get_many is None:
+            return [self.state_db.get(key) for key in keys]
+        return _get_many(keys)
+
+    def _set_many(self, items):
+        """
+        Write a number of keys to the state database. In one operation if
+        the database supports it.
+
+        :param items: A dictionary with keys and values
+        """
+        _set_many = getattr(self.state_db, 'set_many', None)
+        if _set_many is None:
+            for key, value in items.items():
+                self.state_db.set(key, value)
+        else:
+            _set_many(items)
+
+    def _delete_many(self, keys):
+        """
+        Delete a number of keys from the state database. In one operation if
+        the database supports it.
+
+        :param keys: A list of keys
+        """
+        _delete_many = getattr(self.state_db, 'delete_many', None)
+        if _delete_many is None:
+            for key in keys:
+                self.state_db.delete(key)
+        else:
+            _delete_many(keys)
 
     def get_state(self, key):
         """
@@ -66,11 +430,90 @@ class StateInterface:
         :param key: Key into the state database
         :return: A :py:class:´oidcservice.state_interface.State` instance
         """
-        _data = self.state_db.get(key)
-        if not _data:
-            raise KeyError(key)
+        _cache = _STATE_CACHE.get()
+        if _cache is not None:
+            try:
+                return _cache[(id(self.state_db), key)]
+            except KeyError:
+                pass
+
+        if self._field_level():
+            _fields = self.state_db.get_fields(key)
+            if not _fields:
+                raise KeyError(key)
+            _state = State().from_dict(_fields)
+        else:
+            _data = self.state_db.get(key)
+            if not _data:
+                raise KeyError(key)
+            _state = self._to_state(_data)
+
+        if _cache is not None:
+            _cache[(id(self.state_db), key)] = _state
+        return _state
 
-        return State().from_json(_data)
+    @contextmanager
+    def state_cache(self):
+        """
+        A scope, typically one operation like constructing a request, within
+        which a state is only decoded once, no matter how many times it is
+        read. A state that is stored, created or removed is dropped from the
+        cache. Changes made to the state database by others while the scope
+        is open will not be seen. States handed out must not be modified.
+
+        Scopes can be nested, the outermost one decides the lifetime of the
+        cache. Each thread and asyncio task has its own cache.
+        """
+        if _STATE_CACHE.get() is not None:
+            yield
+            return
+
+        _token = _STATE_CACHE.set({})
+        try:
+            yield
+        finally:
+            _STATE_CACHE.reset(_token)
+
+    def _forget(self, key):
+        """Drop a state from the cache of the ongoing operation."""
+        _cache = _STATE_CACHE.get()
+        if _cache:
+            _cache.pop((id(self.state_db), key), None)
+
+    def _to_state(self, data):
+        """Turn what was read from the state database into a State."""
+        if isinstance(data, State):
+            return data
+        if self.serializer is None:
+            return State().from_json(data)
+        return self.serializer.loads(data)
+
+    def _serialize(self, state):
+        """
+        Turn a State into what is written to the state database. Only
+        serialize it if the database can not handle State instances as they
+        are.
+        """
+        if getattr(self.state_db, 'native', False):
+            return state
+        if self.serializer is None:
+            return state.to_json()
+        return self.serializer.dumps(state)
+
+    def _field_level(self):
+        """Whether the state database can store each item separately."""
+        return hasattr(self.state_db, 'set_fields')
+
+    def _set_state(self, key, state):
+        """
+        Write a state to the state database. Only serialize it if the
+        database can not handle State instances as they are.
+
+        :param key: Key into the state database
+        :param state: A :py:class:´oidcservice.state_interface.State` instance
+        """
+        self._forget(key)
+        self.state_db.set(key, self._serialize(state))
 
     def store_item(self, item, item_type, key):
         """
@@ -82,17 +525,95 @@ class StateInterface:
         :param key: The key under which the information should be stored in
             the state database
         """
+        if self._field_level():
+            self._forget(key)
+            self._store_field(item, item_type, key)
+            return
+
+        _states = []
+
+        def _add_item(data):
+            if data:
+                _state = self._to_state(data)
+            else:
+                _state = State()
+
+            try:
+                _state[item_type] = item.to_json()
+            except AttributeError:
+                _state[item_type] = item
+
+            _states.append(_state)
+            return self._serialize(_state)
+
+        _update = getattr(self.state_db, 'update', None)
         try:
-            _state = self.get_state(key)
-        except KeyError:
-            _state = State()
+            if _update is None:
+                try:
+                    _state = self.get_state(key)
+                except KeyError:
+                    _state = None
+                self.state_db.set(key, _add_item(_state))
+            else:
+                # Atomic read-modify-write
+                _update(key, _add_item)
+        finally:
+            self._forget(key)
 
         try:
-            _state[item_type] = item.to_json()
+            _expires_at = _states[-1][item_type]['__expires_at']
+        except (KeyError, TypeError):
+            pass
+        else:
+            self._extend_lifetime(key, _expires_at)
+
+    def _store_field(self, item, item_type, key):
+        """
+        Store an item as one field of a state. None of the other fields are
+        read or written.
+        """
+        try:
+            _value = item.to_json()
         except AttributeError:
-            _state[item_type] = item
+            if isinstance(item, str):
+                _value = item
+            else:
+                _value = json.dumps(item)
 
-        self.state_db.set(key, _state.to_json())
+        self.state_db.set_fields(key, {item_type: _value})
+
+        # Only parse the JSON document if there is a chance it's needed
+        if '__expires_at' in _value:
+            try:
+                _expires_at = json.loads(_value)['__expires_at']
+            except (KeyError, TypeError):
+                pass
+            else:
+                self._extend_lifetime(key, _expires_at)
+
+    def _extend_lifetime(self, key, expires_at):
+        """
+        If the state database supports expiration make sure the state and
+        the keys connected to it does not expire before a given time.
+
+        :param key: Key to the state
+        :param expires_at: Expiration time in seconds since the epoch
+        """
+        try:
+            _expire_at = self.state_db.expire_at
+        except AttributeError:
+            return
+
+        _ref_key = "ref{}ref".format(key)
+        _keys = [key, _ref_key]
+        _val = self.state_db.get(_ref_key)
+        if _val:
+            for xtyp, _x in json.loads(_val).items():
+                _x_key = KEY_PATTERN[xtyp].format(_x)
+                _keys.extend([_x_key, INDEX_PATTERN.format(_x_key)])
+
+        for _key in _keys:
+            _expire_at(_key, expires_at)
 
     def get_iss(self, key):
         """
@@ -101,6 +622,12 @@ class StateInterface:
         :param key: Key to the information in the state database
         :return: The issuer ID
         """
+        if self._field_level():
+            _fields = self.state_db.get_fields(key, ['iss'])
+            if not _fields:
+                raise KeyError(key)
+            return _fields['iss']
+
         _state = self.get_state(key)
         if not _state:
             raise KeyError(key)
@@ -117,11 +644,30 @@ class StateInterface:
         :param key: The key to the information in the state database
         :return: A :py:class:`oidcmsg.message.Message` instance
         """
-        _state = self.get_state(key)
+        _item = self._get_items(key, [item_type])[item_type]
         try:
-            return item_cls(**_state[item_type])
+            return item_cls(**_item)
         except TypeError:
-            return item_cls().from_json(_state[item_type])
+            return item_cls().from_json(_item)
+
+    def _get_items(self, key, item_types):
+        """
+        Get a number of items belonging to a state. If the state database
+        supports it only those items are read and parsed.
+
+        :param key: The key to the information in the state database
+        :param item_types: List of item types
+        :return: A dictionary with item types as keys and the items as values.
+            Items that are not present are left out.
+        """
+        if self._field_level():
+            _fields = self.state_db.get_fields(key, item_types)
+            if _fields is None:
+                raise KeyError(key)
+            return {typ: json.loads(val) for typ, val in _fields.items()}
+
+        _state = self.get_state(key)
+        return {typ: _state[typ] for typ in item_types if typ in _state}
 
     def extend_request_args(self, args, item_cls, item_type, key,
                             parameters, orig=False):
@@ -182,11 +728,11 @@ class StateInterface:
             that.
         :return: A possibly augmented set of arguments.
         """
-        _state = self.get_state(key)
+        _items = self._get_items(key, item_types)
 
         for typ in item_types:
             try:
-                _item = Message(**_state[typ])
+                _item = Message(**_items[typ])
             except KeyError:
                 continue
 
@@ -207,40 +753,72 @@ class StateInterface:
 
         return args
 
+    def _indexed(self):
+        return hasattr(self.state_db, 'index_add')
+
     def store_x2state(self, value, state, xtyp):
         """
         Store the connection between some value (x) and a state value.
         This allows us later in the game to find the state if we have x.
+        A value may be connected to more than one state, a subject id for
+        instance is connected to all the logins done by that subject.
 
         :param value: The value
         :param state: The state value
         :param xtyp: The type of value x is (e.g. nonce, ...)
         """
-        self.state_db.set(KEY_PATTERN[xtyp].format(value), state)
-        try:
-            _val = self.state_db.get("ref{}ref".format(state))
-        except KeyError:
-            _val = None
+        if self._indexed():
+            self.state_db.index_add(xtyp, value, state)
+            return
 
-        if _val is None:
-            refs = {xtyp:value}
-        else:
-            refs = json.loads(_val)
-            refs[xtyp] = value
-        self.state_db.set("ref{}ref".format(state), json.dumps(refs))
+        _x_key = KEY_PATTERN[xtyp].format(value)
+        _idx_key = INDEX_PATTERN.format(_x_key)
+        _ref_key = "ref{}ref".format(state)
+
+        _refs, _states = self._get_many([_ref_key, _idx_key])
+        self._set_many({_x_key: state,
+                        _idx_key: _add_to_index(_states, state),
+                        _ref_key: _add_ref(_refs, xtyp, value)})
+
+    def get_states_by_x(self, value, xtyp):
+        """
+        Find all the state values connected to a x value.
+
+        :param value: The value
+        :param xtyp: The type of value x is (e.g. nonce, ...)
+        :return: A list of state values, the most recently connected last.
+            An empty list if the value is unknown.
+        """
+        if self._indexed():
+            return self.state_db.index_get(xtyp, value)
+
+        _x_key = KEY_PATTERN[xtyp].format(value)
+        _states, _state = self._get_many([INDEX_PATTERN.format(_x_key),
+                                          _x_key])
+        if _states is not None:
+            return json.loads(_states)
+        if _state:  # Stored before there was an index
+            return [_state]
+        return []
 
     def get_state_by_x(self, value, xtyp):
         """
         Find the state value by providing the x value.
         Will raise an exception if the x value is absent from the state
-        data base.
+        data base. If the value is connected to more than one state, the
+        most recently connected one is returned.
 
         :param value: The value
         :return: The state value
         """
-        _state = self.state_db.get(KEY_PATTERN[xtyp].format(value))
-        if _state:
-            return _state
+        if self._indexed():
+            _states = self.state_db.index_get(xtyp, value)
+            if _states:
+                return _states[-1]
+        else:
+            _state = self.state_db.get(KEY_PATTERN[xtyp].format(value))
+            if _state:
+                return _state
 
         raise KeyError('Unknown {}: "{}"'.format(xtyp, value))
 
@@ -265,6 +843,15 @@ class StateInterface:
         """
         return self.get_state_by_x(nonce, 'nonce')
 
+    def get_states_by_nonce(self, nonce):
+        """
+        Find all the state values connected to a nonce value.
+
+        :param nonce: The nonce value
+        :return: A list of state values
+        """
+        return self.get_states_by_x(nonce, 'nonce')
+
     def store_logout_state2state(self, logout_state, state):
         """
         Store the connection between a logout state value and a state value.
@@ -287,6 +874,15 @@ class StateInterface:
         """
         return self.get_state_by_x(logout_state, 'logout state')
 
+    def get_states_by_logout_state(self, logout_state):
+        """
+        Find all the state values connected to a logout state value.
+
+        :param logout_state: The logout state value
+        :return: A list of state values
+        """
+        return self.get_states_by_x(logout_state, 'logout state')
+
     def store_sid2state(self, sid, state):
         """
         Store the connection between a session id (sid) value and a state value.
@@ -309,6 +905,15 @@ class StateInterface:
         """
         return self.get_state_by_x(sid, 'session id')
 
+    def get_states_by_sid(self, sid):
+        """
+        Find all the state values connected to a session id value.
+
+        :param sid: The session ID value
+        :return: A list of state values
+        """
+        return self.get_states_by_x(sid, 'session id')
+
     def store_sub2state(self, sub, state):
         """
         Store the connection between a subject id (sub) value and a state value.
@@ -331,6 +936,16 @@ class StateInterface:
         """
         return self.get_state_by_x(sub, 'subject id')
 
+    def get_states_by_sub(self, sub):
+        """
+        Find all the state values connected to a subject id value. That is
+        all the logins done by the subject.
+
+        :param sub: The Subject ID value
+        :return: A list of state values
+        """
+        return self.get_states_by_x(sub, 'subject id')
+
     def create_state(self, iss, key=''):
         """
         Create a State and assign some value to it.
@@ -345,18 +960,235 @@ class StateInterface:
                 raise ValueError(
                     'Invalid format. Leading and trailing "__" not allowed')
 
+        if self._field_level():
+            self._forget(key)
+            self.state_db.delete(key)
+            self.state_db.set_fields(key, {'iss': iss})
+            return key
+
         _state = State(iss=iss)
-        self.state_db.set(key, _state.to_json())
+        self._set_state(key, _state)
         return key
 
     def remove_state(self, state):
         """
-        Remove a state.
+        Remove a state and its connections to other values.
+
+        If the database keeps the index itself this is one delete. Otherwise
+        it takes two reads, one of the references of the state and one of
+        the index keys named after the values in them, since those are not
+        known before the references have been read. Then one *delete_many*
+        and, if other states are still connected to any of the values, one
+        *set_many*, as there is no operation that does both. That is, at
+        most four operations no matter how many values are connected to the
+        state.
 
         :param state: Key to the state
         """
-        self.state_db.delete(state)
-        refs = json.loads(self.state_db.get("ref{}ref".format(state)))
-        if refs:
-            for xtyp, _val in refs.items():
-                self.state_db.delete(KEY_PATTERN[xtyp].format(_val))
+        self._forget(state)
+        if self._indexed():
+            # The database removes the index entries
+            self._delete_many([state])
+            return
+
+        _ref_key = "ref{}ref".format(state)
+        _keys = [state, _ref_key]
+
+        # The index keys are named after the values in the references, so
+        # those have to be read first
+        _val = self.state_db.get(_ref_key)
+        if not _val:
+            self._delete_many(_keys)
+            return
+
+        _x_keys = [KEY_PATTERN[xtyp].format(_x)
+                   for xtyp, _x in json.loads(_val).items()]
+        _idx_keys = [INDEX_PATTERN.format(k) for k in _x_keys]
+
+        _items = {}
+        for _x_key, _idx_key, _states in zip(_x_keys, _idx_keys,
+                                             self._get_many(_idx_keys)):
+            _states = _remove_from_index(_states, state)
+            if _states:
+                # Other states are still connected to the value
+                _items[_x_key] = json.loads(_states)[-1]
+                _items[_idx_key] = _states
+            else:
+                _keys.extend([_x_key, _idx_key])
+
+        self._delete_many(_keys)
+        if _items:
+            self._set_many(_items)
+
+    # ------------------ asyncio -----------------------
+
+    def _state_reads(self, key):
+        """What to load before running something that uses a state."""
+        if supports(self._state_db, 'set_fields'):
+            _read = ('fields', key)
+        else:
+            _read = ('get', key)
+        return [_read, ('get', "ref{}ref".format(key))]
+
+    def _x_reads(self, value, xtyp):
+        """What to load before connecting a value to a state."""
+        if supports(self._state_db, 'index_add'):
+            return [('index', xtyp, value)]
+        _x_key = KEY_PATTERN[xtyp].format(value)
+        return [('get', _x_key), ('get', INDEX_PATTERN.format(_x_key))]
+
+    def _ref_reads(self, overlay, reads):
+        """
+        What to load, given what has been loaded, before removing the states
+        that are read with ('refs', state).
+        """
+        _reads = []
+        for _read in reads:
+            if _read[0] != 'refs':
+                continue
+            _val = overlay.loaded(('get', "ref{}ref".format(_read[1])))
+            if not _val:
+                continue
+            for xtyp, _x in json.loads(_val).items():
+                _reads.extend(self._x_reads(_x, xtyp))
+        return _reads
+
+    async def _aload(self, overlay, reads, held):
+        """
+        Load what is to be read. The reads that can only be known once
+        something has been loaded are added to the list of reads.
+
+        :return: False if a read has been added that is not locked
+        """
+        _reads = [r for r in reads if r[0] != 'refs']
+        while True:
+            await overlay.aload(_reads)
+            _reads = [r for r in self._ref_reads(overlay, reads)
+                      if r not in reads]
+            if not _reads:
+                return True
+            reads.extend(_reads)
+            if any(lock_key(r) not in held for r in _reads):
+                return False
+
+    async def _avalidate(self, overlay, reads):
+        """
+        Make sure that what the method read, and what it read that was not
+        loaded, is still what is in the state database.
+        """
+        _fresh = OverlayStateDataBase(self._state_db)
+        await _fresh.aload([r for r in reads if r[0] != 'refs'])
+        for _read in reads:
+            if _read[0] != 'refs' and \
+                    _fresh.loaded(_read) != overlay.loaded(_read):
+                raise StateConflict(
+                    'State database changed while running: {}'.format(_read))
+
+    async def arun(self, reads, func, *args, **kwargs):
+        """
+        Run a synchronous method, that uses the state database, without
+        blocking on I/O. The method is run against an
+        :py:class:`oidcservice.async_state.OverlayStateDataBase` into which
+        the necessary values are loaded beforehand. Finally what the method
+        wrote is written to the state database.
+
+        Must be run in the thread that runs the event loop. The overlay is
+        only seen by the method, as the *state_db* of this and any other
+        state interface on the same state database, others using the same
+        instance at the same time see the state database.
+
+        The method is run once. What it reads is locked until what it wrote
+        has been written back, so concurrent runs that read the same keys of
+        the state database are done one after the other. If the method reads
+        something that was not expected, it gets nothing back. It is then
+        made sure, with the locks taken again, that there is still nothing
+        there and that nothing else the method read has changed. If there
+        is, :py:class:`oidcservice.exception.StateConflict` is raised and
+        nothing is written.
+
+        :param reads: What is expected to be read by the method. Apart from
+            the reads the overlay knows, ('refs', state) loads the
+            references of a state and the keys they name.
+        :param func: The method
+        :param args: Positional arguments to the method
+        :param kwargs: Keyword arguments to the method
+        :return: What the method returned
+        """
+        _db = self._state_db
+        _locks = key_locks(_db)
+        _reads = list(reads)
+        _held = []
+        try:
+            while True:
+                _held = await _locks.acquire(lock_key(r) for r in _reads)
+                _overlay = OverlayStateDataBase(_db)
+                if await self._aload(_overlay, _reads, _held):
+                    break
+                _locks.release(_held)
+                _held = []
+
+            _overlay.begin()
+            _token = _OVERLAY.set(_overlay)
+            _error = None
+            try:
+                result = func(*args, **kwargs)
+            except Exception as err:
+                _error = err
+            finally:
+                _OVERLAY.reset(_token)
+
+            if _overlay.missing:
+                _reads.extend(r for r in _overlay.missing if r not in _reads)
+                _locks.release(_held)
+                _held = []
+                _held = await _locks.acquire(lock_key(r) for r in _reads)
+                await self._avalidate(_overlay, _reads)
+            if _error is not None:
+                raise _error
+            await _overlay.awrite_back()
+            return result
+        finally:
+            _locks.release(_held)
+
+    async def aget_state(self, key):
+        """The asyncio version of :py:meth:`get_state`."""
+        return await self.arun(self._state_reads(key), self.get_state, key)
+
+    async def astore_item(self, item, item_type, key):
+        """The asyncio version of :py:meth:`store_item`."""
+        return await self.arun(self._state_reads(key), self.store_item, item,
+                               item_type, key)
+
+    async def aget_item(self, item_cls, item_type, key):
+        """The asyncio version of :py:meth:`get_item`."""
+        return await self.arun(self._state_reads(key), self.get_item,
+                               item_cls, item_type, key)
+
+    async def amultiple_extend_request_args(self, args, key, parameters,
+                                            item_types, orig=False):
+        """The asyncio version of :py:meth:`multiple_extend_request_args`."""
+        return await self.arun(self._state_reads(key),
+                               self.multiple_extend_request_args, args, key,
+                               parameters, item_types, orig)
+
+    async def astore_x2state(self, value, state, xtyp):
+        """The asyncio version of :py:meth:`store_x2state`."""
+        return await self.arun(
+            self._state_reads(state)[1:] + self._x_reads(value, xtyp),
+            self.store_x2state, value, state, xtyp)
+
+    async def aget_state_by_x(self, value, xtyp):
+        """The asyncio version of :py:meth:`get_state_by_x`."""
+        return await self.arun(self._x_reads(value, xtyp),
+                               self.get_state_by_x, value, xtyp)
+
+    async def acreate_state(self, iss, key=''):
+        """The asyncio version of :py:meth:`create_state`."""
+        return await self.arun([], self.create_state, iss, key)
+
+    async def aremove_state(self, state):
+        """The asyncio version of :py:meth:`remove_state`."""
+        _reads = self._state_reads(state)
+        if not supports(self._state_db, 'index_add'):
+            _reads.append(('refs', state))
+        return await self.arun(_reads, self.remove_state, state)
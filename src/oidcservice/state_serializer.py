@@ -0,0 +1,135 @@
+"""
+Serializers that turn a :py:class:`oidcservice.state_interface.State` into
+what is stored in the state database and back again.
+
+A serializer has two methods: *dumps* which given a State returns a string
+or bytes and *loads* which does the reverse.
+"""
+import json
+import logging
+import struct
+
+from oidcservice.state_interface import State
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class JSONStateSerializer:
+    """
+    The format used by default. The State is a JSON document where each
+    item (auth_request, token_response, ...) is a JSON encoded string.
+    """
+
+    @staticmethod
+    def dumps(state):
+        """
+        :param state: A :py:class:`oidcservice.state_interface.State`
+            instance
+        :return: A JSON document
+        """
+        return state.to_json()
+
+    @staticmethod
+    def loads(data):
+        """
+        :param data: A JSON document
+        :return: A :py:class:`oidcservice.state_interface.State` instance
+        """
+        return State().from_json(data)
+
+
+# Starts every record in the binary format. A JSON document can not start
+# with a NUL byte. The second byte is the version of the format.
+MAGIC = b'\x00\x01'
+
+# Field names that are replaced by a number. Names may only be added at the
+# end of this list, otherwise records already stored can not be read.
+FIELD_NAMES = [
+    None,  # 0 means the name follows the field header
+    'iss', 'auth_request', 'auth_response', 'token_response',
+    'refresh_token_request', 'refresh_token_response', 'user_info', 'pkce',
+]
+FIELD_IDS = {name: n for n, name in enumerate(FIELD_NAMES) if name}
+
+# Field name number, value type and value length
+FIELD_HEADER = struct.Struct('>BBI')
+STRING = 0
+JSON = 1
+
+_encode_json = json.JSONEncoder(separators=(',', ':')).encode
+_decode_json = json.JSONDecoder().decode
+
+
+class BinaryStateSerializer:
+    """
+    A compact binary format. A record is a sequence of fields, each one a
+    header followed by the value. Well known field names are replaced by a
+    number. Items are stored as compact JSON documents, which means that an
+    ID Token or access token in an item is not escaped a second time as it
+    is in the JSON format.
+
+    Records in the JSON format are read as well, so a database can be
+    migrated gradually. A state is stored in the binary format the next time
+    it is updated.
+    """
+
+    @staticmethod
+    def dumps(state):
+        """
+        :param state: A :py:class:`oidcservice.state_interface.State`
+            instance
+        :return: The record as bytes
+        """
+        _parts = [MAGIC]
+        for name, value in state.items():
+            if isinstance(value, str):
+                _type = STRING
+                _raw = value.encode('utf-8')
+            else:
+                _type = JSON
+                _raw = _encode_json(value).encode('utf-8')
+
+            _id = FIELD_IDS.get(name, 0)
+            _parts.append(FIELD_HEADER.pack(_id, _type, len(_raw)))
+            if not _id:
+                _name = name.encode('utf-8')
+                _parts.append(bytes([len(_name)]))
+                _parts.append(_name)
+            _parts.append(_raw)
+        return b''.join(_parts)
+
+    @staticmethod
+    def loads(data):
+        """
+        :param data: A record in the binary or the JSON format
+        :return: A :py:class:`oidcservice.state_interface.State` instance
+        """
+        if isinstance(data, str):
+            return State().from_json(data)
+        if not data.startswith(MAGIC):
+            return State().from_json(data.decode('utf-8'))
+
+        _fields = {}
+        _pos = len(MAGIC)
+        _end = len(data)
+        _size = FIELD_HEADER.size
+        while _pos < _end:
+            _id, _type, _length = FIELD_HEADER.unpack_from(data, _pos)
+            _pos += _size
+            if _id:
+                _name = FIELD_NAMES[_id]
+            else:
+                _name_end = _pos + 1 + data[_pos]
+                _name = data[_pos + 1:_name_end].decode('utf-8')
+                _pos = _name_end
+
+            _value = data[_pos:_pos + _length].decode('utf-8')
+            _pos += _length
+            if _type == STRING:
+                _fields[_name] = _value
+            else:
+                _fields[_name] = _decode_json(_value)
+
+        return State(**_fields)
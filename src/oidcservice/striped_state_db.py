@@ -0,0 +1,69 @@
+"""An in-memory state database that can be shared by a number of threads."""
+import logging
+import threading
+
+from oidcservice.state_interface import IndexedStateDataBase
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StripedStateDataBase(IndexedStateDataBase):
+    """
+    A thread safe in-memory state database.
+
+    The keys are spread over a number of locks (stripes) so threads working
+    on different states seldom have to wait for each other. Reads are not
+    locked.
+
+    The database has an atomic read-modify-write operation, :py:meth:`update`,
+    which :py:class:`oidcservice.state_interface.StateInterface` uses when
+    storing an item in a state. So two threads storing different items in the
+    same state, like the authorization request and the PKCE code verifier, will
+    not overwrite each other's changes.
+
+    The database keeps its own secondary index, so connecting a value, like
+    a subject id, to a state is atomic as well.
+    """
+
+    def __init__(self, stripes=64):
+        """
+        :param stripes: The number of locks
+        """
+        IndexedStateDataBase.__init__(self)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+
+    def _lock(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def set(self, key, value):
+        """Assign a value to a key."""
+        with self._lock(key):
+            self._db[key] = value
+
+    def delete(self, key):
+        """Delete a key, its value and the index entries pointing to it."""
+        with self._lock(key):
+            IndexedStateDataBase.delete(self, key)
+
+    def update(self, key, func):
+        """
+        Atomically replace the value bound to a key.
+
+        *func* is run while the key is locked so it must not use the
+        database.
+
+        :param key: The key
+        :param func: A function that is given the present value, None if the
+            key is unknown, and returns the new value. If it returns None
+            the key is deleted, and its index entries with it.
+        :return: The new value
+        """
+        with self._lock(key):
+            _value = func(self._db.get(key))
+            if _value is None:
+                IndexedStateDataBase.delete(self, key)
+            else:
+                self._db[key] = _value
+            return _value
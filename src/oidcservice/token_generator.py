@@ -0,0 +1,83 @@
+"""Random strings, like state, nonce, jti and PKCE code verifiers."""
+import logging
+import os
+import threading
+import weakref
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+_GENERATORS = weakref.WeakSet()
+
+
+class TokenGenerator:
+    """
+    Makes random strings from an alphabet using os.urandom.
+
+    Random bytes are read in bulk. A byte is mapped to the character at
+    its value modulo the size of the alphabet, bytes above the largest
+    multiple of the size are thrown away so that every character is equally
+    likely. The characters are kept in a buffer until they are used. A
+    forked process starts with an empty buffer.
+
+    Thread safe.
+    """
+
+    def __init__(self, alphabet, buffer_size=4096):
+        """
+        :param alphabet: The characters to use, at most 256 ASCII characters
+        :param buffer_size: How many random bytes to read at a time
+        """
+        if not alphabet or len(alphabet) > 256 or \
+                len(set(alphabet)) != len(alphabet):
+            raise ValueError('Not a usable alphabet')
+        _alphabet = alphabet.encode('ascii')
+        _size = len(_alphabet)
+        _limit = 256 - 256 % _size
+        self._table = bytes(_alphabet[b % _size] for b in range(_limit)) + \
+            bytes(256 - _limit)
+        self._delete = bytes(range(_limit, 256))
+        self.buffer_size = buffer_size
+        self._buffer = b''
+        self._pos = 0
+        self._lock = threading.Lock()
+        _GENERATORS.add(self)
+
+    def _refill(self, size):
+        _buffer = self._buffer[self._pos:]
+        while len(_buffer) < size:
+            _buffer += os.urandom(max(self.buffer_size, size)).translate(
+                self._table, self._delete)
+        self._buffer = _buffer
+        self._pos = 0
+
+    def reset(self):
+        """Forget the buffered characters."""
+        with self._lock:
+            self._buffer = b''
+            self._pos = 0
+
+    def __call__(self, size):
+        """
+        :param size: The length of the string
+        :return: A random string
+        """
+        with self._lock:
+            if len(self._buffer) - self._pos < size:
+                self._refill(size)
+            _start = self._pos
+            self._pos += size
+            return self._buffer[_start:self._pos].decode('ascii')
+
+
+def _reset_after_fork():
+    for _generator in list(_GENERATORS):
+        # The lock may have been held by another thread when forking
+        _generator._lock = threading.Lock()
+        _generator.reset()
+
+
+# There is no fork on Windows
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
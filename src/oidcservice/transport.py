@@ -0,0 +1,147 @@
+"""
+Sending the requests a service has built and getting the responses back.
+
+A transport has one method, *send*, which is given the URL, the HTTP method,
+the body and the headers of a request and returns a response with the
+attributes *status_code*, *text* and *headers*. This is what
+:py:meth:`oidcservice.service.Service.service_request` uses.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from oidcservice.exception import TransportError
+
+__author__ = 'Roland Hedberg'
+
+LOGGER = logging.getLogger(__name__)
+
+# What is reported after each call. endpoint is the URL without the query
+# part, which may contain secrets, seconds is the time from sending the
+# request until the whole response was read.
+Timing = namedtuple('Timing',
+                    ['issuer', 'method', 'endpoint', 'status_code', 'seconds'])
+
+
+def origin(url):
+    """
+    :param url: A URL
+    :return: The scheme, host and port of the URL
+    """
+    _part = urlparse(url)
+    return '{}://{}'.format(_part.scheme, _part.netloc)
+
+
+class RequestsTransport:
+    """
+    A transport that uses the requests library. Each issuer has its own
+    session and with that its own pool of keep-alive connections, so that
+    all the services that talk to one OP reuse the same connections.
+
+    Thread safe.
+    """
+
+    def __init__(self, timeout=10, pool_maxsize=10, verify=True,
+                 on_timing=None):
+        """
+        :param timeout: Seconds to wait for the OP, either a number or a
+            (connect, read) tuple. None means forever.
+        :param pool_maxsize: The number of connections to keep per host
+        :param verify: Whether the TLS certificate of the OP should be
+            verified or the path to a CA bundle to verify it with
+        :param on_timing: A function that is given a :py:class:`Timing`
+            after each call
+        """
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.verify = verify
+        self.on_timing = on_timing
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session(self, issuer):
+        """
+        :param issuer: The issuer ID of the OP
+        :return: The requests session used for the issuer
+        """
+        try:
+            return self._sessions[issuer]
+        except KeyError:
+            pass
+
+        with self._lock:
+            _session = self._sessions.get(issuer)
+            if _session is None:
+                _session = requests.Session()
+                _adapter = HTTPAdapter(pool_maxsize=self.pool_maxsize)
+                _session.mount('https://', _adapter)
+                _session.mount('http://', _adapter)
+                _session.verify = self.verify
+                self._sessions[issuer] = _session
+            return _session
+
+    def send(self, url, method='GET', body=None, headers=None, issuer='',
+             timeout=None):
+        """
+        Send a request and read the response.
+
+        :param url: Where to send the request
+        :param method: HTTP method
+        :param body: The body of the request, if any
+        :param headers: HTTP headers
+        :param issuer: The issuer ID of the OP, decides which connection pool
+            is used. If not given the scheme, host and port of the URL is
+            used.
+        :param timeout: Overrides the timeout given when the transport was
+            created
+        :return: A requests.Response instance
+        """
+        if not issuer:
+            issuer = origin(url)
+        if timeout is None:
+            timeout = self.timeout
+
+        _start = time.perf_counter()
+        try:
+            _resp = self.session(issuer).request(
+                method, url, data=body, headers=headers, timeout=timeout,
+                allow_redirects=False)
+        except requests.RequestException as err:
+            LOGGER.error('%s %s failed: %s', method, url, err)
+            raise TransportError('{} {} failed: {}'.format(method, url, err))
+
+        if self.on_timing is not None:
+            self.on_timing(Timing(issuer, method, url.split('?', 1)[0],
+                                  _resp.status_code,
+                                  time.perf_counter() - _start))
+        return _resp
+
+    def close(self):
+        """Close all connections."""
+        with self._lock:
+            _sessions = list(self._sessions.values())
+            self._sessions = {}
+        for _session in _sessions:
+            _session.close()
+
+
+_DEFAULT_TRANSPORT = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def default_transport():
+    """
+    :return: The transport used by services that have not been given one.
+        Created the first time it is asked for.
+    """
+    global _DEFAULT_TRANSPORT
+    if _DEFAULT_TRANSPORT is None:
+        with _DEFAULT_LOCK:
+            if _DEFAULT_TRANSPORT is None:
+                _DEFAULT_TRANSPORT = RequestsTransport()
+    return _DEFAULT_TRANSPORT
@@ -43,6 +43,39 @@ def get_http_url(url, req, method='GET'):
     return url
 
 
+def get_content_type(request_body_type):
+    """
+    Map a request body type to the content type of the HTTP body.
+
+    :param request_body_type: One of 'urlencoded', 'json', 'jws', 'jwe' or
+        'jose'
+    :return: A content type
+    """
+    if request_body_type == 'urlencoded':
+        return URL_ENCODED
+    if request_body_type in ['jws', 'jwe', 'jose']:
+        return JOSE_ENCODED
+    return JSON_ENCODED  # request_body_type == 'json'
+
+
+def get_response_body_type(headers, default='json'):
+    """
+    Find out how a response is serialized from its Content-Type header.
+
+    :param headers: The HTTP headers of the response
+    :param default: What to use if the content type is missing or not known
+    :return: One of 'jwt', 'json', 'urlencoded' or the default
+    """
+    _type = headers.get('content-type', headers.get('Content-Type', ''))
+    if 'application/jwt' in _type:
+        return 'jwt'
+    if JSON_ENCODED in _type:
+        return 'json'
+    if URL_ENCODED in _type:
+        return 'urlencoded'
+    return default
+
+
 def get_http_body(req, content_type=URL_ENCODED):
     """
     Get the message into the format that should be places in the body part
@@ -1,3 +1,7 @@
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
 from oidcmsg.exception import OidcMsgError
 from oidcmsg.oauth2 import AuthorizationRequest
 
@@ -10,6 +14,9 @@ class HTTPResponse(object):
 
 
 class MockOP(object):
+    # Paths that can not be method names
+    paths = {'.well-known/openid-configuration': 'discovery'}
+
     def __init__(self, baseurl='http://example.com/'):
         self.baseurl = baseurl
 
@@ -21,16 +28,16 @@ class MockOP(object):
 
         if '?' in path:
             what, req = path.split('?', 1)
-            meth = getattr(self, what)
-            return meth(req)
+            meth = getattr(self, self.paths.get(what, what))
+            return meth(req, **kwargs)
         else:
-            meth = getattr(self, path)
-            return meth(kwargs['data'])
+            meth = getattr(self, self.paths.get(path, path))
+            return meth(kwargs.pop('data', None), **kwargs)
 
-    def discovery(self):
+    def discovery(self, request=None, **kwargs):
         pass
 
-    def register(self, request):
+    def register(self, request, **kwargs):
         pass
 
     def authorization(self, request, **kwargs):
@@ -47,3 +54,71 @@ class MockOP(object):
 
     def userinfo(self, request, **kwargs):
         pass
+
+
+class MockOPServer(object):
+    """
+    Runs a MockOP as a local HTTP server. Connections are kept alive and
+    counted so that connection reuse can be checked.
+    """
+
+    def __init__(self, op):
+        self.op = op
+        self.connections = 0
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0),
+                                           self._handler_class())
+        self._server.daemon_threads = True
+        self.baseurl = 'http://127.0.0.1:{}/'.format(self._server.server_port)
+        op.baseurl = self.baseurl
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        daemon=True)
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                mock.connections += 1
+
+            def _respond(self):
+                _length = int(self.headers.get('Content-Length', 0))
+                _body = self.rfile.read(_length).decode('utf-8') or None
+                try:
+                    resp = mock.op(mock.baseurl + self.path[1:],
+                                   self.command, data=_body,
+                                   headers=dict(self.headers))
+                except AttributeError:
+                    resp = HTTPResponse('Not found', 404)
+
+                _text = resp.text.encode('utf-8')
+                self.send_response(resp.status_code)
+                for name, value in resp.headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(_text)))
+                self.end_headers()
+                self.wfile.write(_text)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
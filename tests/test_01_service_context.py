@@ -1,4 +1,5 @@
 import os
+import time
 from urllib.parse import urlsplit
 
 import pytest
@@ -256,3 +257,143 @@ class TestClientInfo(object):
         # Now there should be one belonging to https://example.com
         assert len(self.service_context.keyjar.get_issuer_keys(
             'https://example.com')) == 1
+
+
+class TestCachedKeys(object):
+    @pytest.fixture(autouse=True)
+    def create_service_context(self):
+        self.service_context = ServiceContext(
+            config={'client_secret': 'a longesh password'})
+        self.resolved = 0
+
+    def _resolve(self):
+        self.resolved += 1
+        return self.service_context.keyjar.get_signing_key('oct')
+
+    def _keys(self, alg='HS256'):
+        return self.service_context.cached_keys(('test', alg, '', ''),
+                                                self._resolve)
+
+    def test_cached(self):
+        _keys = self._keys()
+        assert len(_keys) == 1
+        assert self._keys() is _keys
+        assert self.resolved == 1
+        self._keys('HS384')
+        assert self.resolved == 2
+
+    def test_keys_changed(self):
+        self._keys()
+        self.service_context.keys_changed()
+        self._keys()
+        assert self.resolved == 2
+
+    def test_bundle_added(self):
+        self._keys()
+        self.service_context.keyjar.add_symmetric('', 'another password')
+        assert len(self._keys()) == 1
+        self.service_context.keys_changed()
+        assert len(self._keys()) == 2
+
+    def test_client_secret(self):
+        self._keys()
+        self.service_context.client_secret = 'another longesh password'
+        _keys = self._keys()
+        assert self.resolved == 2
+        assert [k.key for k in _keys] == [b'another longesh password']
+
+    def test_new_keyjar(self):
+        self._keys()
+        self.service_context.keyjar = build_keyjar(
+            [{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+        assert self._keys() == []
+
+    def test_key_inactive(self):
+        _keys = self._keys()
+        _keys[0].inactive_since = 1
+        assert self._keys() == []
+
+    def test_remote_bundle_due(self, monkeypatch):
+        _bundle = self.service_context.keyjar.issuer_keys[''][0]
+        _bundle.remote = True
+        _now = time.time()
+        _bundle.time_out = _now + 3600
+        self._keys()
+        self._keys()
+        assert self.resolved == 1
+
+        monkeypatch.setattr(time, 'time', lambda: _now + 3601)
+        self._keys()
+        assert self.resolved == 2
+
+    def test_other_owner(self):
+        _context = self.service_context
+        _context.keyjar.add_symmetric('https://op', 'a longesh password')
+
+        def resolve():
+            self.resolved += 1
+            return _context.keyjar.get_signing_key('oct', 'https://op')
+
+        _keys = _context.cached_keys(('test', 'HS256', '', ''), resolve)
+        assert _context.cached_keys(('test', 'HS256', '', ''),
+                                    resolve) is _keys
+        # Rotated
+        _context.keyjar['https://op'] = []
+        _context.keyjar.add_symmetric('https://op', 'another password')
+        _context.keys_changed()
+        _keys = _context.cached_keys(('test', 'HS256', '', ''), resolve)
+        assert self.resolved == 2
+        assert [k.key for k in _keys] == [b'another password']
+
+    def test_owner(self):
+        self.service_context.cached_keys(('test', 'HS256', '', ''),
+                                         self._resolve, owner='https://op')
+        self._keys()
+        assert self.resolved == 2
+        self.service_context.cached_keys(('test', 'HS256', '', ''),
+                                         self._resolve, owner='https://op')
+        assert self.resolved == 2
+
+
+class TestClientSecret(object):
+    @pytest.fixture(autouse=True)
+    def create_service_context(self):
+        self.service_context = ServiceContext(
+            config={'client_id': 'client_id',
+                    'client_secret': 'a longesh password'})
+
+    def _secrets(self):
+        return [k.key for k in self.service_context.keyjar.get_signing_key(
+            'oct')]
+
+    def test_one_key(self):
+        assert self._secrets() == [b'a longesh password']
+        self.service_context.client_secret = 'a longesh password'
+        assert self._secrets() == [b'a longesh password']
+        assert self.service_context.secret_generation == 1
+
+    def test_rotation(self):
+        self.service_context.keyjar.add_symmetric('', 'another longesh key')
+        self.service_context.client_secret = 'another longesh password'
+        assert self._secrets() == [b'another longesh key',
+                                   b'another longesh password']
+        assert self.service_context.secret_generation == 2
+        self.service_context.client_secret = ''
+        assert self._secrets() == [b'another longesh key']
+
+    def test_new_keyjar(self):
+        self.service_context.keyjar = build_keyjar(
+            [{"type": "EC", "crv": "P-256", "use": ["sig"]}])
+        self.service_context.client_secret = 'a longesh password'
+        assert self._secrets() == [b'a longesh password']
+
+    def test_basic_credentials(self):
+        _credentials = self.service_context.basic_credentials(
+            'client_id', 'a longesh password')
+        assert _credentials[1] == 'Basic {}'.format(_credentials[0])
+        assert self.service_context.basic_credentials(
+            'client_id', 'a longesh password') is _credentials
+
+        self.service_context.client_secret_expires_at = 1000
+        assert self.service_context.basic_credentials(
+            'client_id', 'a longesh password') is not _credentials
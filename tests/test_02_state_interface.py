@@ -0,0 +1,505 @@
+import sys
+import threading
+
+import pytest
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oauth2 import AuthorizationRequest
+from oidcmsg.oauth2 import AuthorizationResponse
+
+from oidcservice.state_interface import FieldStateDataBase
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import IndexedStateDataBase
+from oidcservice.state_interface import ObjectStateDataBase
+from oidcservice.state_interface import State
+from oidcservice.state_interface import StateInterface
+from oidcservice.state_serializer import BinaryStateSerializer
+from oidcservice.state_serializer import JSONStateSerializer
+from oidcservice.striped_state_db import StripedStateDataBase
+
+ISS = 'https://example.org/op'
+
+
+class CountingStateDataBase(InMemoryStateDataBase):
+    """Counts the number of calls made to the database."""
+
+    def __init__(self):
+        InMemoryStateDataBase.__init__(self)
+        self.calls = []
+
+    def get(self, key):
+        self.calls.append('get')
+        return InMemoryStateDataBase.get(self, key)
+
+    def get_many(self, keys):
+        self.calls.append('get_many')
+        return [InMemoryStateDataBase.get(self, k) for k in keys]
+
+    def set_many(self, items):
+        self.calls.append('set_many')
+        for key, value in items.items():
+            InMemoryStateDataBase.set(self, key, value)
+
+    def delete_many(self, keys):
+        self.calls.append('delete_many')
+        for key in keys:
+            InMemoryStateDataBase.delete(self, key)
+
+
+class CountingUpdateStateDataBase(CountingStateDataBase):
+    """Also has a read-modify-write operation."""
+
+    def update(self, key, func):
+        self.calls.append('update')
+        _value = func(InMemoryStateDataBase.get(self, key))
+        InMemoryStateDataBase.set(self, key, _value)
+        return _value
+
+
+class SimpleStateDataBase(object):
+    """Only supports the basic set/get/delete operations."""
+
+    def __init__(self):
+        self.db = {}
+
+    def set(self, key, value):
+        self.db[key] = value
+
+    def get(self, key):
+        return self.db.get(key)
+
+    def delete(self, key):
+        self.db.pop(key, None)
+
+
+def run_flow(state_interface, key):
+    state_interface.create_state(ISS, key)
+    state_interface.store_item(
+        AuthorizationRequest(response_type='code', client_id='client_id',
+                             state=key, redirect_uri='https://rp/cb'),
+        'auth_request', key)
+    state_interface.store_nonce2state('nonce', key)
+    state_interface.store_item(
+        AuthorizationResponse(code='access_code', state=key),
+        'auth_response', key)
+    state_interface.store_item(
+        AccessTokenResponse(access_token='token', token_type='Bearer',
+                            refresh_token='refresh'),
+        'token_response', key)
+
+
+class TestStateInterface(object):
+    @pytest.fixture(autouse=True, params=[InMemoryStateDataBase,
+                                          FieldStateDataBase,
+                                          IndexedStateDataBase,
+                                          StripedStateDataBase])
+    def create_state_interface(self, request):
+        self.state_interface = StateInterface(request.param())
+
+    def test_create_state(self):
+        key = self.state_interface.create_state(ISS)
+        assert self.state_interface.get_iss(key) == ISS
+
+    def test_create_state_faulty_key(self):
+        with pytest.raises(ValueError):
+            self.state_interface.create_state(ISS, '__key__')
+
+    def test_get_unknown_state(self):
+        with pytest.raises(KeyError):
+            self.state_interface.get_state('unknown')
+
+    def test_store_and_get_item(self):
+        run_flow(self.state_interface, 'abcde')
+        _item = self.state_interface.get_item(AuthorizationResponse,
+                                              'auth_response', 'abcde')
+        assert _item['code'] == 'access_code'
+
+    def test_multiple_extend_request_args(self):
+        run_flow(self.state_interface, 'abcde')
+        args = self.state_interface.multiple_extend_request_args(
+            {}, 'abcde', ['access_token', 'code'],
+            ['auth_response', 'token_response'])
+        assert args == {'access_token': 'token', 'code': 'access_code'}
+
+    def test_remove_state(self):
+        run_flow(self.state_interface, 'abcde')
+        self.state_interface.remove_state('abcde')
+        with pytest.raises(KeyError):
+            self.state_interface.get_state('abcde')
+        with pytest.raises(KeyError):
+            self.state_interface.get_state_by_nonce('nonce')
+
+    def test_remove_state_without_refs(self):
+        self.state_interface.create_state(ISS, 'abcde')
+        self.state_interface.remove_state('abcde')
+        with pytest.raises(KeyError):
+            self.state_interface.get_state('abcde')
+
+    def test_get_missing_item(self):
+        self.state_interface.create_state(ISS, 'abcde')
+        with pytest.raises(KeyError):
+            self.state_interface.get_item(AuthorizationResponse,
+                                          'auth_response', 'abcde')
+
+    def test_extend_request_args(self):
+        run_flow(self.state_interface, 'abcde')
+        args = self.state_interface.extend_request_args(
+            {}, AuthorizationRequest, 'auth_request', 'abcde',
+            ['redirect_uri', 'client_id', 'scope'])
+        assert args == {'redirect_uri': 'https://rp/cb',
+                        'client_id': 'client_id'}
+
+    def test_multiple_refs(self):
+        self.state_interface.create_state(ISS, 'abcde')
+        self.state_interface.store_nonce2state('nonce', 'abcde')
+        self.state_interface.store_sid2state('sid', 'abcde')
+        assert self.state_interface.get_state_by_nonce('nonce') == 'abcde'
+        assert self.state_interface.get_state_by_sid('sid') == 'abcde'
+        self.state_interface.remove_state('abcde')
+        assert self.state_interface.state_db._db == {}
+
+
+class TestBulkOperations(object):
+    @pytest.mark.parametrize('state_db', [CountingStateDataBase,
+                                          CountingUpdateStateDataBase])
+    def test_store_x2state(self, state_db):
+        _db = state_db()
+        _interface = StateInterface(_db)
+        _interface.store_nonce2state('nonce', 'abcde')
+        _interface.store_sid2state('sid', 'abcde')
+        assert _db.calls == ['get_many', 'set_many', 'get_many', 'set_many']
+
+    @pytest.mark.parametrize('state_db', [CountingStateDataBase,
+                                          CountingUpdateStateDataBase])
+    def test_remove_state(self, state_db):
+        _db = state_db()
+        _interface = StateInterface(_db)
+        run_flow(_interface, 'abcde')
+        _interface.store_sid2state('sid', 'abcde')
+        _interface.store_sid2state('sid', 'fghij')
+        _db.calls = []
+        _interface.remove_state('abcde')
+        assert _db.calls == ['get', 'get_many', 'delete_many', 'set_many']
+        assert _interface.get_states_by_sid('sid') == ['fghij']
+        _interface.remove_state('fghij')
+        assert _db._db == {}
+
+    def test_fallback(self):
+        _db = SimpleStateDataBase()
+        _interface = StateInterface(_db)
+        run_flow(_interface, 'abcde')
+        assert _interface.get_state_by_nonce('nonce') == 'abcde'
+        assert _interface._get_many(['abcde', 'unknown'])[1] is None
+        _interface.remove_state('abcde')
+        assert _db.db == {}
+
+    def test_stored_before_index(self):
+        _db = SimpleStateDataBase()
+        _db.set('==sub==', 'abcde')
+        _interface = StateInterface(_db)
+        assert _interface.get_states_by_sub('sub') == ['abcde']
+
+
+class TestSecondaryIndex(object):
+    @pytest.fixture(autouse=True, params=[InMemoryStateDataBase,
+                                          SimpleStateDataBase,
+                                          IndexedStateDataBase,
+                                          StripedStateDataBase])
+    def create_state_interface(self, request):
+        self.state_db = request.param()
+        self.state_interface = StateInterface(self.state_db)
+        for key in ['first', 'second', 'third']:
+            self.state_interface.create_state(ISS, key)
+            self.state_interface.store_sub2state('sub', key)
+            self.state_interface.store_nonce2state(key + '_nonce', key)
+
+    def test_get_states(self):
+        assert self.state_interface.get_states_by_sub('sub') == [
+            'first', 'second', 'third']
+        assert self.state_interface.get_state_by_sub('sub') == 'third'
+        assert self.state_interface.get_states_by_nonce('second_nonce') == [
+            'second']
+        assert self.state_interface.get_states_by_sid('unknown') == []
+        with pytest.raises(KeyError):
+            self.state_interface.get_state_by_sid('unknown')
+
+    def test_store_again(self):
+        self.state_interface.store_sub2state('sub', 'first')
+        assert self.state_interface.get_states_by_sub('sub') == [
+            'second', 'third', 'first']
+        assert self.state_interface.get_state_by_sub('sub') == 'first'
+
+    def test_remove_state(self):
+        self.state_interface.remove_state('third')
+        assert self.state_interface.get_states_by_sub('sub') == [
+            'first', 'second']
+        assert self.state_interface.get_state_by_sub('sub') == 'second'
+        assert self.state_interface.get_states_by_nonce('third_nonce') == []
+
+        self.state_interface.remove_state('first')
+        self.state_interface.remove_state('second')
+        assert self.state_interface.get_states_by_sub('sub') == []
+        with pytest.raises(KeyError):
+            self.state_interface.get_state_by_sub('sub')
+
+
+class TestStateCache(object):
+    @pytest.fixture(autouse=True)
+    def create_state_interface(self):
+        self.state_db = CountingStateDataBase()
+        self.state_interface = StateInterface(self.state_db)
+        run_flow(self.state_interface, 'abcde')
+        self.state_db.calls = []
+
+    def _read(self):
+        return self.state_interface.multiple_extend_request_args(
+            {}, 'abcde', ['access_token'], ['token_response',
+                                            'refresh_token_response'])
+
+    def test_decoded_once(self):
+        with self.state_interface.state_cache():
+            self._read()
+            self._read()
+            self.state_interface.get_iss('abcde')
+        assert self.state_db.calls == ['get']
+
+        self._read()
+        assert self.state_db.calls == ['get', 'get']
+
+    def test_store_item(self):
+        with self.state_interface.state_cache():
+            assert self._read() == {'access_token': 'token'}
+            self.state_interface.store_item(
+                AccessTokenResponse(access_token='token2',
+                                    token_type='Bearer'),
+                'refresh_token_response', 'abcde')
+            assert self._read() == {'access_token': 'token2'}
+
+    def test_nested(self):
+        with self.state_interface.state_cache():
+            with self.state_interface.state_cache():
+                self._read()
+            self._read()
+        assert self.state_db.calls == ['get']
+
+    def test_remove_state(self):
+        with self.state_interface.state_cache():
+            self._read()
+            self.state_interface.remove_state('abcde')
+            with pytest.raises(KeyError):
+                self.state_interface.get_state('abcde')
+
+
+class TestStripedStateDataBase(object):
+    @pytest.fixture(autouse=True)
+    def create_state_interface(self):
+        self.state_db = StripedStateDataBase(stripes=4)
+        self.state_interface = StateInterface(self.state_db)
+
+    def test_update(self):
+        assert self.state_db.update('key', lambda v: (v or '') + 'a') == 'a'
+        assert self.state_db.update('key', lambda v: v + 'b') == 'ab'
+        assert self.state_db.update('key', lambda v: None) is None
+        assert self.state_db.get('key') is None
+
+    def test_no_lost_updates(self):
+        self.state_interface.create_state(ISS, 'abcde')
+
+        def _worker(n):
+            for i in range(50):
+                self.state_interface.store_item(
+                    AuthorizationResponse(code=str(i)),
+                    'item_{}_{}'.format(n, i), 'abcde')
+            self.state_interface.store_sub2state('sub', 'state{}'.format(n))
+
+        _interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            _threads = [threading.Thread(target=_worker, args=(n,))
+                        for n in range(8)]
+            for _thread in _threads:
+                _thread.start()
+            for _thread in _threads:
+                _thread.join()
+        finally:
+            sys.setswitchinterval(_interval)
+
+        assert len(self.state_interface.get_state('abcde')) == 401
+        assert len(self.state_interface.get_states_by_sub('sub')) == 8
+
+
+class TestStateSerializer(object):
+    @pytest.fixture(autouse=True)
+    def create_state_interface(self):
+        self.state_db = InMemoryStateDataBase()
+        self.state_interface = StateInterface(
+            self.state_db, serializer=BinaryStateSerializer())
+
+    def test_binary(self):
+        run_flow(self.state_interface, 'abcde')
+        assert isinstance(self.state_db.get('abcde'), bytes)
+        _json_interface = StateInterface(InMemoryStateDataBase())
+        run_flow(_json_interface, 'abcde')
+        assert self.state_interface.get_state(
+            'abcde') == _json_interface.get_state('abcde')
+        assert len(self.state_db.get('abcde')) < len(
+            _json_interface.state_db.get('abcde'))
+
+    def test_unknown_field(self):
+        self.state_interface.create_state(ISS, 'abcde')
+        self.state_interface.store_item(
+            AccessTokenResponse(access_token='token', token_type='Bearer'),
+            'client_credentials_response', 'abcde')
+        _item = self.state_interface.get_item(
+            AccessTokenResponse, 'client_credentials_response', 'abcde')
+        assert _item['access_token'] == 'token'
+
+    def test_read_json_records(self):
+        _json_interface = StateInterface(self.state_db,
+                                         serializer=JSONStateSerializer())
+        run_flow(_json_interface, 'abcde')
+        assert isinstance(self.state_db.get('abcde'), str)
+        _state = self.state_interface.get_state('abcde')
+        self.state_db.set('abcde', self.state_db.get('abcde').encode())
+        assert self.state_interface.get_state('abcde') == _state
+
+        self.state_interface.store_item(
+            AccessTokenResponse(access_token='token2', token_type='Bearer'),
+            'refresh_token_response', 'abcde')
+        assert isinstance(self.state_db.get('abcde'), bytes)
+        assert self.state_interface.get_iss('abcde') == ISS
+
+    def test_serializer_of_database(self):
+        self.state_db.serializer = BinaryStateSerializer()
+        _interface = StateInterface(self.state_db)
+        run_flow(_interface, 'abcde')
+        assert isinstance(self.state_db.get('abcde'), bytes)
+
+    def test_object_database_backend(self):
+        self.state_db.serializer = BinaryStateSerializer()
+        _object_db = ObjectStateDataBase(backend=self.state_db)
+        run_flow(StateInterface(_object_db), 'abcde')
+        _object_db.flush()
+        assert isinstance(self.state_db.get('abcde'), bytes)
+
+        _interface = StateInterface(ObjectStateDataBase(backend=self.state_db))
+        assert _interface.get_iss('abcde') == ISS
+
+
+class TestObjectStateDataBase(object):
+    @pytest.fixture(autouse=True)
+    def create_state_interface(self):
+        self.backend = InMemoryStateDataBase()
+        self.state_db = ObjectStateDataBase(backend=self.backend)
+        self.state_interface = StateInterface(self.state_db)
+
+    def test_keeps_objects(self):
+        run_flow(self.state_interface, 'abcde')
+        assert isinstance(self.state_db.get('abcde'), State)
+        _state = self.state_interface.get_state('abcde')
+        assert _state is self.state_db.get('abcde')
+        assert set(_state.keys()) == {'iss', 'auth_request', 'auth_response',
+                                      'token_response'}
+
+    def test_same_result_as_json_database(self):
+        run_flow(self.state_interface, 'abcde')
+        _json_interface = StateInterface(InMemoryStateDataBase())
+        run_flow(_json_interface, 'abcde')
+        for item_cls, item_type in [
+                (AuthorizationRequest, 'auth_request'),
+                (AuthorizationResponse, 'auth_response'),
+                (AccessTokenResponse, 'token_response')]:
+            assert self.state_interface.get_item(
+                item_cls, item_type, 'abcde') == _json_interface.get_item(
+                    item_cls, item_type, 'abcde')
+
+    def test_accepts_json_documents(self):
+        self.state_db.set('abcde', State(iss=ISS).to_json())
+        assert self.state_interface.get_iss('abcde') == ISS
+
+    def test_flush(self):
+        run_flow(self.state_interface, 'abcde')
+        assert self.backend.get('abcde') is None
+
+        self.state_db.flush()
+        _json = self.backend.get('abcde')
+        assert isinstance(_json, str)
+        assert State().from_json(_json) == self.state_interface.get_state(
+            'abcde')
+        assert self.backend.get('__nonce__') == 'abcde'
+
+    def test_read_through(self):
+        _interface = StateInterface(self.backend)
+        run_flow(_interface, 'abcde')
+
+        _item = self.state_interface.get_item(AccessTokenResponse,
+                                              'token_response', 'abcde')
+        assert _item['access_token'] == 'token'
+
+    def test_flush_deleted(self):
+        run_flow(self.state_interface, 'abcde')
+        self.state_db.flush()
+        self.state_interface.remove_state('abcde')
+        assert self.state_db.get('abcde') is None
+        self.state_db.flush()
+        assert self.backend.get('abcde') is None
+        assert self.backend.get('__nonce__') is None
+
+
+class TestFieldStateDataBase(object):
+    @pytest.fixture(autouse=True)
+    def create_state_interface(self):
+        self.state_db = FieldStateDataBase()
+        self.state_interface = StateInterface(self.state_db)
+
+    def test_fields(self):
+        run_flow(self.state_interface, 'abcde')
+        _fields = self.state_db.get_fields('abcde')
+        assert set(_fields.keys()) == {'iss', 'auth_request', 'auth_response',
+                                       'token_response'}
+        assert _fields['iss'] == ISS
+        assert AccessTokenResponse().from_json(
+            _fields['token_response'])['access_token'] == 'token'
+
+    def test_only_one_field_written(self):
+        run_flow(self.state_interface, 'abcde')
+        _written = []
+        _set_fields = self.state_db.set_fields
+
+        def set_fields(key, fields):
+            _written.append(fields)
+            _set_fields(key, fields)
+
+        self.state_db.set_fields = set_fields
+        self.state_interface.store_item(
+            AccessTokenResponse(access_token='token2', token_type='Bearer'),
+            'refresh_token_response', 'abcde')
+        assert len(_written) == 1
+        assert list(_written[0].keys()) == ['refresh_token_response']
+
+    def test_same_state_as_json_database(self):
+        run_flow(self.state_interface, 'abcde')
+        _json_interface = StateInterface(InMemoryStateDataBase())
+        run_flow(_json_interface, 'abcde')
+        assert self.state_interface.get_state(
+            'abcde') == _json_interface.get_state('abcde')
+        assert State().from_json(self.state_db.get(
+            'abcde')) == _json_interface.get_state('abcde')
+
+    def test_json_document_converted(self):
+        _json_interface = StateInterface(InMemoryStateDataBase())
+        run_flow(_json_interface, 'abcde')
+        self.state_db.set('abcde', _json_interface.state_db.get('abcde'))
+
+        self.state_interface.store_item(
+            AccessTokenResponse(access_token='token2', token_type='Bearer'),
+            'refresh_token_response', 'abcde')
+        assert self.state_interface.get_iss('abcde') == ISS
+        _args = self.state_interface.multiple_extend_request_args(
+            {}, 'abcde', ['access_token', 'code'],
+            ['auth_response', 'token_response', 'refresh_token_response'])
+        assert _args == {'access_token': 'token2', 'code': 'access_code'}
+
+    def test_create_state_resets(self):
+        run_flow(self.state_interface, 'abcde')
+        self.state_interface.create_state(ISS, 'abcde')
+        assert list(self.state_db.get_fields('abcde').keys()) == ['iss']
@@ -0,0 +1,219 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oauth2 import AuthorizationResponse
+
+from oidcservice.sqlite_state_db import SELECT_VALUE
+from oidcservice.sqlite_state_db import SQLiteStateDataBase
+from oidcservice.state_interface import StateInterface
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / 'state.db')
+
+
+def test_set_get_delete(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    assert _db.get('foo') is None
+    _db.set('foo', 'bar')
+    assert _db.get('foo') == 'bar'
+    _db.set('foo', 'baz')
+    assert _db.get('foo') == 'baz'
+    _db.delete('foo')
+    assert _db.get('foo') is None
+    # deleting something that isn't there is not an error
+    _db.delete('foo')
+
+
+def test_wal_mode(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    _conn, _ = _db._connection()
+    assert _conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+
+
+def test_persistent(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    _interface = StateInterface(_db)
+    _interface.create_state('https://example.org/op', 'abcde')
+    _interface.store_item(AuthorizationResponse(code='code', state='abcde'),
+                          'auth_response', 'abcde')
+    _db.close()
+
+    _interface = StateInterface(SQLiteStateDataBase(db_file))
+    assert _interface.get_iss('abcde') == 'https://example.org/op'
+    _item = _interface.get_item(AuthorizationResponse, 'auth_response',
+                                'abcde')
+    assert _item['code'] == 'code'
+
+
+def test_connection_per_thread(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    _conns = {}
+
+    def _worker(n):
+        _conns[n] = _db._connection()[0]
+        _db.set('key{}'.format(n), str(n))
+
+    _threads = [threading.Thread(target=_worker, args=(n,)) for n in range(4)]
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+
+    assert len(set(id(c) for c in _conns.values())) == 4
+    assert [_db.get('key{}'.format(n)) for n in range(4)] == ['0', '1', '2',
+                                                              '3']
+
+
+def test_dead_threads(db_file):
+    _db = SQLiteStateDataBase(db_file, commit_interval=3600)
+    _conns = []
+
+    def _worker(n):
+        _conns.append(_db._connection()[0])
+        _db.set('key{}'.format(n), str(n))
+
+    for n in range(20):
+        _thread = threading.Thread(target=_worker, args=(n,))
+        _thread.start()
+        _thread.join()
+
+    # Only the connection of this thread is left, the others were committed
+    # and closed when their threads ended
+    assert len(_db._connections) == 1
+    with pytest.raises(sqlite3.ProgrammingError):
+        _conns[0].execute(SELECT_VALUE, ('key0',))
+    _reader = SQLiteStateDataBase(db_file)
+    assert [_reader.get('key{}'.format(n)) for n in range(20)] == [
+        str(n) for n in range(20)]
+
+
+def test_close(db_file):
+    _db = SQLiteStateDataBase(db_file, commit_interval=3600)
+    _thread = threading.Thread(target=_db.set, args=('foo', 'bar'))
+    _thread.start()
+    _thread.join()
+    _db.set('bar', 'baz')
+    _committer = _db._committer[0]
+    _db.close()
+    assert not _committer.is_alive()
+    assert _db._connections == []
+
+    _reader = SQLiteStateDataBase(db_file)
+    assert _reader.get('foo') == 'bar'
+    assert _reader.get('bar') == 'baz'
+
+
+def test_group_commit(db_file):
+    _writer = SQLiteStateDataBase(db_file, commit_interval=3600)
+    _reader = SQLiteStateDataBase(db_file)
+
+    _writer.set('foo', 'bar')
+    # The writer sees its own writes, others do not until committed
+    assert _writer.get('foo') == 'bar'
+    assert _reader.get('foo') is None
+
+    _writer.commit()
+    assert _reader.get('foo') == 'bar'
+
+    _writer.set('foo', 'baz')
+    _writer.commit_all()
+    assert _reader.get('foo') == 'baz'
+
+
+def test_background_commit(db_file):
+    _writer = SQLiteStateDataBase(db_file, commit_interval=0.01)
+    _reader = SQLiteStateDataBase(db_file)
+    _writer.set('foo', 'bar')
+
+    _event = threading.Event()
+    for _ in range(200):
+        if _reader.get('foo') == 'bar':
+            break
+        _event.wait(0.01)
+    assert _reader.get('foo') == 'bar'
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Needs os.fork')
+def test_fork(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    _interface = StateInterface(_db)
+    _interface.create_state('https://example.org/op', 'abcde')
+
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _interface.store_item(
+                AccessTokenResponse(access_token='token',
+                                    token_type='Bearer'),
+                'token_response', 'abcde')
+            _db.close()
+        finally:
+            os._exit(0)
+
+    os.waitpid(pid, 0)
+    _item = _interface.get_item(AccessTokenResponse, 'token_response',
+                                'abcde')
+    assert _item['access_token'] == 'token'
+
+
+def test_bulk_operations(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    _items = {'key{}'.format(n): str(n) for n in range(1200)}
+    _db.set_many(_items)
+    _keys = list(_items.keys()) + ['unknown']
+    assert _db.get_many(_keys) == list(_items.values()) + [None]
+
+    _db.delete_many(_keys[:600])
+    assert _db.get_many(_keys[599:601]) == [None, '600']
+
+
+def test_bulk_operations_group_commit(db_file):
+    _writer = SQLiteStateDataBase(db_file, commit_interval=3600)
+    _reader = SQLiteStateDataBase(db_file)
+    _writer.set_many({'foo': 'bar', 'bar': 'foo'})
+    assert _reader.get_many(['foo', 'bar']) == [None, None]
+    _writer.commit()
+    assert _reader.get_many(['foo', 'bar']) == ['bar', 'foo']
+
+
+def test_secondary_index(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    _interface = StateInterface(_db)
+    for key in ['first', 'second', 'third']:
+        _interface.create_state('https://example.org/op', key)
+        _interface.store_sub2state('sub', key)
+    _interface.store_sub2state('sub', 'first')
+    assert _interface.get_states_by_sub('sub') == ['second', 'third', 'first']
+
+    _interface.remove_state('first')
+    assert SQLiteStateDataBase(db_file).index_get('subject id', 'sub') == [
+        'second', 'third']
+    assert _interface.get_state_by_sub('sub') == 'third'
+    _db.delete_many(['second', 'third'])
+    assert _interface.get_states_by_sub('sub') == []
+
+
+def test_update(db_file):
+    _db = SQLiteStateDataBase(db_file)
+    assert _db.update('counter', lambda v: str(int(v or 0) + 1)) == '1'
+
+    def _worker():
+        _db = SQLiteStateDataBase(db_file)
+        for _ in range(50):
+            _db.update('counter', lambda v: str(int(v) + 1))
+        _db.close()
+
+    _threads = [threading.Thread(target=_worker) for _ in range(4)]
+    for _thread in _threads:
+        _thread.start()
+    for _thread in _threads:
+        _thread.join()
+    assert _db.get('counter') == '201'
+
+    assert _db.update('counter', lambda v: None) is None
+    assert _db.get('counter') is None
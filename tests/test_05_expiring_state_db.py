@@ -0,0 +1,185 @@
+import pytest
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oauth2 import AuthorizationResponse
+
+from oidcservice import expiring_state_db
+from oidcservice.expiring_state_db import ExpiringStateDataBase
+from oidcservice.state_interface import StateInterface
+
+ISS = 'https://example.org/op'
+
+
+class Clock(object):
+    def __init__(self, now=1000000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    _clock = Clock()
+    monkeypatch.setattr(expiring_state_db, 'time_sans_frac', _clock)
+    return _clock
+
+
+def test_lazy_expiration(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _db.set('foo', 'bar')
+    clock.now += 9
+    assert _db.get('foo') == 'bar'
+    clock.now += 1
+    assert _db.get('foo') is None
+    assert len(_db) == 0
+
+
+def test_set_extends_lifetime(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _db.set('foo', 'bar')
+    clock.now += 8
+    _db.set('foo', 'baz')
+    clock.now += 8
+    assert _db.get('foo') == 'baz'
+
+
+def test_expire_at(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _db.set('foo', 'bar')
+    _db.expire_at('foo', clock.now + 100)
+    # Never shortens
+    _db.expire_at('foo', clock.now + 5)
+    clock.now += 109
+    assert _db.get('foo') == 'bar'
+    clock.now += 1
+    assert _db.get('foo') is None
+    # Does not create keys
+    _db.expire_at('xyz', clock.now + 100)
+    assert _db.get('xyz') is None
+
+
+def test_sweep(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    for n in range(10):
+        _db.set('key{}'.format(n), 'value')
+    clock.now += 5
+    _db.set('late', 'value')
+    clock.now += 5
+    assert _db.sweep() == 10
+    assert len(_db) == 1
+
+
+def test_delete_and_set_again(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    for _ in range(10):
+        _db.set('foo', 'bar')
+        _db.delete('foo')
+    _db.set('foo', 'bar')
+    assert len(_db._sweep_queue) == 1
+
+
+@pytest.mark.parametrize('sweep_batch', [2, 4])
+def test_memory_bound(clock, sweep_batch):
+    # 100 new keys per second that are never read or deleted.
+    _db = ExpiringStateDataBase(lifetime=10, sweep_batch=sweep_batch)
+    _rate = 100
+    _max = 0
+    for tick in range(500):
+        clock.now += 1
+        for n in range(_rate):
+            _db.set('{}:{}'.format(tick, n), 'value')
+        _max = max(_max, len(_db))
+
+    # keys that are alive
+    _alive = _db.lifetime * _rate
+    assert _max <= _alive * sweep_batch / (sweep_batch - 1) + _rate
+    assert len(_db._sweep_queue) == len(_db)
+
+
+def test_background_sweeper(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _db.set('foo', 'bar')
+    clock.now += 10
+    _db.start_sweeper(interval=0.01)
+    try:
+        for _ in range(200):
+            if not len(_db):
+                break
+            _db._sweeper.wait(0.01)
+        assert len(_db) == 0
+    finally:
+        _db.stop_sweeper()
+
+
+def test_state_lifetime_from_expires_at(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _interface = StateInterface(_db)
+    _interface.create_state(ISS, 'abcde')
+    _interface.store_nonce2state('nonce', 'abcde')
+    _interface.store_item(AuthorizationResponse(code='code', state='abcde'),
+                          'auth_response', 'abcde')
+    _interface.store_item(
+        AccessTokenResponse(access_token='token', token_type='Bearer',
+                            __expires_at=clock.now + 3600),
+        'token_response', 'abcde')
+
+    clock.now += 3600
+    assert _interface.get_iss('abcde') == ISS
+    assert _interface.get_state_by_nonce('nonce') == 'abcde'
+
+    clock.now += 10
+    with pytest.raises(KeyError):
+        _interface.get_state('abcde')
+    with pytest.raises(KeyError):
+        _interface.get_state_by_nonce('nonce')
+
+
+def test_abandoned_login(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _interface = StateInterface(_db)
+    _interface.create_state(ISS, 'abcde')
+    _interface.store_nonce2state('nonce', 'abcde')
+    clock.now += 10
+    _db.sweep()
+    assert len(_db) == 0
+
+
+def test_connected_keys_live_as_long_as_the_state(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _interface = StateInterface(_db)
+    _interface.create_state(ISS, 'abcde')
+    _interface.store_nonce2state('nonce', 'abcde')
+    _interface.store_sub2state('sub', 'abcde')
+    clock.now += 8
+    _interface.store_item(AuthorizationResponse(code='code', state='abcde'),
+                          'auth_response', 'abcde')
+
+    clock.now += 4
+    assert _interface.get_states_by_nonce('nonce') == ['abcde']
+    assert _interface.get_state_by_sub('sub') == 'abcde'
+
+    clock.now += 6
+    assert _interface.get_states_by_nonce('nonce') == []
+    _db.sweep()
+    assert len(_db) == 0
+
+
+def test_expired_states_left_out(clock):
+    _db = ExpiringStateDataBase(lifetime=10)
+    _interface = StateInterface(_db)
+    for _state in ['first', 'second']:
+        _interface.create_state(ISS, _state)
+    _interface.store_sub2state('sub', 'second')
+    _interface.store_sub2state('sub', 'first')
+    clock.now += 8
+    _interface.store_item(AuthorizationResponse(code='code', state='second'),
+                          'auth_response', 'second')
+
+    clock.now += 4
+    assert _interface.get_states_by_sub('sub') == ['second']
+    assert _interface.get_state_by_sub('sub') == 'second'
+
+    clock.now += 10
+    assert _interface.get_states_by_sub('sub') == []
+    with pytest.raises(KeyError):
+        _interface.get_state_by_sub('sub')
@@ -0,0 +1,271 @@
+import asyncio
+import threading
+
+import pytest
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oauth2 import AuthorizationRequest
+from oidcmsg.oauth2 import AuthorizationResponse
+
+from oidcservice.async_state import OverlayStateDataBase
+from oidcservice.exception import StateConflict
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import FieldStateDataBase
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import IndexedStateDataBase
+from oidcservice.state_interface import StateInterface
+from oidcservice.striped_state_db import StripedStateDataBase
+
+ISS = 'https://example.org/op'
+
+
+class AsyncStateDataBase(object):
+    """Only supports the asynchronous operations."""
+
+    def __init__(self):
+        self.db = {}
+        self.reads = 0
+
+    async def aget(self, key):
+        await asyncio.sleep(0)
+        self.reads += 1
+        return self.db.get(key)
+
+    async def aset(self, key, value):
+        await asyncio.sleep(0)
+        self.db[key] = value
+
+    async def adelete(self, key):
+        await asyncio.sleep(0)
+        self.db.pop(key, None)
+
+
+class AsyncBulkStateDataBase(AsyncStateDataBase):
+    async def aget_many(self, keys):
+        await asyncio.sleep(0)
+        self.reads += 1
+        return [self.db.get(key) for key in keys]
+
+
+async def arun_flow(state_interface, key):
+    await state_interface.acreate_state(ISS, key)
+    await state_interface.astore_item(
+        AuthorizationRequest(response_type='code', client_id='client_id',
+                             state=key, redirect_uri='https://rp/cb'),
+        'auth_request', key)
+    await state_interface.astore_x2state(key + '_nonce', key, 'nonce')
+    await state_interface.astore_x2state('sub', key, 'subject id')
+    await state_interface.astore_item(
+        AuthorizationResponse(code='access_code', state=key),
+        'auth_response', key)
+    await state_interface.astore_item(
+        AccessTokenResponse(access_token='token', token_type='Bearer'),
+        'token_response', key)
+
+
+@pytest.mark.parametrize('state_db', [AsyncStateDataBase,
+                                      AsyncBulkStateDataBase,
+                                      InMemoryStateDataBase,
+                                      FieldStateDataBase,
+                                      IndexedStateDataBase])
+def test_flow(state_db):
+    _interface = StateInterface(state_db())
+    asyncio.run(arun_flow(_interface, 'abcde'))
+
+    _args = asyncio.run(_interface.amultiple_extend_request_args(
+        {}, 'abcde', ['access_token', 'code', 'redirect_uri'],
+        ['auth_request', 'auth_response', 'token_response']))
+    assert _args == {'access_token': 'token', 'code': 'access_code',
+                     'redirect_uri': 'https://rp/cb'}
+    assert asyncio.run(_interface.aget_state_by_x('abcde_nonce',
+                                                  'nonce')) == 'abcde'
+
+    _state = asyncio.run(_interface.aget_state('abcde'))
+    assert set(_state.keys()) == {'iss', 'auth_request', 'auth_response',
+                                  'token_response'}
+
+    asyncio.run(_interface.aremove_state('abcde'))
+    with pytest.raises(KeyError):
+        asyncio.run(_interface.aget_state('abcde'))
+    with pytest.raises(KeyError):
+        asyncio.run(_interface.aget_state_by_x('abcde_nonce', 'nonce'))
+
+
+def test_same_state_as_sync():
+    _interface = StateInterface(AsyncStateDataBase())
+    asyncio.run(arun_flow(_interface, 'abcde'))
+    _sync_interface = StateInterface(InMemoryStateDataBase())
+    asyncio.run(arun_flow(_sync_interface, 'abcde'))
+    assert _interface.state_db.db == _sync_interface.state_db._db
+
+
+def test_concurrent_logins():
+    _interface = StateInterface(AsyncStateDataBase())
+
+    async def logins():
+        await asyncio.gather(*[arun_flow(_interface, 'key{}'.format(n))
+                               for n in range(100)])
+
+    asyncio.run(logins())
+    for n in range(100):
+        _item = asyncio.run(_interface.aget_item(
+            AccessTokenResponse, 'token_response', 'key{}'.format(n)))
+        assert _item['access_token'] == 'token'
+
+
+@pytest.mark.parametrize('state_db', [AsyncStateDataBase,
+                                      AsyncBulkStateDataBase,
+                                      InMemoryStateDataBase,
+                                      IndexedStateDataBase,
+                                      StripedStateDataBase])
+def test_concurrent_updates(state_db):
+    _interface = StateInterface(state_db())
+
+    async def updates():
+        await _interface.acreate_state(ISS, 'abcde')
+        await asyncio.gather(
+            _interface.astore_item(
+                AuthorizationResponse(code='access_code', state='abcde'),
+                'auth_response', 'abcde'),
+            _interface.astore_item(
+                AccessTokenResponse(access_token='token', token_type='Bearer'),
+                'token_response', 'abcde'))
+        await asyncio.gather(*[
+            _interface.astore_x2state('sub', 's{}'.format(n), 'subject id')
+            for n in range(5)])
+
+    def states():
+        return sorted(asyncio.run(_interface.arun(
+            _interface._x_reads('sub', 'subject id'),
+            _interface.get_states_by_sub, 'sub')))
+
+    asyncio.run(updates())
+    _state = asyncio.run(_interface.aget_state('abcde'))
+    assert set(_state.keys()) == {'iss', 'auth_response', 'token_response'}
+    assert states() == ['s{}'.format(n) for n in range(5)]
+
+    asyncio.run(_interface.aremove_state('s2'))
+    assert states() == ['s{}'.format(n) for n in (0, 1, 3, 4)]
+
+
+def test_one_read():
+    _db = AsyncBulkStateDataBase()
+    _interface = StateInterface(_db)
+    asyncio.run(arun_flow(_interface, 'abcde'))
+    _db.reads = 0
+    asyncio.run(_interface.astore_item(
+        AccessTokenResponse(access_token='token2', token_type='Bearer'),
+        'refresh_token_response', 'abcde'))
+    assert _db.reads == 1
+
+
+def test_unexpected_read():
+    _db = AsyncBulkStateDataBase()
+    _interface = StateInterface(_db)
+    asyncio.run(arun_flow(_interface, 'abcde'))
+    _runs = []
+
+    def get_two(key, other):
+        _runs.append(key)
+        _interface.store_x2state('nonce2', key, 'nonce')
+        return _interface.get_iss(key), _interface.get_iss(other)
+
+    asyncio.run(_interface.acreate_state(ISS, 'fghij'))
+    with pytest.raises(StateConflict):
+        asyncio.run(_interface.arun(_interface._state_reads('abcde'), get_two,
+                                    'abcde', 'fghij'))
+    # The method is not rerun and nothing is written
+    assert _runs == ['abcde']
+    assert '__nonce2__' not in _db.db
+
+
+def test_unexpected_read_nothing_there():
+    _db = AsyncBulkStateDataBase()
+    _interface = StateInterface(_db)
+    asyncio.run(arun_flow(_interface, 'abcde'))
+
+    def store(key):
+        _interface.store_x2state('nonce2', key, 'nonce')
+        return _interface.get_iss(key)
+
+    assert asyncio.run(_interface.arun(_interface._state_reads('abcde'),
+                                       store, 'abcde')) == ISS
+    assert asyncio.run(_interface.aget_state_by_x('nonce2',
+                                                  'nonce')) == 'abcde'
+
+
+def test_overlay_not_shared():
+    _db = InMemoryStateDataBase()
+    _interface = StateInterface(_db)
+    _seen = []
+
+    def run():
+        _thread = threading.Thread(
+            target=lambda: _seen.append(_interface.state_db))
+        _thread.start()
+        _thread.join()
+        _seen.append(_interface.state_db)
+
+    asyncio.run(_interface.arun([], run))
+    assert _seen[0] is _db
+    assert isinstance(_seen[1], OverlayStateDataBase)
+    assert _interface.state_db is _db
+
+
+class UpdateStateDataBase(InMemoryStateDataBase):
+    def __init__(self):
+        InMemoryStateDataBase.__init__(self)
+        self.updates = []
+
+    def update(self, key, func):
+        self.updates.append(key)
+        self.set(key, func(self.get(key)))
+
+
+def test_update_written_back():
+    _db = UpdateStateDataBase()
+    _interface = StateInterface(_db)
+    asyncio.run(arun_flow(_interface, 'abcde'))
+    assert _db.updates == ['abcde'] * 3
+    _item = _interface.get_item(AccessTokenResponse, 'token_response',
+                                'abcde')
+    assert _item['access_token'] == 'token'
+
+
+class TestService(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self):
+        client_config = {
+            'client_id': 'client_id',
+            'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'behaviour': {'response_types': ['code']}
+        }
+        service_context = ServiceContext(config=client_config)
+        self.state_db = AsyncStateDataBase()
+        self.service = service_factory('Authorization', ['oauth2'],
+                                       state_db=self.state_db,
+                                       service_context=service_context)
+
+    def test_construct(self):
+        _req = asyncio.run(self.service.aconstruct(
+            request_args={'foo': 'bar'}, state='state'))
+        assert isinstance(_req, AuthorizationRequest)
+        assert set(_req.keys()) == {'client_id', 'redirect_uri', 'foo',
+                                    'state'}
+        assert self.state_db.db['state']
+
+    def test_update_service_context(self):
+        self.service.endpoint = 'https://example.com/authorize'
+        _info = asyncio.run(self.service.aget_request_parameters(
+            request_args={'response_type': 'code'}, state='state'))
+        assert set(_info.keys()) == {'url', 'method'}
+
+        _resp = asyncio.run(self.service.aparse_response(
+            AuthorizationResponse(code='access_code',
+                                  state='state').to_urlencoded(),
+            sformat='urlencoded', state='state'))
+        asyncio.run(self.service.aupdate_service_context(_resp, key='state'))
+        _item = asyncio.run(self.service.aget_item(
+            AuthorizationResponse, 'auth_response', 'state'))
+        assert _item['code'] == 'access_code'
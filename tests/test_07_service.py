@@ -1,14 +1,30 @@
+import copy
+import tracemalloc
+
 import pytest
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import KeyJar
+from cryptojwt.key_jar import build_keyjar
 
+from oidcservice import service
 from oidcservice.service_context import ServiceContext
+from oidcservice.service import DeferredVerification
+from oidcservice.service import VERIFY_DEFERRED
+from oidcservice.service import VERIFY_SKIP
 from oidcservice.service import Service
+from oidcservice.service_factory import service_factory
 from oidcservice.state_interface import InMemoryStateDataBase
 from oidcservice.state_interface import State
 
+from oidcmsg.exception import MissingRequiredAttribute
 from oidcmsg.oauth2 import Message
 from oidcmsg.oauth2 import SINGLE_OPTIONAL_INT
 from oidcmsg.oauth2 import SINGLE_OPTIONAL_STRING
 from oidcmsg.oauth2 import SINGLE_REQUIRED_STRING
+from oidcmsg.oidc import AccessTokenResponse
+from oidcmsg.oidc import verified_claim_name
+
+ISS = 'https://www.example.org/as'
 
 
 class DummyMessage(Message):
@@ -82,3 +98,329 @@ class TestRequest(object):
         _req = self.service.construct(request_args=req_args)
         assert isinstance(_req, Message)
         assert list(_req.keys()) == ['foo']
+
+
+class TestGatherRequestArgs(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self):
+        service_context = ServiceContext(client_id='client_id',
+                                         issuer='https://www.example.org/as')
+        self.service = DummyService(service_context,
+                                    state_db=InMemoryStateDataBase(),
+                                    conf={'request_args': {'opt_str': 'conf'}})
+        self.service.default_request_args = {'opt_int': 1, 'opt_str': 'dflt'}
+
+    def test_priority(self):
+        self.service.service_context.register_args['req_str'] = 'register'
+        assert self.service.gather_request_args() == {
+            'req_str': 'register', 'opt_str': 'conf', 'opt_int': 1}
+        assert self.service.gather_request_args(opt_int=2) == {
+            'req_str': 'register', 'opt_str': 'conf', 'opt_int': 2}
+
+    def test_plan_reused(self):
+        _plan = self.service._request_args_plan()
+        self.service.gather_request_args()
+        assert self.service._request_args_plan() is _plan
+
+    def test_new_value(self):
+        self.service.gather_request_args()
+        self.service.default_request_args['opt_int'] = 3
+        assert self.service.gather_request_args()['opt_int'] == 3
+
+    def test_new_context_attribute(self):
+        assert 'req_str' not in self.service.gather_request_args()
+        self.service.service_context.req_str = 'context'
+        assert self.service.gather_request_args()['req_str'] == 'context'
+        del self.service.service_context.req_str
+        assert 'req_str' not in self.service.gather_request_args()
+
+    def test_new_key(self):
+        self.service.gather_request_args()
+        self.service.service_context.register_args['req_str'] = 'register'
+        del self.service.default_request_args['opt_int']
+        assert self.service.gather_request_args() == {
+            'req_str': 'register', 'opt_str': 'conf'}
+
+    def test_replaced_conf(self):
+        self.service.gather_request_args()
+        self.service.conf['request_args'] = {'opt_int': 5}
+        assert self.service.gather_request_args() == {
+            'opt_str': 'dflt', 'opt_int': 5}
+        del self.service.conf['request_args']
+        assert self.service.gather_request_args() == {
+            'opt_str': 'dflt', 'opt_int': 1}
+
+    def test_new_service_context(self):
+        self.service.gather_request_args()
+        _context = ServiceContext()
+        _context.register_args['req_str'] = 'register'
+        self.service.service_context = _context
+        assert self.service.gather_request_args()['req_str'] == 'register'
+
+
+class TestJWTUnpacker(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self):
+        service_context = ServiceContext(
+            client_id='client_id', client_secret='a longesh password',
+            issuer='https://www.example.org/as')
+        self.service = DummyService(service_context,
+                                    state_db=InMemoryStateDataBase())
+        self.service.service_name = 'userinfo'
+
+    def test_unpack(self):
+        _jwt = JWT(key_jar=self.service.service_context.keyjar,
+                   sign_alg='HS256')
+        _token = _jwt.pack(payload={'sub': 'diana'})
+        assert self.service._do_jwt(_token)['sub'] == 'diana'
+        assert self.service._do_jwt(_token)['sub'] == 'diana'
+
+    def test_reused(self):
+        _unpacker = self.service._jwt_unpacker()
+        assert self.service._jwt_unpacker() is _unpacker
+        self.service.service_context.keyjar.add_symmetric('', 'another longesh password')
+        assert self.service._jwt_unpacker() is _unpacker
+
+    def test_behaviour(self):
+        _context = self.service.service_context
+        _context.provider_info['userinfo_signing_alg_values_supported'] = [
+            'RS256', 'ES256']
+        _unpacker = self.service._jwt_unpacker()
+        assert _unpacker.allowed_sign_algs == ['RS256', 'ES256']
+        _context.behaviour['userinfo_signed_response_alg'] = 'ES256'
+        _unpacker = self.service._jwt_unpacker()
+        assert _unpacker.allowed_sign_algs == 'ES256'
+        _context.behaviour['userinfo_encrypted_response_alg'] = 'RSA1_5'
+        assert self.service._jwt_unpacker().allowed_enc_algs == 'RSA1_5'
+
+    def test_provider_info(self):
+        _unpacker = self.service._jwt_unpacker()
+        assert _unpacker.allowed_sign_algs is None
+        self.service.service_context.provider_info = {
+            'userinfo_signing_alg_values_supported': ['RS256']}
+        assert self.service._jwt_unpacker().allowed_sign_algs == ['RS256']
+
+    def test_keyjar(self):
+        self.service._jwt_unpacker()
+        _keyjar = KeyJar()
+        self.service.service_context.keyjar = _keyjar
+        assert self.service._jwt_unpacker().key_jar is _keyjar
+
+    def test_client_id(self):
+        self.service._jwt_unpacker()
+        self.service.service_context.client_id = 'other'
+        assert self.service._jwt_unpacker().iss == 'other'
+
+
+def set_opt_str(request_args, **kwargs):
+    request_args['opt_str'] = kwargs.get('opt_str', 'pre')
+    return request_args, {'opt_int': 2}
+
+
+def set_opt_int(request, **kwargs):
+    if 'opt_int' in kwargs:
+        request['opt_int'] = kwargs['opt_int']
+    return request
+
+
+class TestHookChain(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self):
+        service_context = ServiceContext(client_id='client_id',
+                                         issuer='https://www.example.org/as')
+        self.service = DummyService(service_context,
+                                    state_db=InMemoryStateDataBase())
+        self.service.pre_construct.append(set_opt_str)
+        self.service.post_construct.append(set_opt_int)
+
+    def test_construct(self):
+        _req = self.service.construct(request_args={'req_str': 'x'})
+        assert _req.to_dict() == {'req_str': 'x', 'opt_str': 'pre',
+                                  'opt_int': 2}
+
+    def test_conf_args(self):
+        self.service.conf = {'pre_construct': {'opt_str': 'conf'}}
+        _req = self.service.construct(request_args={'req_str': 'x'})
+        assert _req['opt_str'] == 'conf'
+        _req = self.service.construct(request_args={'req_str': 'x'},
+                                      opt_str='kwarg')
+        assert _req['opt_str'] == 'kwarg'
+        assert self.service.conf == {'pre_construct': {'opt_str': 'conf'}}
+
+    def test_post_args(self):
+        def more_post_args(request_args, **kwargs):
+            return request_args, {'opt_int': 3}
+
+        self.service.construct(request_args={'req_str': 'x'})
+        self.service.pre_construct.append(more_post_args)
+        _req = self.service.construct(request_args={'req_str': 'x'})
+        assert _req['opt_int'] == 3
+
+    def test_list_changed(self):
+        self.service.construct(request_args={'req_str': 'x'})
+        self.service.pre_construct.remove(set_opt_str)
+        _req = self.service.construct(request_args={'req_str': 'x',
+                                                    'opt_int': 1})
+        assert 'opt_str' not in _req
+        self.service.post_construct = []
+        _req = self.service.construct(request_args={'req_str': 'x',
+                                                    'opt_int': 1})
+        assert _req['opt_int'] == 1
+
+    @pytest.mark.parametrize('conf', [{}, {'pre_construct': {'foo': 'bar'}}])
+    def test_allocations(self, conf):
+        # What the hook dispatch has allocated while the last hook runs
+        self.service.conf = conf
+        _blocks = []
+
+        def probe(request_args, **kwargs):
+            if not tracemalloc.is_tracing():
+                return request_args, {}
+            _snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(True, service.__file__)])
+            _blocks.append(sum(s.count for s in _snapshot.statistics(
+                'filename')))
+            return request_args, {}
+
+        self.service.pre_construct = [probe]
+        self.service.do_pre_construct({})
+        tracemalloc.start()
+        try:
+            self.service.do_pre_construct({})
+        finally:
+            tracemalloc.stop()
+        # The loop and the keyword arguments of the hook
+        assert _blocks[-1] <= 2
+
+
+class VerifiedMessage(DummyMessage):
+    verified = 0
+
+    def verify(self, **kwargs):
+        VerifiedMessage.verified += 1
+        Message.verify(self, **kwargs)
+        self['opt_int'] = kwargs['opt_int']
+        return True
+
+
+class VerifiedService(DummyService):
+    response_cls = VerifiedMessage
+
+    def gather_verify_arguments(self):
+        return {'opt_int': 7}
+
+
+class TestVerification(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self):
+        service_context = ServiceContext(client_id='client_id',
+                                         issuer='https://www.example.org/as')
+        self.service = VerifiedService(service_context,
+                                       state_db=InMemoryStateDataBase())
+        VerifiedMessage.verified = 0
+
+    def test_full(self):
+        _resp = self.service.parse_response('{"req_str": "foo"}')
+        assert VerifiedMessage.verified == 1
+        assert _resp['opt_int'] == 7
+        with pytest.raises(MissingRequiredAttribute):
+            self.service.parse_response('{"opt_str": "foo"}')
+
+    def test_deferred(self):
+        self.service.verification = VERIFY_DEFERRED
+        _resp = self.service.parse_response('{"req_str": "foo"}')
+        assert VerifiedMessage.verified == 0
+        assert isinstance(_resp, DeferredVerification)
+        assert _resp['opt_int'] == 7
+        assert VerifiedMessage.verified == 1
+        assert type(_resp.message()) is VerifiedMessage
+        assert _resp.to_dict() == {'req_str': 'foo', 'opt_int': 7}
+        assert VerifiedMessage.verified == 1
+
+    def test_deferred_fails(self):
+        self.service.verification = VERIFY_DEFERRED
+        _resp = self.service.parse_response('{"opt_str": "foo"}')
+        for _ in range(2):
+            with pytest.raises(MissingRequiredAttribute):
+                _resp.get('opt_str')
+        assert VerifiedMessage.verified == 2
+
+    def test_deferred_conf(self):
+        _service = VerifiedService(self.service.service_context,
+                                   state_db=InMemoryStateDataBase(),
+                                   conf={'verification': VERIFY_DEFERRED})
+        _resp = _service.parse_response('{"req_str": "foo"}')
+        assert VerifiedMessage.verified == 0
+        assert 'opt_int' in _resp
+
+    def test_deferred_error_response(self):
+        self.service.verification = VERIFY_DEFERRED
+        _resp = self.service.parse_response('{"error": "invalid_request"}')
+        assert _resp['error'] == 'invalid_request'
+        assert VerifiedMessage.verified == 0
+
+    def test_deferred_post_parse(self):
+        class PostParseService(VerifiedService):
+            def post_parse_response(self, response, **kwargs):
+                response['opt_str'] = 'bar'
+                return response
+
+        _service = PostParseService(self.service.service_context,
+                                    state_db=InMemoryStateDataBase(),
+                                    conf={'verification': VERIFY_DEFERRED})
+        _resp = _service.parse_response('{"req_str": "foo"}')
+        # Post parsing needs a verified response
+        assert VerifiedMessage.verified == 1
+        assert type(_resp) is VerifiedMessage
+
+    def test_skip(self):
+        _resp = self.service.parse_response('{"opt_str": "foo"}',
+                                            verification=VERIFY_SKIP)
+        assert _resp.to_dict() == {'opt_str': 'foo'}
+        assert VerifiedMessage.verified == 0
+
+
+class TestDeferredIdToken(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self):
+        _op_keyjar = build_keyjar([{"type": "RSA", "use": ["sig"]}])
+        self.service_context = ServiceContext(config={
+            'client_id': 'client_id', 'issuer': ISS,
+            'redirect_uris': ['https://example.com/cli/authz_cb']})
+        self.service_context.keyjar.import_jwks(_op_keyjar.export_jwks(),
+                                                ISS)
+        self.service = service_factory(
+            'AccessToken', ['oidc'], state_db=InMemoryStateDataBase(),
+            service_context=self.service_context,
+            conf={'verification': VERIFY_DEFERRED})
+        _idt = JWT(key_jar=_op_keyjar, iss=ISS, sign_alg='RS256',
+                   lifetime=300).pack(payload={'sub': 'diana'},
+                                      aud=['client_id'])
+        self.response = AccessTokenResponse(
+            access_token='token', token_type='Bearer', id_token=_idt)
+
+    def test_parse_response(self):
+        _resp = self.service.parse_response(self.response.to_json(),
+                                            state='state')
+        assert isinstance(_resp, DeferredVerification)
+        _idt = verified_claim_name('id_token')
+        assert _idt not in _resp.unverified
+        assert _resp[_idt]['sub'] == 'diana'
+
+    def test_parse_response_fails(self):
+        _header, _payload, _sig = self.response['id_token'].split('.')
+        self.response['id_token'] = '.'.join([_header, _payload, _sig[::-1]])
+        _resp = self.service.parse_response(self.response.to_json(),
+                                            state='state')
+        for _ in range(2):
+            with pytest.raises(Exception):
+                _resp['access_token']
+
+    def test_copy(self):
+        _resp = self.service.parse_response(self.response.to_json(),
+                                            state='state')
+        _copy = copy.deepcopy(_resp)
+        assert _copy.unverified is not _resp.unverified
+        assert _copy._verify.keywords['vargs']['keyjar'] is \
+            self.service_context.keyjar
+        assert _copy['access_token'] == 'token'
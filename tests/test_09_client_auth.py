@@ -117,6 +117,20 @@ class TestClientSecretBasic(object):
 
         assert http_args["headers"]["Authorization"].startswith('Basic ')
 
+    def test_secret_rotation(self, services):
+        _service = services['accesstoken']
+        _context = _service.service_context
+        _header = ClientSecretBasic().construct(
+            Message(), _service)['headers']['Authorization']
+        assert ClientSecretBasic().construct(
+            Message(), _service)['headers']['Authorization'] is _header
+
+        _context.client_secret = 'another password'
+        _header = ClientSecretBasic().construct(
+            Message(), _service)['headers']['Authorization']
+        _credentials = base64.urlsafe_b64decode(_header[6:]).decode('utf-8')
+        assert _credentials == 'A:another+password'
+
 
 class TestBearerHeader(object):
     def test_construct(self):
@@ -283,6 +297,39 @@ class TestPrivateKeyJWT(object):
         assert jso['aud'] == [
             _service.service_context.provider_info['token_endpoint']]
 
+    def test_signing_key_cached(self, services):
+        _service = services['accesstoken']
+        kb_rsa = KeyBundle(source='file://{}'.format(
+            os.path.join(BASE_PATH, "data/keys/rsa.key")), fileformat='der')
+        _service.service_context.keyjar.add_kb('', kb_rsa)
+        _service.service_context.provider_info = {
+            'issuer': 'https://example.com/',
+            'token_endpoint': "https://example.com/token"}
+
+        class CountingPrivateKeyJWT(PrivateKeyJWT):
+            resolved = 0
+
+            def get_signing_key_from_keyjar(self, algorithm,
+                                            service_context=None):
+                CountingPrivateKeyJWT.resolved += 1
+                return PrivateKeyJWT.get_signing_key_from_keyjar(
+                    self, algorithm, service_context)
+
+        for _ in range(3):
+            CountingPrivateKeyJWT().construct(AccessTokenRequest(),
+                                              service=_service,
+                                              algorithm="RS256")
+        assert CountingPrivateKeyJWT.resolved == 1
+
+        _service.service_context.keys_changed()
+        request = AccessTokenRequest()
+        CountingPrivateKeyJWT().construct(request, service=_service,
+                                          algorithm="RS256")
+        assert CountingPrivateKeyJWT.resolved == 2
+        _kj = KeyJar()
+        _kj.add_kb(_service.service_context.client_id, kb_rsa)
+        assert JWT(key_jar=_kj).unpack(request["client_assertion"])
+
     def test_construct_client_assertion(self, services):
         _service = services['accesstoken']
 
@@ -5,6 +5,7 @@ from oidcmsg.oauth2 import AuthorizationRequest
 from oidcmsg.oauth2 import AuthorizationResponse
 from oidcmsg.oauth2 import Message
 
+from oidcservice.client_auth import factory as ca_factory
 from oidcservice.service import Service
 from oidcservice.service_context import ServiceContext
 from oidcservice.service_factory import service_factory
@@ -202,6 +203,11 @@ class TestProviderInfo(object):
         assert _info['url'] == '{}/.well-known/openid-configuration'.format(
             self._iss)
 
+    def test_get_request_parameters_batch(self):
+        _infos = list(self.service.get_request_parameters_batch(
+            [('a', None), ('b', None)]))
+        assert _infos == [self.service.get_request_parameters()] * 2
+
 
 class TestRefreshAccessTokenRequest(object):
     @pytest.fixture(autouse=True)
@@ -235,6 +241,66 @@ class TestRefreshAccessTokenRequest(object):
         _info = self.service.get_request_parameters(state='abcdef')
         assert set(_info.keys()) == {'url', 'body', 'headers', 'method'}
 
+    def _add_states(self, n):
+        _keys = []
+        for i in range(n):
+            _key = 'state{}'.format(i)
+            _token_response = AccessTokenResponse(
+                access_token='bearer_token{}'.format(i),
+                refresh_token='refresh{}'.format(i))
+            self.service.state_db.set(_key, State(
+                token_response=_token_response.to_json()).to_json())
+            _keys.append(_key)
+        return _keys
+
+    @pytest.mark.parametrize('authn_method', ['', 'client_secret_basic',
+                                              'client_secret_post'])
+    def test_get_request_parameters_batch(self, authn_method):
+        _keys = self._add_states(3)
+        _infos = list(self.service.get_request_parameters_batch(
+            [(key, None) for key in _keys], authn_method=authn_method))
+        assert _infos == [
+            self.service.get_request_parameters(state=key,
+                                                authn_method=authn_method)
+            for key in _keys]
+        assert 'refresh1' in str(_infos[1])
+
+    def test_get_request_parameters_batch_request_args(self):
+        _keys = self._add_states(2)
+        _infos = list(self.service.get_request_parameters_batch(
+            [(_keys[0], {'scope': ['openid']}), (_keys[1], None)]))
+        assert 'scope=openid' in _infos[0]['body']
+        assert 'scope' not in _infos[1]['body']
+
+    def test_get_request_parameters_batch_lazy(self):
+        _keys = self._add_states(2)
+        _created = []
+
+        def factory(authn_method):
+            _created.append(authn_method)
+            return ca_factory(authn_method)
+
+        self.service.client_authn_factory = factory
+        _batch = self.service.get_request_parameters_batch(
+            [(_keys[0], None), ('unknown', None), (_keys[1], None)])
+        assert _created == []
+        assert next(_batch)['headers'] == {
+            'Authorization': 'Bearer refresh0',
+            'Content-Type': 'application/x-www-form-urlencoded'}
+        assert _created == ['bearer_header']
+        # A request that can not be built does not end the batch
+        assert isinstance(next(_batch), KeyError)
+        assert next(_batch)['headers']['Authorization'] == 'Bearer refresh1'
+        assert list(_batch) == []
+        assert _created == ['bearer_header']
+
+    def test_get_request_parameters_batch_state_argument(self):
+        _keys = self._add_states(2)
+        _infos = list(self.service.get_request_parameters_batch(
+            [(key, None) for key in _keys], state='other'))
+        assert _infos == [self.service.get_request_parameters(state=key)
+                          for key in _keys]
+
 
 def test_access_token_srv_conf():
     client_config = {
@@ -1,5 +1,7 @@
 import json
 import os
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
 
 import pytest
 from cryptojwt.jws import jws
@@ -24,6 +26,7 @@ from oidcservice.exception import ParameterError
 from oidcservice.oidc.registration import add_jwks_uri_or_jwks
 from oidcservice.oidc.registration import response_types_to_grant_types
 from oidcservice.service_context import ServiceContext
+from oidcservice.util import get_http_url
 from oidcservice.service_factory import service_factory
 from oidcservice.state_interface import InMemoryStateDataBase
 from oidcservice.state_interface import State
@@ -244,6 +247,125 @@ class TestAuthorization(object):
             self.service.update_service_context(resp, 'state')
 
 
+class TestRequestObjectKeys(object):
+    @pytest.fixture(autouse=True)
+    def create_request(self):
+        client_config = {
+            'client_id': 'client_id', 'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb']
+        }
+        self.keyjar = build_keyjar(KEYSPEC)
+        service_context = ServiceContext(self.keyjar, config=client_config)
+        service_context.issuer = 'https://example.com'
+        self.service = service_factory('Authorization', ['oidc'],
+                                       state_db=InMemoryStateDataBase(),
+                                       service_context=service_context)
+        self.service.endpoint = 'https://example.com/authorize'
+
+    def test_keys(self):
+        _keys = self.service.request_object_keys('RS256')
+        assert [k.kty for k in _keys.get_signing_key()] == ['RSA']
+        assert self.service.request_object_keys('RS256') is _keys
+        _keys = self.service.request_object_keys('ES256')
+        assert [k.kty for k in _keys.get_signing_key()] == ['EC']
+
+    def test_keys_changed(self):
+        _keys = self.service.request_object_keys('RS256')
+        self.service.service_context.keys_changed()
+        assert self.service.request_object_keys('RS256') is not _keys
+
+    def test_signing_kid(self):
+        _keyjar = build_keyjar([{"type": "RSA", "use": ["sig"]}])
+        _key = _keyjar.get_signing_key('RSA')[0]
+        self.keyjar.add_kb('', _keyjar.issuer_keys[''][0])
+        _context = self.service.service_context
+        _picked = self.service.request_object_keys('RS256')
+        assert _picked.get_signing_key()[0] is not _key
+
+        _context.kid['sig']['RSA'] = _key.kid
+        assert self.service.request_object_keys(
+            'RS256').get_signing_key()[0] is _key
+
+    def test_request(self):
+        req_args = {'response_type': 'code', 'state': 'state'}
+        _info = self.service.get_request_parameters(request_args=req_args,
+                                                    request_method='value')
+        msg = AuthorizationRequest().from_urlencoded(
+            self.service.get_urlinfo(_info['url']))
+        _resp = jws.factory(msg['request']).verify_compact(
+            msg['request'], keys=self.keyjar.get_signing_key(key_type='RSA'))
+        assert _resp['state'] == 'state'
+
+
+class TestAuthorizationURLTemplate(object):
+    @pytest.fixture(autouse=True)
+    def create_request(self):
+        client_config = {
+            'client_id': 'client_id', 'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'behaviour': {'response_types': ['code']}
+        }
+        service_context = ServiceContext(CLI_KEY, config=client_config)
+        service_context.issuer = 'https://example.com'
+        self.service = service_factory('Authorization', ['oidc'],
+                                       state_db=InMemoryStateDataBase(),
+                                       service_context=service_context,
+                                       conf={'url_template': True})
+        self.service.endpoint = 'https://example.com/authorize'
+
+    def _url(self, **request_args):
+        return self.service.get_request_parameters(
+            request_args=request_args)['url']
+
+    def test_same_as_get_http_url(self):
+        self.service.endpoint = 'https://example.com/authorize?foo=bar#frag'
+        _url = self._url(scope=['openid', 'email'], state='a b&c')
+        _req = self.service.get_item(AuthorizationRequest, 'auth_request',
+                                     'a b&c')
+        _expected = get_http_url(self.service.endpoint, _req)
+        assert parse_qs(urlsplit(_url).query) == \
+            parse_qs(urlsplit(_expected).query)
+        assert _url.startswith('https://example.com/authorize?')
+        assert _url.endswith('#frag')
+        assert parse_qs(urlsplit(_url).query)['foo'] == ['bar']
+        assert self.service._template is not None
+
+    def test_template_reused(self):
+        _first = parse_qs(urlsplit(self._url()).query)
+        _template = self.service._template
+        _second = parse_qs(urlsplit(self._url()).query)
+        assert self.service._template is _template
+        assert _first['state'] != _second['state']
+        assert _first['nonce'] != _second['nonce']
+        assert _first['scope'] == _second['scope'] == ['openid']
+
+    def test_new_static_value(self):
+        self._url()
+        _query = parse_qs(urlsplit(self._url(scope=['email'])).query)
+        assert _query['scope'] == ['email openid']
+        self.service.service_context.behaviour['response_types'] = ['token']
+        _query = parse_qs(urlsplit(self._url()).query)
+        assert _query['response_type'] == ['token']
+        assert 'nonce' not in _query
+
+    def test_new_endpoint(self):
+        self._url()
+        self.service.endpoint = 'https://op.example.org/authz'
+        assert self._url().startswith('https://op.example.org/authz?')
+
+    def test_dynamic_param_in_endpoint(self):
+        self.service.endpoint = 'https://example.com/authorize?state=fixed'
+        _query = parse_qs(urlsplit(self._url()).query)
+        assert _query['state'] == ['fixed']
+        assert self.service._template is None
+
+    def test_off(self):
+        self.service.url_template = False
+        _query = parse_qs(urlsplit(self._url()).query)
+        assert _query['client_id'] == ['client_id']
+        assert self.service._template is None
+
+
 class TestAuthorizationCallback(object):
     @pytest.fixture(autouse=True)
     def create_request(self):
@@ -641,6 +763,20 @@ class TestUserInfo(object):
         assert len(_req) == 1
         assert 'access_token' in _req
 
+    def test_state_decoded_once(self):
+        _reads = []
+        _get = self.service.state_db.get
+
+        def get(key):
+            _reads.append(key)
+            return _get(key)
+
+        self.service.state_db.get = get
+        self.service.endpoint = 'https://example.com/userinfo'
+        _info = self.service.get_request_parameters(state='abcde')
+        assert _info['headers'] == {'Authorization': 'Bearer access_token'}
+        assert _reads == ['abcde']
+
     def test_unpack_simple_response(self):
         resp = OpenIDSchema(sub='diana', given_name='Diana',
                             family_name='krall')
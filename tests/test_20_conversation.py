@@ -5,6 +5,7 @@ import time
 from urllib.parse import parse_qs
 from urllib.parse import urlparse
 
+import pytest
 from cryptojwt.jwt import JWT
 from cryptojwt.key_jar import KeyJar
 
@@ -19,6 +20,8 @@ from oidcservice.oidc.webfinger import WebFinger
 from oidcservice.service import init_services
 from oidcservice.service_context import ServiceContext
 from oidcservice.oidc import DEFAULT_SERVICES
+from oidcservice.sqlite_state_db import SQLiteStateDataBase
+from oidcservice.state_interface import FieldStateDataBase
 from oidcservice.state_interface import InMemoryStateDataBase
 
 # ================== SETUP ===========================
@@ -97,7 +100,16 @@ OP_KEYJAR.import_jwks(SERVICE_PUBLIC_JWKS, RP_BASEURL)
 
 # ---------------------------------------------------
 
-def test_conversation():
+@pytest.fixture(params=['memory', 'sqlite', 'field'])
+def state_db(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteStateDataBase(str(tmp_path / 'state.db'))
+    elif request.param == 'field':
+        return FieldStateDataBase()
+    return InMemoryStateDataBase()
+
+
+def test_conversation(state_db):
     service_context = ServiceContext(
         RP_KEYJAR,
         {
@@ -119,8 +131,8 @@ def test_conversation():
     service_spec['WebFinger'] = {'class': WebFinger}
 
     service = init_services(service_spec,
-                             state_db=InMemoryStateDataBase(),
-                             service_context=service_context)
+                            state_db=state_db,
+                            service_context=service_context)
 
     assert set(service.keys()) == {'accesstoken', 'authorization', 'webfinger',
                                    'registration', 'refresh_token', 'userinfo',
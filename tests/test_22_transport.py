@@ -0,0 +1,328 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import pytest
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oauth2 import ResponseMessage
+
+from oidcservice.async_transport import AiohttpTransport
+from oidcservice.async_transport import ExecutorTransport
+from oidcservice.async_transport import async_transport
+from oidcservice.exception import ResponseError
+from oidcservice.exception import TransportError
+from oidcservice.oauth2 import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.state_interface import State
+from oidcservice.transport import RequestsTransport
+from oidcservice.transport import origin
+
+from MockOP import HTTPResponse
+from MockOP import MockOP
+from MockOP import MockOPServer
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class StubOP(MockOP):
+    def __init__(self, baseurl='http://example.com/'):
+        MockOP.__init__(self, baseurl)
+        self.active = 0
+        self.max_active = 0
+        self._lock = threading.Lock()
+
+    def discovery(self, request=None, **kwargs):
+        _info = {
+            'issuer': self.baseurl[:-1],
+            'authorization_endpoint': self.baseurl + 'authorization',
+            'token_endpoint': self.baseurl + 'token',
+            'response_types_supported': ['code'],
+            'grant_types_supported': ['authorization_code',
+                                      'refresh_token'],
+        }
+        return HTTPResponse(json.dumps(_info), headers=JSON_HEADERS)
+
+    def token(self, request, **kwargs):
+        _req = parse_qs(request)
+        _authz = kwargs['headers'].get('Authorization')
+        if _req.get('refresh_token') == ['revoked'] or \
+                _authz == 'Bearer revoked':
+            return HTTPResponse(json.dumps({'error': 'invalid_grant'}), 400,
+                                headers=JSON_HEADERS)
+
+        _resp = AccessTokenResponse(access_token='new_access_token',
+                                    refresh_token='new_refresh_token',
+                                    token_type='Bearer', expires_in=3600)
+        return HTTPResponse(_resp.to_json(), headers=JSON_HEADERS)
+
+    def echo(self, request, **kwargs):
+        return HTTPResponse(request or '',
+                            headers={'Content-Type': 'text/plain'})
+
+    def slow(self, request, **kwargs):
+        time.sleep(0.5)
+        return HTTPResponse('late')
+
+    def broken(self, request, **kwargs):
+        return HTTPResponse('Internal Server Error', 500)
+
+    def busy(self, request, **kwargs):
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.active, self.max_active)
+        time.sleep(0.05)
+        with self._lock:
+            self.active -= 1
+        return HTTPResponse('done')
+
+
+@pytest.fixture
+def server():
+    with MockOPServer(StubOP()) as _server:
+        yield _server
+
+
+class TestRequestsTransport(object):
+    @pytest.fixture(autouse=True)
+    def create_transport(self):
+        self.timings = []
+        self.transport = RequestsTransport(timeout=5,
+                                           on_timing=self.timings.append)
+        yield
+        self.transport.close()
+
+    def test_send(self, server):
+        _resp = self.transport.send(server.baseurl + 'echo?foo=bar')
+        assert _resp.status_code == 200
+        assert _resp.text == 'foo=bar'
+
+        _resp = self.transport.send(server.baseurl + 'echo', method='POST',
+                                    body='foo=bar')
+        assert _resp.text == 'foo=bar'
+
+    def test_connections_reused(self, server):
+        for _ in range(5):
+            self.transport.send(server.baseurl + 'echo?foo=bar',
+                                issuer='https://op.example.org')
+        assert server.connections == 1
+
+    def test_pool_per_issuer(self, server):
+        assert self.transport.session('https://a.example.org') is \
+            self.transport.session('https://a.example.org')
+        for issuer in ['https://a.example.org', 'https://b.example.org'] * 2:
+            self.transport.send(server.baseurl + 'echo?foo=bar',
+                                issuer=issuer)
+        assert server.connections == 2
+
+    def test_timing(self, server):
+        self.transport.send(server.baseurl + 'echo?secret=1',
+                            issuer='https://op.example.org')
+        self.transport.send(server.baseurl + 'slow')
+        assert len(self.timings) == 2
+        assert self.timings[0].issuer == 'https://op.example.org'
+        assert self.timings[0].method == 'GET'
+        assert self.timings[0].endpoint == server.baseurl + 'echo'
+        assert self.timings[0].status_code == 200
+        assert self.timings[1].issuer == origin(server.baseurl)
+        assert self.timings[1].seconds >= 0.5
+
+    def test_timeout(self, server):
+        with pytest.raises(TransportError):
+            self.transport.send(server.baseurl + 'slow', timeout=0.1)
+        assert self.timings == []
+
+    def test_connection_refused(self, server):
+        server.stop()
+        with pytest.raises(TransportError):
+            self.transport.send(server.baseurl + 'echo')
+
+
+class ServicesSetup(object):
+    transport_class = RequestsTransport
+
+    @pytest.fixture(autouse=True)
+    def create_services(self, server):
+        self.server = server
+        self.transport = self.transport_class(timeout=5)
+        self.service_context = ServiceContext(config={
+            'client_id': 'client_id', 'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'issuer': server.baseurl[:-1]})
+        self.state_db = InMemoryStateDataBase()
+        self.service = init_services(DEFAULT_SERVICES, self.service_context,
+                                     self.state_db, transport=self.transport)
+        self.service_context.service = self.service
+        yield
+        self.close()
+
+    def close(self):
+        self.transport.close()
+
+    def _add_state(self, refresh_token, key='state'):
+        _token_response = AccessTokenResponse(access_token='access_token',
+                                              refresh_token=refresh_token,
+                                              token_type='Bearer')
+        self.state_db.set(key, State(
+            iss=self.service_context.issuer,
+            token_response=_token_response.to_json()).to_json())
+
+
+class TestServiceRequest(ServicesSetup):
+
+    def test_transport(self):
+        for _service in self.service.values():
+            assert _service.get_transport() is self.transport
+
+    def test_provider_info(self):
+        _resp = self.service['provider_info'].service_request()
+        assert _resp['token_endpoint'] == self.server.baseurl + 'token'
+        assert self.service_context.provider_info == _resp
+        assert self.service['accesstoken'].endpoint == \
+            self.server.baseurl + 'token'
+
+    def test_refresh_access_token(self):
+        self.service['provider_info'].service_request()
+        self._add_state('refresh_token')
+        _resp = self.service['refresh_token'].service_request(state='state')
+        assert _resp['access_token'] == 'new_access_token'
+        _item = self.service['refresh_token'].get_item(
+            AccessTokenResponse, 'token_response', 'state')
+        assert _item['refresh_token'] == 'new_refresh_token'
+        assert self.server.connections == 1
+
+    def test_error_response(self):
+        self.service['provider_info'].service_request()
+        self._add_state('revoked')
+        _resp = self.service['refresh_token'].service_request(state='state')
+        assert isinstance(_resp, ResponseMessage)
+        assert _resp['error'] == 'invalid_grant'
+        _item = self.service['refresh_token'].get_item(
+            AccessTokenResponse, 'token_response', 'state')
+        assert _item['access_token'] == 'access_token'
+
+    def test_server_error(self):
+        self._add_state('refresh_token')
+        self.service['refresh_token'].endpoint = self.server.baseurl + 'broken'
+        with pytest.raises(ResponseError):
+            self.service['refresh_token'].service_request(state='state')
+
+
+class TestExecutorTransport(object):
+    @pytest.fixture(autouse=True)
+    def create_transport(self):
+        self.transport = RequestsTransport(timeout=5)
+        yield
+        self.transport.close()
+
+    def test_asend(self, server):
+        _transport = ExecutorTransport(self.transport)
+        _resp = asyncio.run(_transport.asend(server.baseurl + 'echo',
+                                             method='POST', body='foo=bar'))
+        assert _resp.text == 'foo=bar'
+
+    def test_max_per_host(self, server):
+        _transport = ExecutorTransport(self.transport, max_per_host=2)
+
+        async def send_all():
+            return await asyncio.gather(*[
+                _transport.asend(server.baseurl + 'busy') for _ in range(8)])
+
+        _responses = asyncio.run(send_all())
+        assert [r.text for r in _responses] == ['done'] * 8
+        assert server.op.max_active == 2
+        assert server.connections == 2
+
+    def test_async_transport(self):
+        _transport = async_transport(self.transport)
+        assert isinstance(_transport, ExecutorTransport)
+        assert async_transport(self.transport) is _transport
+        assert async_transport(_transport) is _transport
+
+
+class TestAsyncServiceRequest(ServicesSetup):
+    def _discover(self):
+        asyncio.run(self.service['provider_info'].aservice_request())
+
+    def test_provider_info(self):
+        _resp = asyncio.run(self.service['provider_info'].aservice_request())
+        assert _resp['token_endpoint'] == self.server.baseurl + 'token'
+        assert self.service_context.provider_info == _resp
+
+    def test_concurrent_refresh(self):
+        self._discover()
+        _keys = ['state{}'.format(n) for n in range(10)]
+        for key in _keys:
+            self._add_state('refresh_token', key)
+
+        async def refresh_all():
+            return await asyncio.gather(*[
+                self.service['refresh_token'].aservice_request(state=key)
+                for key in _keys])
+
+        _responses = asyncio.run(refresh_all())
+        assert [r['access_token'] for r in _responses] == \
+            ['new_access_token'] * 10
+        for key in _keys:
+            _item = self.service['refresh_token'].get_item(
+                AccessTokenResponse, 'token_response', key)
+            assert _item['refresh_token'] == 'new_refresh_token'
+
+    def test_executor(self):
+        self._discover()
+        self._add_state('refresh_token')
+        _service = self.service['refresh_token']
+        _threads = []
+
+        def verify_response(*args, **kwargs):
+            _threads.append(threading.get_ident())
+            return type(_service).verify_response(_service, *args, **kwargs)
+
+        _service.verify_response = verify_response
+        with ThreadPoolExecutor(1) as executor:
+            _resp = asyncio.run(_service.aservice_request(state='state',
+                                                          executor=executor))
+        assert _resp['access_token'] == 'new_access_token'
+        assert _threads and _threads[0] != threading.get_ident()
+
+    def test_error_response(self):
+        self._discover()
+        self._add_state('revoked')
+        _resp = asyncio.run(
+            self.service['refresh_token'].aservice_request(state='state'))
+        assert _resp['error'] == 'invalid_grant'
+
+    def test_server_error(self):
+        self._add_state('refresh_token')
+        self.service['refresh_token'].endpoint = self.server.baseurl + 'broken'
+        with pytest.raises(ResponseError):
+            asyncio.run(
+                self.service['refresh_token'].aservice_request(state='state'))
+
+
+class TestAiohttpTransport(ServicesSetup):
+    @property
+    def transport_class(self):
+        pytest.importorskip('aiohttp')
+        return AiohttpTransport
+
+    def close(self):
+        pass
+
+    def test_refresh(self):
+        async def refresh():
+            try:
+                await self.service['provider_info'].aservice_request()
+                self._add_state('refresh_token')
+                return await self.service['refresh_token'].aservice_request(
+                    state='state')
+            finally:
+                await self.transport.aclose()
+
+        _resp = asyncio.run(refresh())
+        assert _resp['access_token'] == 'new_access_token'
+        assert self.server.connections == 1
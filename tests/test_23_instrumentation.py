@@ -0,0 +1,140 @@
+import logging
+
+import pytest
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oauth2 import AuthorizationResponse
+
+from oidcservice.instrumentation import Histogram
+from oidcservice.instrumentation import LogSink
+from oidcservice.instrumentation import StageTiming
+from oidcservice.instrumentation import hook_name
+from oidcservice.instrumentation import instrument
+from oidcservice.oauth2 import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+from oidcservice.state_interface import InMemoryStateDataBase
+
+ISS = 'https://example.com'
+
+
+class TestInstrumentation(object):
+    @pytest.fixture(autouse=True)
+    def create_services(self):
+        service_context = ServiceContext(config={
+            'client_id': 'client_id', 'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'issuer': ISS})
+        self.services = init_services(DEFAULT_SERVICES, service_context,
+                                      InMemoryStateDataBase())
+        for _service in self.services.values():
+            _service.endpoint = '{}/{}'.format(ISS, _service.service_name)
+        self.timings = []
+        instrument(self.services, self.timings.append)
+
+    def _stages(self):
+        return [(t.service_name, t.stage, t.hook) for t in self.timings]
+
+    def test_request(self):
+        _service = self.services['authorization']
+        _service.create_state(ISS, 'state')
+        _service.get_request_parameters(
+            request_args={'response_type': 'code'}, state='state')
+        assert self._stages() == [
+            ('authorization', 'pre_construct', 'pick_redirect_uris'),
+            ('authorization', 'pre_construct', 'set_state_parameter'),
+            ('authorization', 'gather_request_args', ''),
+            ('authorization', 'instantiate', ''),
+            ('authorization', 'post_construct', 'store_auth_request'),
+            ('authorization', 'serialize', '')]
+        assert all(t.seconds >= 0 for t in self.timings)
+
+    def test_client_authn(self):
+        _service = self.services['accesstoken']
+        _service.create_state(ISS, 'state')
+        _service.store_item(AuthorizationResponse(code='code'),
+                            'auth_response', 'state')
+        _service.get_request_parameters(
+            request_args={'redirect_uri': 'https://example.com/cli/authz_cb'},
+            state='state')
+        assert ('accesstoken', 'client_authn', 'client_secret_basic') in \
+            self._stages()
+
+    def test_batch(self):
+        _service = self.services['accesstoken']
+        for key in ['a', 'b']:
+            _service.create_state(ISS, key)
+            _service.store_item(AuthorizationResponse(code='code'),
+                                'auth_response', key)
+        _args = {'redirect_uri': 'https://example.com/cli/authz_cb'}
+        list(_service.get_request_parameters_batch([('a', _args),
+                                                    ('b', _args)]))
+        _stages = self._stages()
+        assert _stages.count(('accesstoken', 'client_authn',
+                              'client_secret_basic')) == 2
+        assert _stages.count(('accesstoken', 'serialize', '')) == 2
+
+    def test_response(self):
+        _service = self.services['accesstoken']
+        _service.create_state(ISS, 'state')
+        _resp = AccessTokenResponse(access_token='access_token',
+                                    token_type='Bearer')
+        _service.parse_response(_resp.to_json(), state='state')
+        assert self._stages() == [
+            ('accesstoken', 'deserialize', ''),
+            ('accesstoken', 'verify', ''),
+            ('accesstoken', 'post_parse_response', '')]
+
+    def test_error_response(self):
+        _service = self.services['accesstoken']
+        _service.parse_response('{"error": "invalid_grant"}')
+        assert self._stages() == [('accesstoken', 'deserialize', '')]
+
+    def test_disabled(self):
+        instrument(self.services, None)
+        _service = self.services['authorization']
+        _service.create_state(ISS, 'state')
+        _service.get_request_parameters(
+            request_args={'response_type': 'code'}, state='state')
+        assert self.timings == []
+
+
+def test_hook_name():
+    class Hook(object):
+        def __call__(self, request_args, **kwargs):
+            return request_args, {}
+
+    def pre_construct(request_args, **kwargs):
+        return request_args, {}
+
+    assert hook_name(pre_construct) == 'pre_construct'
+    assert hook_name(Hook()) == 'Hook'
+    assert hook_name(TestInstrumentation().create_services) == \
+        'create_services'
+
+
+def test_histogram():
+    _histogram = Histogram()
+    for n in range(1, 101):
+        _histogram(StageTiming('token', 'verify', '', n * 1e-4))
+    _histogram(StageTiming('token', 'serialize', '', 1e-5))
+
+    _summary = _histogram.summary()
+    assert set(_summary.keys()) == {('token', 'verify', ''),
+                                    ('token', 'serialize', '')}
+    _verify = _summary[('token', 'verify', '')]
+    assert _verify['count'] == 100
+    assert _verify['mean'] == pytest.approx(50.5e-4)
+    assert _verify['max'] == pytest.approx(1e-2)
+    assert 50e-4 <= _verify['p50'] <= 50e-4 * 1.25
+    assert 99e-4 <= _verify['p99'] <= 1e-2
+    assert _summary[('token', 'serialize', '')]['p99'] == pytest.approx(1e-5)
+
+    _histogram.clear()
+    assert _histogram.summary() == {}
+
+
+def test_log_sink(caplog):
+    _sink = LogSink(level=logging.INFO)
+    with caplog.at_level(logging.INFO, logger='oidcservice.instrumentation'):
+        _sink(StageTiming('token', 'verify', '', 1e-4))
+    assert caplog.messages == ['token verify : 100.0 us']
@@ -0,0 +1,131 @@
+import os
+import time
+
+import pytest
+from cryptojwt.jwt import JWT
+from cryptojwt.key_bundle import KeyBundle
+from cryptojwt.key_jar import KeyJar
+from oidcmsg.oauth2 import AccessTokenRequest
+
+from oidcservice.assertion_pool import AssertionPool
+from oidcservice.client_auth import PrivateKeyJWT
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+
+BASE_PATH = os.path.abspath(os.path.dirname(__file__))
+CLIENT_ID = 'client_id'
+TOKEN_ENDPOINT = 'https://example.com/token'
+
+
+@pytest.fixture
+def key_bundle():
+    return KeyBundle(source='file://{}'.format(
+        os.path.join(BASE_PATH, "data/keys/rsa.key")), fileformat='der')
+
+
+def unpack(assertion, key_bundle):
+    _keyjar = KeyJar()
+    _keyjar.add_kb(CLIENT_ID, key_bundle)
+    return JWT(key_jar=_keyjar).unpack(assertion)
+
+
+class TestAssertionPool(object):
+    @pytest.fixture(autouse=True)
+    def create_pool(self, key_bundle):
+        self.pool = AssertionPool(size=4)
+        self.keys = key_bundle.get('RSA')
+
+    def _take(self):
+        return self.pool.take(CLIENT_ID, self.keys, TOKEN_ENDPOINT, 'RS256')
+
+    def test_take(self, key_bundle):
+        assert self._take() is None
+        self.pool.fill()
+        assert self.pool.stats() == {'hits': 0, 'misses': 1, 'expired': 0,
+                                     'signed': 4, 'pooled': 4}
+
+        _jtis = set()
+        for _ in range(4):
+            _info = unpack(self._take(), key_bundle)
+            assert _info['iss'] == CLIENT_ID
+            assert _info['aud'] == [TOKEN_ENDPOINT]
+            assert _info['exp'] - _info['iat'] == self.pool.lifetime
+            _jtis.add(_info['jti'])
+        assert len(_jtis) == 4
+
+        assert self._take() is None
+        assert self.pool.stats() == {'hits': 4, 'misses': 2, 'expired': 0,
+                                     'signed': 4, 'pooled': 0}
+
+    def test_other_audience(self):
+        self._take()
+        self.pool.fill()
+        assert self.pool.take(CLIENT_ID, self.keys, 'https://example.com',
+                              'RS256') is None
+
+    def test_expired(self):
+        self.pool.min_remaining = self.pool.lifetime + 1
+        self._take()
+        self.pool.fill()
+        assert self._take() is None
+        assert self.pool.stats()['expired'] == 4
+
+    def test_not_asked_for(self):
+        self._take()
+        for _pool in self.pool._pools.values():
+            _pool[2] -= self.pool.lifetime + 1
+        self.pool.fill()
+        assert self.pool.stats()['pooled'] == 0
+        assert self.pool._pools == {}
+
+    def test_background(self):
+        self.pool.start(interval=10)
+        try:
+            self._take()
+            for _ in range(100):
+                if self.pool.stats()['pooled'] == 4:
+                    break
+                time.sleep(0.05)
+            assert self._take()
+        finally:
+            self.pool.stop()
+        assert self.pool.stats()['hits'] == 1
+
+
+class TestPrivateKeyJWT(object):
+    @pytest.fixture(autouse=True)
+    def create_service(self, key_bundle):
+        _context = ServiceContext(config={'client_id': CLIENT_ID})
+        _context.keyjar.add_kb('', key_bundle)
+        _context.provider_info = {'issuer': 'https://example.com/',
+                                  'token_endpoint': TOKEN_ENDPOINT}
+        _context.assertion_pool = AssertionPool(size=2)
+        self.service = service_factory('AccessToken', ['oidc'],
+                                       state_db=InMemoryStateDataBase(),
+                                       service_context=_context)
+        self.pool = _context.assertion_pool
+
+    def _assertion(self, **kwargs):
+        _request = AccessTokenRequest()
+        PrivateKeyJWT().construct(_request, service=self.service,
+                                  algorithm='RS256',
+                                  authn_endpoint='token_endpoint', **kwargs)
+        return _request['client_assertion']
+
+    def test_from_pool(self, key_bundle):
+        # Signed inline when the pool is empty
+        assert unpack(self._assertion(), key_bundle)['aud'] == [
+            TOKEN_ENDPOINT]
+        self.pool.fill()
+        assert unpack(self._assertion(), key_bundle)['aud'] == [
+            TOKEN_ENDPOINT]
+        assert self.pool.stats() == {'hits': 1, 'misses': 1, 'expired': 0,
+                                     'signed': 2, 'pooled': 1}
+
+    def test_lifetime(self, key_bundle):
+        self._assertion()
+        self.pool.fill()
+        _info = unpack(self._assertion(lifetime=30), key_bundle)
+        assert _info['exp'] - _info['iat'] == 30
+        assert self.pool.stats()['hits'] == 0
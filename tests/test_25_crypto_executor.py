@@ -0,0 +1,194 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from cryptojwt.exception import HeaderError
+from cryptojwt.jwe.jwe import factory as jwe_factory
+from cryptojwt.jws.exception import SignerAlgError
+from cryptojwt.jws.jws import JWS
+from cryptojwt.jws.jws import factory as jws_factory
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import KeyJar
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oauth2 import AccessTokenRequest
+from oidcmsg.oidc import AccessTokenResponse
+from oidcmsg.oidc import AuthorizationRequest
+from oidcmsg.oidc import verified_claim_name
+
+from oidcservice import crypto_executor
+from oidcservice.client_auth import PrivateKeyJWT
+from oidcservice.crypto_executor import CryptoExecutor
+from oidcservice.crypto_executor import OffloadedJWT
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+from oidcservice.state_interface import InMemoryStateDataBase
+
+ISS = 'https://example.com'
+KEYSPEC = [
+    {"type": "RSA", "use": ["sig"]},
+    {"type": "EC", "crv": "P-256", "use": ["sig"]},
+]
+ENC_KEYSPEC = [{"type": "RSA", "use": ["enc"]}]
+
+
+@pytest.fixture(scope='module')
+def executor():
+    _executor = CryptoExecutor(max_workers=2)
+    yield _executor
+    _executor.shutdown()
+
+
+@pytest.fixture(scope='module')
+def keyjar():
+    return build_keyjar(KEYSPEC)
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    def __init__(self):
+        ThreadPoolExecutor.__init__(self, 1)
+        self.submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.submitted += 1
+        return ThreadPoolExecutor.submit(self, *args, **kwargs)
+
+
+class TestCryptoExecutor(object):
+    @pytest.mark.parametrize('alg,kty', [('RS256', 'RSA'), ('ES256', 'EC')])
+    def test_sign(self, executor, keyjar, alg, kty):
+        _token = executor.sign('{"sub": "diana"}', alg,
+                               keyjar.get_signing_key(kty))
+        assert jws_factory(_token).verify_compact(
+            _token, keyjar.get_signing_key(kty)) == {'sub': 'diana'}
+        assert executor.verify(_token, keyjar.get_signing_key(kty)) == {
+            'sub': 'diana'}
+
+    def test_verify_fails(self, executor, keyjar):
+        _token = JWS('{"sub": "diana"}', alg='RS256').sign_compact(
+            keyjar.get_signing_key('RSA'))
+        _other = build_keyjar(KEYSPEC)
+        with pytest.raises(Exception):
+            executor.verify(_token, _other.get_signing_key('RSA'))
+
+    def test_verify_disallowed_alg(self, executor, keyjar):
+        _token = executor.sign('{"sub": "diana"}', 'ES256',
+                               keyjar.get_signing_key('EC'))
+        with pytest.raises(SignerAlgError):
+            executor.verify(_token, keyjar.get_signing_key('EC'),
+                            allowed_algs=['RS256'])
+
+        _keyjar = KeyJar()
+        _keyjar.import_jwks(keyjar.export_jwks(), ISS)
+        _token = JWT(key_jar=keyjar, iss=ISS, sign_alg='ES256').pack(
+            payload={'sub': 'diana'})
+        with pytest.raises(SignerAlgError):
+            OffloadedJWT(executor, key_jar=_keyjar,
+                         allowed_sign_algs=['RS256']).unpack(_token)
+        assert OffloadedJWT(executor, key_jar=_keyjar,
+                            allowed_sign_algs=['ES256']).unpack(
+            _token)['sub'] == 'diana'
+
+    def test_encrypt(self, executor):
+        _keyjar = build_keyjar(ENC_KEYSPEC)
+        _keys = _keyjar.get_encrypt_key('RSA')
+        _token = executor.encrypt('secret', 'RSA-OAEP', 'A128CBC-HS256',
+                                  _keys, kid=_keys[0].kid)
+        assert jwe_factory(_token).jwt.headers['kid'] == _keys[0].kid
+        assert executor.decrypt(_token, _keys) == b'secret'
+        with pytest.raises(HeaderError):
+            executor.decrypt(_token, _keys, allowed_algs=['RSA1_5'])
+        with pytest.raises(HeaderError):
+            executor.decrypt(_token, _keys, allowed_encs=['A256GCM'])
+
+    def test_keys_sent_once(self, keyjar):
+        crypto_executor._WORKER_KEYS.clear()
+        _executor = CryptoExecutor(executor=CountingExecutor())
+        _keys = keyjar.get_signing_key('EC')
+        _executor.sign('{}', 'ES256', _keys)
+        assert _executor.executor.submitted == 2
+        _executor.sign('{}', 'ES256', _keys)
+        assert _executor.executor.submitted == 3
+        assert len(crypto_executor._WORKER_KEYS) == 1
+        _executor.shutdown()
+
+
+class TestServices(object):
+    @pytest.fixture(autouse=True)
+    def create_context(self, executor, keyjar):
+        self.service_context = ServiceContext(keyjar, config={
+            'client_id': 'client_id', 'issuer': ISS,
+            'redirect_uris': ['https://example.com/cli/authz_cb']})
+        self.service_context.provider_info = {
+            'issuer': ISS, 'token_endpoint': ISS + '/token'}
+        self.service_context.crypto_executor = executor
+        self.keyjar = keyjar
+
+    def _service(self, service_name):
+        return service_factory(service_name, ['oidc'],
+                               state_db=InMemoryStateDataBase(),
+                               service_context=self.service_context)
+
+    def test_signed_response(self):
+        _op_keyjar = build_keyjar(KEYSPEC)
+        self.service_context.keyjar.import_jwks(_op_keyjar.export_jwks(),
+                                                ISS)
+        _token = JWT(key_jar=_op_keyjar, iss=ISS, sign_alg='ES256').pack(
+            payload={'sub': 'diana'})
+        _service = self._service('UserInfo')
+        assert isinstance(_service._jwt_unpacker(), OffloadedJWT)
+        assert _service._do_jwt(_token)['sub'] == 'diana'
+
+        self.service_context.crypto_executor = None
+        assert not isinstance(_service._jwt_unpacker(), OffloadedJWT)
+
+    def _id_token_response(self, op_keyjar):
+        _idt = JWT(key_jar=op_keyjar, iss=ISS, sign_alg='ES256',
+                   lifetime=300).pack(
+            payload={'sub': 'diana', 'aud': ['client_id'], 'nonce': 'N'})
+        return AccessTokenResponse(access_token='token', token_type='Bearer',
+                                   id_token=_idt).to_json()
+
+    def test_id_token(self):
+        _op_keyjar = build_keyjar(KEYSPEC)
+        self.service_context.keyjar.import_jwks(_op_keyjar.export_jwks(),
+                                                ISS)
+        _executor = CryptoExecutor(executor=CountingExecutor())
+        self.service_context.crypto_executor = _executor
+        _service = self._service('AccessToken')
+        _resp = _service.verify_response(
+            self._id_token_response(_op_keyjar), 'json')
+        assert _resp[verified_claim_name('id_token')]['sub'] == 'diana'
+        assert _executor.executor.submitted
+        _executor.shutdown()
+
+    def test_id_token_bad_signature(self):
+        _op_keyjar = build_keyjar(KEYSPEC)
+        self.service_context.keyjar.import_jwks(
+            build_keyjar(KEYSPEC).export_jwks(), ISS)
+        _service = self._service('AccessToken')
+        with pytest.raises(Exception):
+            _service.verify_response(self._id_token_response(_op_keyjar),
+                                     'json')
+
+    def test_client_assertion(self):
+        _request = AccessTokenRequest()
+        PrivateKeyJWT().construct(_request,
+                                  service=self._service('AccessToken'),
+                                  algorithm='RS256',
+                                  authn_endpoint='token_endpoint')
+        _keyjar = KeyJar()
+        _keyjar.import_jwks(self.keyjar.export_jwks(), 'client_id')
+        _info = JWT(key_jar=_keyjar).unpack(_request['client_assertion'])
+        assert _info['aud'] == [ISS + '/token']
+
+    def test_request_object(self):
+        _service = self._service('Authorization')
+        _request = AuthorizationRequest(
+            response_type='code', client_id='client_id', scope='openid',
+            redirect_uri='https://example.com/cli/authz_cb', state='state')
+        _service.construct_request_parameter(
+            _request, 'request', request_object_signing_alg='ES256',
+            service=_service)
+        _info = jws_factory(_request['request']).verify_compact(
+            _request['request'], self.keyjar.get_signing_key('EC'))
+        assert _info['state'] == 'state'
+        assert _info['aud'] == [ISS]
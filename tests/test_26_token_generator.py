@@ -0,0 +1,68 @@
+import os
+import string
+from collections import Counter
+
+import pytest
+
+from oidcservice import BASECH
+from oidcservice import rndstr
+from oidcservice import unreserved
+from oidcservice.token_generator import TokenGenerator
+
+
+def test_rndstr():
+    _value = rndstr(32)
+    assert len(_value) == 32
+    assert set(_value) <= set(string.ascii_letters + string.digits)
+    assert len(rndstr()) == 16
+
+
+def test_unreserved():
+    _value = unreserved()
+    assert len(_value) == 64
+    assert set(_value) <= set(BASECH)
+
+
+def test_unique():
+    assert len({rndstr(32) for _ in range(10000)}) == 10000
+
+
+def test_larger_than_buffer():
+    _generator = TokenGenerator('ab', buffer_size=16)
+    _value = _generator(1000)
+    assert len(_value) == 1000
+    assert set(_value) == {'a', 'b'}
+
+
+def test_uniform():
+    # 66 characters, bytes from 198 and up are thrown away
+    _generator = TokenGenerator(BASECH)
+    _counts = Counter(_generator(66 * 2000))
+    assert set(_counts) == set(BASECH)
+    # Without throwing bytes away the first 58 characters would be 4/3 as
+    # likely as the rest
+    assert max(_counts.values()) < 2000 * 1.15
+    assert min(_counts.values()) > 2000 * 0.85
+
+
+@pytest.mark.parametrize('alphabet', ['', 'aa', 'x' * 257])
+def test_bad_alphabet(alphabet):
+    with pytest.raises(ValueError):
+        TokenGenerator(alphabet)
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='no fork')
+def test_fork():
+    _generator = TokenGenerator(string.ascii_letters)
+    _generator(1)
+    _read, _write = os.pipe()
+    _pid = os.fork()
+    if _pid == 0:
+        os.write(_write, _generator(32).encode('ascii'))
+        os._exit(0)
+    os.waitpid(_pid, 0)
+    _child = os.read(_read, 32).decode('ascii')
+    os.close(_read)
+    os.close(_write)
+    assert len(_child) == 32
+    assert _child != _generator(32)